@@ -31,7 +31,7 @@ async def main():
         await interface.exit_program(error)
     finally:
         if agent:
-            await agent.mcp_host.cleanup()
+            await agent.shutdown()
 
 # Run the main function
 try:
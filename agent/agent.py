@@ -2,12 +2,18 @@
 
 from __future__ import annotations
 
+import asyncio
 import atexit
+import json
 import logging
+import pathlib
+import time
 import uuid
+from collections.abc import AsyncIterator, Callable
+from contextlib import aclosing
 from enum import Enum
 from random import randint
-from typing import TypeVar
+from typing import Any, TypeVar
 
 from pynput import keyboard as pynput_keyboard
 
@@ -15,18 +21,27 @@ from agent.interface import Interface
 from agent.llm import get_available_models
 from agent.llm.local import LocalInference
 from agent.llm.prompts import get_available_prompts, load_prompt
+from agent.llm.remote import RemoteInference
 from agent.mcp import MCP_PROMPT
 from agent.mcp.host import MCPHost
 from agent.state import AgentState
-from agent.state_machine import AgentStateMachine
+from agent.state_machine import STATE_MACHINE_CACHE, AgentStateMachine
+from agent.system.compaction import MemoryCompactor
+from agent.system.context import ContextWindow
+from agent.system.hooks import AgentHooks
 from agent.system.interaction import Interaction
 from agent.system.memory import Memory
+from agent.system.session_store import SessionStore
 from agent.system.voice import VoiceBox
 from agent.tools import Tool, ToolCall
 
 logger = logging.getLogger(__name__)
 
 MAX_SUB_STEPS: int = 20
+# stands in for a tool result while the next prompt is prefilled
+PENDING_TOOL_RESULT = "[[pending tool result]]"
+CHECKPOINTS_DIRECTORY = pathlib.Path(__file__).parent / ".cache" / "checkpoints"
+CHECKPOINT_VERSION = 1
 
 T = TypeVar("T")
 
@@ -53,6 +68,7 @@ class Agent:
             return cls(state_string)
 
     state_machine: AgentStateMachine
+    state_machine_fingerprint: str | None = None
     available_states: dict[str, AgentState]
     tools: dict[str, Tool]
 
@@ -61,7 +77,7 @@ class Agent:
         name: str,
         system_prompt_name: str,
         interface: Interface,
-        inference: LocalInference,
+        inference: LocalInference | RemoteInference,
         seed: int | None = None,
         tools: list[Tool] | list[str] | None = None,
         python_interpreter: bool = False,
@@ -70,6 +86,7 @@ class Agent:
         force_planning: bool = True,
         character_max: int | None = None,
         include_pause_button: bool = True,
+        hooks: list[AgentHooks] | None = None,
         **inference_kwargs,
     ):
         """Initialize an agent."""
@@ -78,7 +95,11 @@ class Agent:
         self.name = name
         self.status = Agent.Status.IDLE
         self.step_number = 0
+        self.turn_number = 0
         self.prefill = None
+        self.hooks: list[AgentHooks] = list(hooks or [])
+        self._stop_requested = False
+        self._is_shut_down = False
 
         self.system_prompt_name = system_prompt_name
         self.inference_kwargs = inference_kwargs
@@ -91,6 +112,15 @@ class Agent:
 
         self.inference = inference
         self.interface = interface
+        self.max_buffered_tokens = inference_kwargs.pop("max_buffered_tokens", 32)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        self.compact_tool_catalog = inference_kwargs.pop("compact_tool_catalog", False)
+        self.planning_token_budget = inference_kwargs.pop("planning_token_budget", 0)
+        self.parallel_tool_calls = inference_kwargs.pop("parallel_tool_calls", False)
+        self.tool_call_timeout = inference_kwargs.pop("tool_call_timeout", 0)
+        self.overlap_prefill = inference_kwargs.pop("overlap_prefill", True)
 
         self.tools: dict[str, Tool] = {}
         for tool in tools or Tool.load():
@@ -98,12 +128,61 @@ class Agent:
                 self.tools[tool.name] = tool
             elif isinstance(tool, str):
                 self.tools[tool] = Tool.load(file_name=tool)[0]
-
-        self.memory = Memory()
+        if not self.compact_tool_catalog:
+            # full schemas are already in the system prompt
+            self.tools.pop("describe_tool", None)
+
+        self.persist_session = inference_kwargs.pop("persist_session", False)
+        session_store = SessionStore(self.name) if self.persist_session else None
+        resumed = session_store is not None and session_store.exists()
+        if session_store is not None and resumed:
+            self.memory = Memory.from_store(session_store)
+        else:
+            self.memory = Memory(store=session_store)
+        context_window_tokens = inference_kwargs.pop("context_window_tokens", 0)
+        context_policy = inference_kwargs.pop("context_policy", "sliding_window")
+        context_low_water_ratio = inference_kwargs.pop("context_low_water_ratio", 0.5)
+        context_keep_last_turns = inference_kwargs.pop("context_keep_last_turns", 8)
+        self.context_window = (
+            ContextWindow(
+                self.memory,
+                self.inference.count_tokens,
+                max_tokens=context_window_tokens,
+                policy=context_policy,
+                low_water_ratio=context_low_water_ratio,
+                keep_last_turns=context_keep_last_turns,
+            )
+            if context_window_tokens
+            else None
+        )
+        compaction_trigger_tokens = inference_kwargs.pop("compaction_trigger_tokens", 0)
+        compaction_keep_recent_turns = inference_kwargs.pop("compaction_keep_recent_turns", 2)
+        if compaction_trigger_tokens and not self.inference.front_end.supports_forking():
+            logger.warning(
+                f"Memory compaction is disabled: the {type(self.inference.front_end).__name__} "
+                "frontend cannot fork an inference session for the summarizer"
+            )
+            compaction_trigger_tokens = 0
+        self.compactor = (
+            MemoryCompactor(
+                self.memory,
+                self.inference,
+                trigger_tokens=compaction_trigger_tokens,
+                keep_recent_turns=compaction_keep_recent_turns,
+            )
+            if compaction_trigger_tokens
+            else None
+        )
         self.enable_voice = inference_kwargs.pop("enable_voice", False)
+        self.persist_state_machines = inference_kwargs.pop("persist_state_machines", False)
         self.voicebox = VoiceBox() if self.enable_voice and VoiceBox.is_downloaded() else None
         self.mcp_host = MCPHost()
         self.configure(set_system_prompt=True)
+        if resumed:
+            self.inference.warm_start(
+                [e.to_dict() for e in self.memory.events.values()],
+                **self.inference_kwargs,
+            )
 
         if include_pause_button:
             # Set up keyboard listener for pause/resume functionality
@@ -122,7 +201,7 @@ class Agent:
             self_ref = weak_self()
             if (
                 self_ref is not None
-                and self_ref.status == Agent.Status.PROCESSING
+                and self_ref.status in (Agent.Status.PROCESSING, Agent.Status.PAUSED)
                 and key == pynput_keyboard.Key.space
             ):
                 self_ref.toggle_pause()
@@ -156,83 +235,288 @@ class Agent:
         ]
 
     def toggle_pause(self):
-        """Toggle the agent's pause state when the spacebar is pressed."""
+        """
+        Toggle the agent's pause state when the spacebar is pressed.
+
+        Called from the keyboard listener's thread; the pause event is updated on the event loop.
+        A paused agent stops consuming tokens, which stalls generation once the stream's buffer fills.
+        """
         if self.status != Agent.Status.PAUSED:
             self.status = Agent.Status.PAUSED
         else:
             self.status = Agent.Status.PROCESSING
+
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._update_pause_event)
+        else:
+            self._update_pause_event()
         logger.info(
             f"Agent {'paused' if self.status == Agent.Status.PAUSED else 'resumed'}"
         )
 
     async def loop(self) -> None:
         """
-        Run the agent within a loop.
+        Run the agent until the user exits or a stop is requested.
 
-        The agent will take action until it reaches the maximum number of sub-steps.
+        Each iteration is one turn: a user message, followed by steps until
+        the agent hands control back or reaches the maximum number of sub-steps.
+        The loop is iterative, so long sessions do not keep earlier turns alive.
         """
-        message = await self.interface.get_input(
-            message="Enter your message [enter to send, Ctrl+C to exit]:",
-            qmark=">",
-            clear_line=True,
-        )
+        self._stop_requested = False
+        while not self._stop_requested:
+            if self.compactor is not None:
+                # summarize old turns while waiting for the user
+                self.compactor.start(**self.inference_kwargs)
+            message = await self.interface.get_input(
+                message="Enter your message [enter to send, Ctrl+C to exit]:",
+                qmark=">",
+                clear_line=True,
+            )
+            if self.compactor is not None:
+                await self.compactor.stop()
+            if message is None:
+                self.status = Agent.Status.STANDBY
+                await self.interface.exit_program()
+                return
+
+            await self.run_turn(message)
+
+    async def run_turn(self, message: Interaction) -> None:
+        """
+        Act on a user message until the agent hands control back.
+
+        Args:
+            message: The user message; empty messages let the agent continue on its own.
+        """
+        self.turn_number += 1
+        turn_number = self.turn_number
         if isinstance(message, Interaction):
             self.status = Agent.Status.PROCESSING
             if message.content:
                 self.memory.append_to_history(message)
                 await self.interface.show_output(message)
-        elif message is None:
-            self.status = Agent.Status.STANDBY
-            await self.interface.exit_program()
-            return
+        await self._run_hooks("on_turn_start", turn_number, message)
 
-        self.step_number = 0
-        while self.can_act:
-            self.step_number += 1
-            self.status = Agent.Status.PROCESSING
-            await self.generate_action()
+        try:
+            self.step_number = 0
+            while self.can_act and not self._stop_requested:
+                self.step_number += 1
+                self.status = Agent.Status.PROCESSING
+                await self._run_hooks("on_step_start", self.step_number)
+                await self.generate_action()
+                await self._run_hooks("on_step_end", self.step_number)
+        finally:
+            # the end of a turn is a stable point to save the conversation's KV cache at
+            self.inference.cache_prompt_prefix(**self.inference_kwargs)
+            await self._run_hooks("on_turn_end", turn_number)
+
+    def request_stop(self) -> None:
+        """
+        Stop the loop once the current step is done. Safe to call from any thread.
+        """
+        self._stop_requested = True
+
+    async def shutdown(self) -> None:
+        """
+        Stop the agent and release its resources.
+
+        Generation in progress is cancelled at its next token,
+        the shutdown hooks run, and the keyboard listener, MCP sessions
+        and the inference server session, if any, are closed.
+        Calling it again has no effect.
+        """
+        if self._is_shut_down:
+            return
+        self._is_shut_down = True
+
+        self.request_stop()
+        self.cancel()
+        if self.compactor is not None:
+            await self.compactor.stop()
+        self.status = Agent.Status.STANDBY
+        await self._run_hooks("on_shutdown")
+
+        if getattr(self, "keyboard_listener", None):
+            self.keyboard_listener.stop()
+            self.keyboard_listener = None
+        await self.mcp_host.cleanup()
+        if isinstance(self.inference, RemoteInference):
+            await self.inference.close()
+        logger.info(f"Agent {self.name} shut down after {self.turn_number} turns")
+
+    def add_hooks(self, hooks: AgentHooks) -> None:
+        """
+        Register lifecycle hooks.
+        """
+        self.hooks.append(hooks)
+
+    async def _run_hooks(self, event: str, *args: Any) -> None:
+        for hooks in self.hooks:
+            try:
+                await getattr(hooks, event)(self, *args)
+            except Exception as e:
+                logger.error(f"{type(hooks).__name__}.{event} failed: {e}")
+
+    def _update_pause_event(self) -> None:
+        if self.status == Agent.Status.PAUSED:
+            self._resumed.clear()
+        else:
+            self._resumed.set()
 
-        await self.loop()
+    def cancel(self) -> None:
+        """
+        Stop the current generation at its next token. Safe to call from any thread.
+        """
+        self.inference.cancel()
 
     async def generate_action(self) -> None:
         """
         Generate an action based on the current state of the agent.
 
-        This method generates an action based on the current state of the agent.
+        With a planning token budget, tokens spent in planning states are counted.
+        Once the budget is exceeded, generation stops at the end of the current planning state,
+        and resumes with an action-only state machine, prefilled with the planning so far.
         """
+        if self.context_window is not None:
+            prompt = self.context_window.prompt()
+            logger.debug(f"Context window stats: {self.context_window.stats}")
+        else:
+            prompt = [e.to_dict() for e in self.memory.events.values()]
+        generated: list[int] = []
+        planning_tokens: dict[str, int] = {}
+        completed_outputs: int | None = None
+        budget_exceeded = False
+
         self.inference.engine.reset()
-        for _ in self.inference.run_inference(
-            prompt=[e.to_dict() for e in self.memory.events.values()],
-            **self.inference_kwargs,
-        ):
-            if live_output := self.inference.engine.get_live_structured_output():
-                self.interface.show_live_output(
-                    self.available_states.get(live_output[0].lower()), live_output[1]
-                )
-            else:
-                self.interface.end_live_output()
+        # closing the stream waits for the inference worker, so the engine is free afterwards
+        async with aclosing(
+            self._stream_inference(
+                prompt,
+                snapshot=self._planning_snapshot if self.planning_token_budget else None,
+                **self.inference_kwargs,
+            )
+        ) as stream:
+            async for token_id, (live_output, outputs) in stream:
+                generated.append(token_id)
+                if not self.planning_token_budget:
+                    continue
+
+                if live_output and live_output[0] in self.state_machine.planning_states:
+                    planning_tokens[live_output[0]] = planning_tokens.get(live_output[0], 0) + 1
+
+                if completed_outputs is None and sum(planning_tokens.values()) > self.planning_token_budget:
+                    completed_outputs = len(outputs)
+                elif completed_outputs is not None:
+                    # stop at the boundary of the planning state that exceeded the budget
+                    if len(outputs) > completed_outputs and outputs[-1][0] in self.state_machine.planning_states:
+                        budget_exceeded = True
+                        break
+
+        if self.planning_token_budget:
+            logger.info(
+                f"Step {self.step_number} planning used {sum(planning_tokens.values())}"
+                f"/{self.planning_token_budget} tokens: {planning_tokens}"
+            )
 
-            if self.status == Agent.Status.PAUSED:
-                # useful for debugging
-                self.interface.end_live_output()
-                breakpoint()
-                self.status = Agent.Status.PROCESSING
+        structured_output = list(self.inference.engine.get_stateful_structured_output())
+        if budget_exceeded:
+            structured_output += await self._force_action(prompt, generated)
 
         self.interface.end_live_output()
-        await self.take_action()
+        await self.take_action(structured_output)
+
+    async def _force_action(self, prompt: list[dict[str, Any]], generated: list[int]) -> list[tuple[str, Any]]:
+        """
+        Generate the action after the planning budget was exceeded.
+
+        The generated planning text is prefilled, so the model continues right after it,
+        while an action-only state machine forces it to act.
+
+        Returns:
+            The structured output of the action.
+        """
+        logger.info("Planning token budget exceeded, forcing an action")
+        action_state_machine, _ = STATE_MACHINE_CACHE.get(
+            persist=self.persist_state_machines,
+            include_planning=False,
+            **self._state_machine_kwargs(),
+        )
+        self.inference.configure(action_state_machine)
+        try:
+            self.inference.engine.reset()
+            prefill = self.inference.front_end.tokenizer.decode(generated)
+            stream = self._stream_inference(prompt, **{**self.inference_kwargs, "prefill": prefill})
+            async with aclosing(stream):
+                async for _ in stream:
+                    pass
+            return list(self.inference.engine.get_stateful_structured_output())
+        finally:
+            self.inference.configure(self.state_machine)
+
+    async def _stream_inference(
+        self,
+        prompt: list[dict[str, Any]],
+        snapshot: Callable[[Any], tuple[Any, list[tuple[str, Any]]]] | None = None,
+        **inference_kwargs,
+    ) -> AsyncIterator[tuple[int, tuple[Any, list[tuple[str, Any]]]]]:
+        """
+        Run inference on the inference worker, showing the live structured output.
+
+        Yields:
+            The generated token ids, with the live structured output and the completed
+            structured outputs after each token (the latter only with a custom snapshot).
+        """
+        self._loop = asyncio.get_running_loop()
+        stream = self.inference.stream_inference(
+            prompt,
+            snapshot=snapshot or self._live_snapshot,
+            max_buffered_tokens=self.max_buffered_tokens,
+            **inference_kwargs,
+        )
+        # closed when this generator is, rather than whenever it is garbage collected
+        async with aclosing(stream):
+            async for token_id, state in stream:
+                live_output = state[0]
+                if live_output:
+                    self.interface.show_live_output(
+                        self.available_states.get(live_output[0].lower()), live_output[1]
+                    )
+                else:
+                    self.interface.end_live_output()
+
+                if self.status == Agent.Status.PAUSED:
+                    self.interface.end_live_output()
+                    await self._resumed.wait()
+
+                yield token_id, state
+
+    @staticmethod
+    def _live_snapshot(engine: Any) -> tuple[Any, list[tuple[str, Any]]]:
+        return engine.get_live_structured_output(), []
+
+    @staticmethod
+    def _planning_snapshot(engine: Any) -> tuple[Any, list[tuple[str, Any]]]:
+        return engine.get_live_structured_output(), list(engine.get_stateful_structured_output())
 
-    async def take_action(self) -> None:
+    async def take_action(self, structured_output: list[tuple[str, Any]] | None = None) -> None:
         """
         Take actions based on an event.
 
         This method handles the event, appends it to the history, and processes
         any tool calls.
+
+        Args:
+            structured_output: The (state, output) pairs to act on.
+                Defaults to the engine's structured output.
         """
+        if structured_output is None:
+            structured_output = list(self.inference.engine.get_stateful_structured_output())
+
         action = Interaction(
             role=Interaction.Role.ASSISTANT,
             name=self.name,
         )
-        for state, output in self.inference.engine.get_stateful_structured_output():
+        for state, output in structured_output:
             agent_state = self.available_states.get(state)
             if not agent_state:
                 logger.warning(f"Unknown state: {state}")
@@ -242,53 +526,120 @@ class Agent:
                 case "scratchpad" | "thinking" | "reasoning" | "inner_monologue":
                     action.content += agent_state.format(output.strip()) + "\n"
 
+                case "tool_call" if isinstance(output, list):
+                    tool_calls = [ToolCall(**call) for call in output]
+                    action.tool_call = [tool_call.to_dict() for tool_call in tool_calls]
+                    self._prefill_next_step(action)
+                    interactions = await self.use_tools(tool_calls)
+                    for interaction in interactions:
+                        await self.interface.show_output(interaction)
+                    action.tool_result = Interaction(
+                        role=Interaction.Role.TOOL,
+                        content="\n\n".join(str(interaction.content) for interaction in interactions),
+                    ).to_dict()
+
                 case "tool_call":
                     tool_call = ToolCall(**output)
+                    action.tool_call = tool_call.to_dict()
+                    self._prefill_next_step(action)
                     interaction = await self.use_tool(tool_call)
                     await self.interface.show_output(interaction)
-                    action.metadata["tool_call"] = tool_call.to_dict()
-                    action.metadata["tool_result"] = interaction.to_dict()
+                    action.tool_result = interaction.to_dict()
 
                 case "python":
                     from agent.system.run_code.run_python_code import run_python_code
 
+                    action.tool_call = agent_state.format(output.strip())
+                    self._prefill_next_step(action)
                     interaction = await run_python_code(self, output)
                     await self.interface.show_output(interaction)
-                    action.metadata["tool_call"] = agent_state.format(output.strip())
-                    action.metadata["tool_result"] = interaction.to_dict()
+                    action.tool_result = interaction.to_dict()
 
                 case "bash":
                     from agent.system.run_code.run_bash_code import run_bash_code
 
+                    action.tool_call = agent_state.format(output.strip())
+                    self._prefill_next_step(action)
                     interaction = await run_bash_code(self, output)
                     await self.interface.show_output(interaction)
-                    action.metadata["tool_call"] = agent_state.format(output.strip())
-                    action.metadata["tool_result"] = interaction.to_dict()
+                    action.tool_result = interaction.to_dict()
 
                 case _:
                     raise ValueError(f"Unknown structured output: {output}")
 
         self.memory.append_to_history(action)
 
+    def _prefill_next_step(self, action: Interaction) -> None:
+        """
+        Start prefilling the next step's prompt while the action's tool runs.
+
+        The next prompt is the history followed by the action and its tool result.
+        Only the result is unknown, so a placeholder stands in for it,
+        and everything before the placeholder is processed in the background.
+        """
+        if not self.overlap_prefill:
+            return
+
+        pending_action = Interaction.from_dict(
+            {
+                **action.to_dict(),
+                "name": action.name,
+                "tool_result": Interaction(role=Interaction.Role.TOOL, content=PENDING_TOOL_RESULT).to_dict(),
+            }
+        )
+        events = {**self.memory.events, pending_action.event_id: pending_action}
+        try:
+            self.inference.prefill(
+                [e.to_dict() for e in events.values()],
+                PENDING_TOOL_RESULT,
+                **self.inference_kwargs,
+            )
+        except Exception as e:
+            logger.error(f"Failed to prefill the next step: {e}")
+
     async def use_tool(self, tool_call: ToolCall) -> Interaction:
         """Use a tool and return results.
 
         Args:
             tool_use: The tool call to use.
         """
+        with self.interface.console.status(f"[yellow]Using {tool_call.name}"):
+            return await self._call_tool(tool_call)
+
+    async def use_tools(self, tool_calls: list[ToolCall]) -> list[Interaction]:
+        """Use several independent tools concurrently.
+
+        Args:
+            tool_calls: The tool calls to use.
+
+        Returns:
+            The results, in the order of the tool calls.
+        """
+        names = ", ".join(tool_call.name for tool_call in tool_calls)
+        with self.interface.console.status(f"[yellow]Using {names}"):
+            start = time.perf_counter()
+            results = await asyncio.gather(*(self._call_tool(tool_call) for tool_call in tool_calls))
+            logger.debug(f"Ran {len(tool_calls)} tool calls in {time.perf_counter() - start:.2f}s")
+        return list(results)
+
+    async def _call_tool(self, tool_call: ToolCall) -> Interaction:
         try:
             tool = self.tools[tool_call.name]
-            with self.interface.console.status(f"[yellow]Using {tool_call.name}"):
-                if not tool.mcp_server:
-                    result = await tool.call(self, **tool_call.arguments or {})
-                    assert isinstance(result, Interaction)
-                else:
-                    result = await self.mcp_host.use_tool(
-                        tool.mcp_server,
-                        tool_call,
-                    )
+            if not tool.mcp_server:
+                call = tool.call(self, **tool_call.arguments or {})
+            else:
+                call = self.mcp_host.use_tool(tool.mcp_server, tool_call)
 
+            result = await asyncio.wait_for(call, timeout=self.tool_call_timeout or None)
+            if not tool.mcp_server:
+                assert isinstance(result, Interaction)
             return result
+        except TimeoutError:
+            self.status = Agent.Status.FAILED
+            return Interaction(
+                role=Interaction.Role.TOOL,
+                content=f"Tool call failed: {tool_call.name} timed out after {self.tool_call_timeout}s",
+            )
         except Exception as e:
             self.status = Agent.Status.FAILED
             return Interaction(
@@ -296,6 +647,74 @@ class Agent:
                 content=f"Tool call failed: {e}",
             )
 
+    def checkpoint(
+        self,
+        file_path: str | pathlib.Path | None = None,
+        release: bool = False,
+    ) -> pathlib.Path:
+        """
+        Save the session to a single file, to be restored later.
+
+        The file is the frontend's KV cache file, with the processed token ids,
+        the memory and the agent's status and counters stored in its metadata.
+        Checkpoints are taken between steps; the structuring engine is reset on restore.
+
+        Args:
+            file_path: The checkpoint file. Defaults to `.cache/checkpoints/<name>.safetensors`.
+            release: Whether to drop the KV cache afterwards, freeing the model for other sessions.
+
+        Returns:
+            The path of the checkpoint file.
+        """
+        path = pathlib.Path(file_path or CHECKPOINTS_DIRECTORY / f"{self.name}.safetensors")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "name": self.name,
+            "status": str(self.status),
+            "step_number": self.step_number,
+            "turn_number": self.turn_number,
+            "seed": self.seed,
+            "state_machine_fingerprint": self.state_machine_fingerprint,
+            "system_prompt_id": self.memory.system_prompt.event_id if self.memory.system_prompt else None,
+            "events": self.memory.serialize(),
+        }
+        start = time.perf_counter()
+        self.inference.save_checkpoint(str(path), {"agent_checkpoint": json.dumps(state, default=str)})
+        logger.info(
+            f"Checkpointed {len(state['events'])} events to {path} in {time.perf_counter() - start:.2f}s"
+        )
+        if release:
+            self.inference.release_cache()
+        return path
+
+    def restore(self, file_path: str | pathlib.Path | None = None) -> None:
+        """
+        Restore a session saved with `checkpoint`.
+
+        Args:
+            file_path: The checkpoint file. Defaults to `.cache/checkpoints/<name>.safetensors`.
+        """
+        path = pathlib.Path(file_path or CHECKPOINTS_DIRECTORY / f"{self.name}.safetensors")
+        metadata = self.inference.load_checkpoint(str(path))
+        if "agent_checkpoint" not in metadata:
+            raise ValueError(f"{path} is not an agent checkpoint")
+
+        state = json.loads(metadata["agent_checkpoint"])
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {state.get('version')}")
+        if state["state_machine_fingerprint"] != self.state_machine_fingerprint:
+            logger.warning("The agent's tools or options changed since the checkpoint was taken")
+
+        self.memory.restore(state["events"], state["system_prompt_id"])
+        self.status = Agent.Status.from_string(state["status"])
+        self.step_number = state["step_number"]
+        self.turn_number = state["turn_number"]
+        self.seed = state["seed"]
+        self.inference_kwargs["seed"] = self.seed
+        self.inference.engine.reset()
+        self._update_pause_event()
+
     def add_tools(
         self,
         new_tools: list[Tool],
@@ -303,24 +722,63 @@ class Agent:
     ):
         """
         Add new tools to the agent.
+
+        Tool schemas are compiled once per schema, so only the new tools' schemas
+        are compiled; see `benchmarks/tool_registration.py`.
         """
         self.tools.update({tool.name: tool for tool in new_tools})
         self.configure(reset_system_prompt)
 
+    def remove_tools(
+        self,
+        tool_names: list[str],
+        reset_system_prompt: bool = False,
+    ):
+        """
+        Remove tools from the agent.
+        """
+        for tool_name in tool_names:
+            self.tools.pop(tool_name, None)
+        self.configure(reset_system_prompt)
+
     def configure(self, set_system_prompt: bool = False):
-        self.state_machine = AgentStateMachine(
-            tools=list(self.tools.values()),
-            use_python=self.python_interpreter,
-            use_bash=self.bash_interpreter,
-            max_planning_loops=self.max_planning_loops,
-            force_planning=self.force_planning,
-            delimiters_kwargs=self.inference.front_end.tokenizer.delimiters,
-            character_max=self.character_max,
+        """
+        Configure the engine with the state machine for the agent's tools and options.
+
+        State machines are memoized by a fingerprint of their options,
+        and the engine is only reconfigured when the fingerprint changes.
+        """
+        state_machine, fingerprint = STATE_MACHINE_CACHE.get(
+            persist=self.persist_state_machines,
+            **self._state_machine_kwargs(),
         )
-        self.available_states = self.state_machine.states
-        self.inference.engine.configure(self.state_machine)
+        if fingerprint != self.state_machine_fingerprint:
+            self.state_machine = state_machine
+            self.state_machine_fingerprint = fingerprint
+            self.available_states = self.state_machine.states
+            self.inference.configure(self.state_machine)
+
         if set_system_prompt:
-            self.memory.update_system_prompt(self.system_prompt)
+            system_prompt = self.system_prompt
+            self.memory.update_system_prompt(system_prompt)
+            num_tokens = len(self.inference.front_end.tokenizer.encode(system_prompt.content))
+            logger.info(
+                f"System prompt is {num_tokens} tokens with {len(self.tools)} tools"
+                f"{' (compact tool catalog)' if self.compact_tool_catalog else ''}"
+            )
+
+    def _state_machine_kwargs(self) -> dict[str, Any]:
+        return {
+            "tools": list(self.tools.values()),
+            "use_python": self.python_interpreter,
+            "use_bash": self.bash_interpreter,
+            "max_planning_loops": self.max_planning_loops,
+            "force_planning": self.force_planning,
+            "delimiters_kwargs": self.inference.front_end.tokenizer.delimiters,
+            "character_max": self.character_max,
+            "compact_tool_catalog": self.compact_tool_catalog,
+            "parallel_tool_calls": self.parallel_tool_calls,
+        }
 
     @staticmethod
     async def get_agent_name(interface: Interface) -> str:
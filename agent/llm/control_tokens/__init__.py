@@ -60,6 +60,7 @@ class ControlTokens(BaseModel):
             "scratchpad": self.scratchpad_delimiters,
             "thinking": self.thinking_delimiters,
             "tool_call": self.tool_use_delimiters,
+            "tool_calls": self.tool_calls_delimiters,
             "tool_list": self.tool_list_delimiters,
             "tool_result": self.tool_result_delimiters,
             "tool_results": self.tool_results_delimiters,
@@ -178,6 +179,17 @@ class ControlTokens(BaseModel):
             return self.tool_call_start, self.tool_call_end
         return None
 
+    @property
+    def tool_calls_delimiters(self) -> tuple[str, str] | None:
+        """Returns the delimiter pair around a list of tool calls if defined.
+
+        Returns:
+            A tuple of start and end delimiters, or None if not defined.
+        """
+        if self.tool_calls_start and self.tool_calls_end:
+            return self.tool_calls_start, self.tool_calls_end
+        return None
+
 
 def get_control_tokens(model_path: str, tokenizer_config: dict) -> ControlTokens:
     """Get the control tokens for the model."""
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from typing import Any
+
+from agent.llm.tokenizer import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalEncoder:
+    """
+    Encodes a conversation one interaction at a time.
+
+    Re-rendering the chat template and re-tokenizing the entire history on every
+    step makes prompt preparation grow with the length of the session.
+    This encoder renders each interaction as its own template segment, keeps the
+    resulting token ids keyed by the interaction's `event_id`, and only renders
+    interactions that are new or whose content changed since the last call.
+
+    The encoded prompt is the concatenation of:
+        begin_of_text + interaction segments + generation prompt (and prefill)
+    """
+
+    def __init__(self, tokenizer: Tokenizer, verify: bool = False) -> None:
+        """
+        Args:
+            tokenizer: The tokenizer used to render and encode segments.
+            verify: If True, every incremental encoding is cross-checked against
+                a full re-render of the conversation.
+        """
+        self.tokenizer = tokenizer
+        self.verify = verify
+        self._segments: dict[str, tuple[str, list[int]]] = {}
+        self._frames: dict[str, list[int]] = {}
+        self.last_encode_time: float = 0.0
+        self.last_encoded_segments: int = 0
+
+    def encode(self, interactions: list[dict[str, Any]], **kwargs) -> list[int]:
+        """
+        Encode a list of interaction dictionaries into token ids.
+
+        Args:
+            interactions: The conversation, as produced by `Interaction.to_dict`.
+            **kwargs: Template variables (control tokens, prefill, etc.).
+
+        Returns:
+            The token ids of the fully templated prompt.
+        """
+        tic = time.perf_counter()
+        seen: set[str] = set()
+        encoded_segments = 0
+
+        token_ids = list(self._frame("header", kwargs))
+        for interaction in interactions:
+            event_id = interaction.get("event_id")
+            if event_id is None:
+                return self.tokenizer.encode(interactions, **kwargs)
+
+            seen.add(event_id)
+            fingerprint = self._fingerprint(interaction)
+            cached = self._segments.get(event_id)
+            if cached is None or cached[0] != fingerprint:
+                segment = self._encode_segment(interaction, kwargs)
+                self._segments[event_id] = (fingerprint, segment)
+                encoded_segments += 1
+            else:
+                segment = cached[1]
+            token_ids.extend(segment)
+        token_ids.extend(self._frame("footer", kwargs))
+
+        # forget interactions that are no longer part of the conversation
+        for event_id in self._segments.keys() - seen:
+            del self._segments[event_id]
+
+        self.last_encode_time = time.perf_counter() - tic
+        self.last_encoded_segments = encoded_segments
+        logger.debug(
+            f"Encoded {len(token_ids)} prompt tokens in {self.last_encode_time * 1000:.2f}ms "
+            f"({encoded_segments}/{len(interactions)} interactions rendered)"
+        )
+
+        if self.verify:
+            full_encoding = self.tokenizer.encode(interactions, **kwargs)
+            if full_encoding != token_ids:
+                logger.warning(
+                    "Incremental encoding diverged from the full render, "
+                    "falling back to the full encoding."
+                )
+                self.reset()
+                return full_encoding
+
+        return token_ids
+
+    def segment_length(self, event_id: str) -> int | None:
+        """
+        Get the number of tokens of an already encoded interaction.
+
+        Args:
+            event_id: The interaction's event id.
+
+        Returns:
+            The token count, or None if the interaction has not been encoded.
+        """
+        if cached := self._segments.get(event_id):
+            return len(cached[1])
+        return None
+
+    def reset(self) -> None:
+        """
+        Forget all encoded segments.
+        """
+        self._segments.clear()
+        self._frames.clear()
+
+    def _encode_segment(self, interaction: dict[str, Any], kwargs: dict[str, Any]) -> list[int]:
+        """
+        Render and tokenize a single interaction without the surrounding frame.
+        """
+        if not interaction:
+            return []
+        return self.tokenizer.encode(
+            [interaction],
+            **{
+                **kwargs,
+                "omit_begin_of_text": True,
+                "omit_generation_prompt": True,
+            },
+        )
+
+    def _frame(self, part: str, kwargs: dict[str, Any]) -> list[int]:
+        """
+        Get the tokens surrounding the interactions.
+
+        The header is the begin-of-text marker, the footer is the generation prompt
+        followed by an optional prefill. Both only depend on the template variables.
+        """
+        key = f"{part}:{self._fingerprint(kwargs)}"
+        if key not in self._frames:
+            frame_kwargs = {
+                **kwargs,
+                "omit_begin_of_text": part != "header",
+                "omit_generation_prompt": part != "footer",
+            }
+            rendered = self.tokenizer.render([], **frame_kwargs)
+            self._frames[key] = (
+                self.tokenizer.encode(rendered, add_special_tokens=False) if rendered else []
+            )
+        return self._frames[key]
+
+    @staticmethod
+    def _fingerprint(value: Any) -> str:
+        serialized = json.dumps(value, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode()).hexdigest()
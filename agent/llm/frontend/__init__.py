@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import copy
+import json
+import struct
 from abc import ABC, abstractmethod
-from collections.abc import Iterator
+from collections.abc import Iterator, Mapping
+from types import MappingProxyType
 from typing import Any, TypeVar
 
 from pse.structuring_engine import StructuringEngine
 
 from agent.llm.tokenizer import Tokenizer
+from agent.llm.vocabulary import VocabularyMasks
 
 T = TypeVar("T")
 
@@ -19,23 +24,62 @@ class Frontend(ABC):
     tokenizer: Tokenizer
     cache: list[Any]
     processed_token_ids: list[int]
+    vocabulary_masks: VocabularyMasks | None = None
+    start_delimiters: tuple[str, ...] = ()
+    freeform_states: Mapping[str, tuple[str, int, int]] = MappingProxyType({})
 
     @staticmethod
-    def from_path(model_path: str, frontend: str | None = "mlx") -> Frontend:
+    def from_path(model_path: str, frontend: str | None = "mlx", **kwargs: Any) -> Frontend:
         if frontend == "mlx":
             from agent.llm.frontend.mlx import MLXInference
 
-            return MLXInference(model_path)
+            return MLXInference(model_path, **kwargs)
         elif frontend == "torch":
             from agent.llm.frontend.torch import TorchInference
 
-            return TorchInference(model_path)
+            return TorchInference(model_path, **kwargs)
         else:
             raise ValueError(f"Invalid front-end type: {frontend!r}")
 
     def supports_reusing_prompt_cache(self) -> bool:
         return False
 
+    def supports_forking(self) -> bool:
+        return True
+
+    def fork(self) -> Frontend:
+        """
+        Create a frontend sharing the loaded model and tokenizer, with its own KV cache.
+
+        Forks let several sessions generate with one copy of the model weights,
+        as long as their inference calls do not run concurrently.
+        """
+        fork = copy.copy(self)
+        fork.reset_cache()
+        return fork
+
+    def reset_cache(self) -> None:
+        """
+        Drop the KV cache and the processed token ids, so the next inference call starts anew.
+        """
+        self.cache = []
+        self.processed_token_ids = []
+
+    def prefill(self, token_ids: list[int], **kwargs: Any) -> int:
+        """
+        Process prompt tokens into the KV cache ahead of the next inference call.
+
+        Front-ends that cannot reuse their cache across calls ignore this.
+
+        Args:
+            token_ids (list[int]): A prefix of the next prompt.
+            **kwargs: The inference keyword arguments of the next call.
+
+        Returns:
+            int: The number of tokens that were processed.
+        """
+        return 0
+
     @abstractmethod
     def inference(self, prompt: list[int], engine: StructuringEngine, **kwargs: Any) -> Iterator[Any]:
         pass
@@ -54,12 +98,36 @@ class Frontend(ABC):
         pass
 
     @abstractmethod
-    def save_cache_to_file(self, file_path: str, computed_ids: list[int]) -> None:
+    def save_cache_to_file(
+        self,
+        file_path: str,
+        computed_ids: list[int],
+        metadata: dict[str, str] | None = None,
+    ) -> None:
         """
         Save a KV cache to a file.
 
         Args:
             file_path (str): Path to the cache file.
             computed_ids (list[int]): The token IDs that have been processed.
+            metadata (dict[str, str] | None): Additional metadata stored with the cache.
         """
         pass
+
+    @staticmethod
+    def read_cache_metadata(file_path: str) -> dict[str, str]:
+        """
+        Read the metadata of a cache file without loading its tensors.
+
+        Cache files are safetensors files, which start with the size of their JSON header.
+
+        Args:
+            file_path (str): Path to the cache file.
+
+        Returns:
+            dict[str, str]: The metadata stored with the cache.
+        """
+        with open(file_path, "rb") as f:
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+        return header.get("__metadata__", {})
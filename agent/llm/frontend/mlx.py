@@ -1,9 +1,11 @@
 import json
 import logging
+import time
 from collections.abc import Callable, Iterator
 from typing import Any
 
 import mlx.core as mx
+import numpy as np
 from mlx_proxy.cache import BaseCache
 from mlx_proxy.generate_step import generate_step
 from mlx_proxy.samplers import make_sampler
@@ -11,22 +13,42 @@ from mlx_proxy.utils import load_model, set_max_reccomended_device_limit
 from pse.structuring_engine import StructuringEngine
 
 from agent.llm.frontend import Frontend
+from agent.llm.prompt_lookup import DEFAULT_MAX_NGRAM_SIZE, PromptLookup
+from agent.llm.radix_cache import RadixCache, common_prefix_length
 from agent.llm.tokenizer import Tokenizer
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_RADIX_CACHE_BYTES = 4 * 1024**3
+DEFAULT_NUM_DRAFT_TOKENS = 4
+PREFILL_STEP_SIZE = 2048
+MAX_BOUNDARY_TEXT_LENGTH = 256
+# characters kept clear of a freeform state's maximum, where the mask depends on the length
+FREEFORM_LENGTH_MARGIN = 128
+
+KVSegment = list[tuple[mx.array, mx.array]]
+
 
 class MLXInference(Frontend):
     """
     Front-end for MLX models.
     """
 
-    def __init__(self, model_path: str):
+    def __init__(
+        self,
+        model_path: str,
+        draft_model_path: str | None = None,
+        radix_cache_max_bytes: int = DEFAULT_RADIX_CACHE_BYTES,
+    ):
         """
         Initialize the MLXFrontEnd.
 
         Args:
             model_path (str): The path to the model.
+            draft_model_path (str | None): Path to a smaller model sharing the tokenizer,
+                used to propose tokens for speculative decoding.
+            radix_cache_max_bytes (int): Memory cap for previously computed KV branches.
+                Set to 0 to disable the radix cache.
         """
         set_max_reccomended_device_limit()
         self.model, _ = load_model(model_path)
@@ -34,6 +56,26 @@ class MLXInference(Frontend):
         self.cache: list[BaseCache] = []
         self.processed_token_ids = []
 
+        self.draft_model = load_model(draft_model_path)[0] if draft_model_path else None
+        self.draft_cache: list[BaseCache] = []
+        self.draft_token_ids: list[int] = []
+        self.prompt_lookup = PromptLookup()
+        self.speculative_stats: dict[str, dict[str, dict[str, int]]] = {}
+        self.decode_stats: dict[str, float] = {}
+        self._boundary_text: str | None = None
+        self._delimiter_masks: dict[tuple[str, tuple[str, ...]], mx.array | None] = {}
+        self._state_masks: dict[tuple[str, str], mx.array] = {}
+        self._vectorized_mask = False
+        self.radix_cache: RadixCache[KVSegment] | None = (
+            RadixCache(
+                split_segment=_split_segment,
+                size_of=_segment_nbytes,
+                max_size=radix_cache_max_bytes,
+            )
+            if radix_cache_max_bytes > 0
+            else None
+        )
+
     def inference(
         self,
         prompt: list[int],
@@ -58,6 +100,38 @@ class MLXInference(Frontend):
                 reusable=kwargs.get("reuse_prompt_cache", False),
             )
 
+        if kwargs.get("reuse_prompt_cache", False) and not kwargs.get("max_kv_size"):
+            self._resume_from_radix_cache(prompt)
+
+        speculative = (
+            self.draft_model is not None and kwargs.get("num_draft_tokens", DEFAULT_NUM_DRAFT_TOKENS) > 0
+        ) or kwargs.get("prompt_lookup_tokens", 0) > 0
+        # only generate_step trims the rotating cache of max_kv_size
+        custom_loop = not kwargs.get("max_kv_size") and (
+            speculative
+            or kwargs.get("fast_forward_forced_tokens", False)
+            or kwargs.get("vectorized_logits_mask", False)
+        )
+        if custom_loop:
+            yield from self._structured_decode(prompt, engine, **kwargs)
+            saved = self.decode_stats["forced_tokens"]
+            generated = self.decode_stats["generated_tokens"]
+            seconds = self.decode_stats["seconds"]
+            logger.debug(
+                f"Decoded {generated} tokens with {self.decode_stats['forward_passes']} forward passes "
+                f"({generated / seconds if seconds else 0:.1f} tokens/sec), "
+                f"fast-forwarded {saved} forced tokens ({saved} forward passes saved)"
+            )
+            if self._vectorized_mask:
+                logger.debug(
+                    f"Reused memoized masks for {self.decode_stats['mask_hits']} tokens, "
+                    f"computed {self.decode_stats['mask_misses']}"
+                )
+            if speculative:
+                logger.debug(f"Speculative decoding acceptance rates: {self.acceptance_rates}")
+            return
+
+        stop_tokens = self.tokenizer.stop_tokens
         for generated_tokens, _ in generate_step(
             prompt=prompt,
             model=self.model,
@@ -73,7 +147,7 @@ class MLXInference(Frontend):
             tokens = generated_tokens.tolist()
             assert isinstance(tokens, list)
             for token_id in tokens:
-                if token_id in self.tokenizer.stop_tokens:
+                if token_id in stop_tokens:
                     break
                 yield token_id
 
@@ -86,21 +160,517 @@ class MLXInference(Frontend):
         If structured is True, use the structured sampler.
         Otherwise, use the simple sampler.
         """
+        sampler = self._make_base_sampler(**kwargs)
+        return lambda x: engine.sample(x, sampler)
+
+    def _make_base_sampler(self, **kwargs) -> Callable[..., Any]:
+        """
+        Return the sampler used by the engine to pick tokens from the masked logits.
+        """
         temp = float(kwargs.get("temp", 1.0))
         min_p = float(kwargs.get("min_p", 0.0))
         min_tokens_to_keep = int(kwargs.get("min_tokens_to_keep", 1))
-        sampler = make_sampler(
+        return make_sampler(
             temp=temp,
             min_p=min_p,
             min_tokens_to_keep=min_tokens_to_keep
         )
-        return lambda x: engine.sample(x, sampler)
+
+    def _structured_decode(
+        self,
+        prompt: list[int],
+        engine: StructuringEngine,
+        **kwargs,
+    ) -> Iterator[int]:
+        """
+        Generate token ids with a decode loop that can process several tokens per forward pass.
+
+        Two optimizations share this loop:
+        - Forced tokens: when the engine allows exactly one continuation, the token is
+          appended without sampling from the model, and the whole forced span is processed
+          in the next forward pass instead of one forward pass per token.
+        - Speculative decoding: up to `prompt_lookup_tokens` tokens are proposed by matching
+          the latest n-gram against the prompt and generated tokens, otherwise the draft model
+          greedily proposes `num_draft_tokens` tokens. The main model scores all proposals
+          in the same forward pass. Each proposal is verified in order by sampling from
+          the main model's logits through the engine: it is accepted if the engine samples
+          exactly that token, otherwise the sampled token replaces it and the remaining
+          proposals are discarded.
+
+        Output therefore always follows the main model and the engine's constraints.
+        The loop is not used with `max_kv_size`, whose rotating cache only `generate_step` trims.
+
+        While the start delimiter of a state is being generated, the engine only masks the
+        logits left by the precomputed vocabulary masks, see `_delimiter_mask`.
+        With `vectorized_logits_mask`, the engine's dense masks inside freeform states are
+        memoized by state fingerprint, see `_state_mask`.
+        """
+        sampler = self._make_base_sampler(**kwargs)
+        max_tokens = kwargs.get("max_tokens", 1000)
+        num_draft_tokens = kwargs.get("num_draft_tokens", DEFAULT_NUM_DRAFT_TOKENS)
+        prompt_lookup_tokens = kwargs.get("prompt_lookup_tokens", 0)
+        fast_forward = kwargs.get("fast_forward_forced_tokens", False)
+        self.decode_stats = {
+            "forward_passes": 1,
+            "forced_tokens": 0,
+            "generated_tokens": 0,
+            "seconds": 0.0,
+            "mask_hits": 0,
+            "mask_misses": 0,
+        }
+        self._vectorized_mask = kwargs.get("vectorized_logits_mask", False)
+        self._state_masks = {}
+
+        token_ids = list(prompt)
+        self.prompt_lookup.max_ngram_size = kwargs.get("prompt_lookup_ngram_size", DEFAULT_MAX_NGRAM_SIZE)
+        self.prompt_lookup.reset(token_ids)
+        self._boundary_text = ""
+        logits: mx.array | None = self._prefill(prompt, kwargs.get("reuse_prompt_cache", False))[-1]
+        start = time.perf_counter()
+        try:
+            yield from self._decode_loop(
+                engine,
+                token_ids,
+                logits,
+                sampler,
+                max_tokens,
+                num_draft_tokens,
+                prompt_lookup_tokens,
+                fast_forward,
+            )
+        finally:
+            self.decode_stats["generated_tokens"] = len(token_ids) - len(prompt)
+            self.decode_stats["seconds"] = time.perf_counter() - start
+
+    def _decode_loop(
+        self,
+        engine: StructuringEngine,
+        token_ids: list[int],
+        logits: mx.array | None,
+        sampler: Callable[..., Any],
+        max_tokens: int,
+        num_draft_tokens: int,
+        prompt_lookup_tokens: int,
+        fast_forward: bool,
+    ) -> Iterator[int]:
+        """
+        The decode loop of `_structured_decode`, starting from the logits of the last prompt token.
+
+        Generated tokens are appended to `token_ids`.
+        """
+        stop_tokens = self.tokenizer.stop_tokens
+        assert logits is not None
+        vocab_size = logits.shape[-1]
+        mask: mx.array | None = None
+        pending: list[int] = []
+        generated = 0
+        while generated < max_tokens:
+            if logits is not None:
+                sampled = self._sample(engine, logits, sampler, mask)
+                for token_id in sampled:
+                    if token_id in stop_tokens:
+                        return
+                    yield token_id
+                generated += len(sampled)
+                token_ids.extend(sampled)
+                pending.extend(sampled)
+                if engine.has_reached_accept_state:
+                    return
+
+            mask = None
+            if fast_forward:
+                forced, mask = self._forced_tokens(engine, sampler, vocab_size, max_tokens - generated)
+                for token_id in forced:
+                    if token_id in stop_tokens:
+                        return
+                    yield token_id
+                self.decode_stats["forced_tokens"] += len(forced)
+                generated += len(forced)
+                token_ids.extend(forced)
+                pending.extend(forced)
+                if engine.has_reached_accept_state or generated >= max_tokens:
+                    return
+
+            remaining = max_tokens - generated
+            source = "prompt_lookup"
+            draft = self.prompt_lookup.propose(min(prompt_lookup_tokens, remaining))
+            if not draft:
+                source = "draft_model"
+                draft = self._propose_draft(token_ids, min(num_draft_tokens, remaining))
+            state = self._current_state(engine)
+            outputs = self._forward(self.model, self.cache, pending + draft)
+            self.decode_stats["forward_passes"] += 1
+            offset = len(pending)
+            logits = outputs[offset - 1]
+            pending = []
+            accepted = 0
+            for i, draft_token in enumerate(draft):
+                sampled = self._sample(engine, logits, sampler, mask)
+                mask = None
+                for token_id in sampled:
+                    if token_id in stop_tokens:
+                        self._record_draft(source, state, len(draft), accepted)
+                        return
+                    yield token_id
+                generated += len(sampled)
+                token_ids.extend(sampled)
+
+                if sampled != [draft_token]:
+                    # discard the rejected proposals from the cache
+                    _trim_cache(self.cache, len(draft) - i)
+                    pending = sampled
+                    logits = None
+                    break
+
+                accepted += 1
+                logits = outputs[offset + i]
+                if engine.has_reached_accept_state or generated >= max_tokens:
+                    break
+
+            self._record_draft(source, state, len(draft), accepted)
+            if engine.has_reached_accept_state:
+                return
+
+    def _forced_tokens(
+        self,
+        engine: StructuringEngine,
+        sampler: Callable[..., Any],
+        vocab_size: int,
+        limit: int,
+    ) -> tuple[list[int], mx.array | None]:
+        """
+        Consume the tokens the engine allows as the only possible continuation.
+
+        The engine's mask does not depend on the logits' values, so it is probed with
+        uniform logits without running the model.
+
+        Returns:
+            The forced tokens, and the mask probed for the first non-forced position,
+            which is reused when sampling that position.
+        """
+        forced: list[int] = []
+        uniform = mx.zeros((1, vocab_size))
+        while len(forced) < limit and not engine.has_reached_accept_state:
+            mask = self._state_mask(engine, vocab_size) if self._vectorized_mask else None
+            if mask is None:
+                mask = ~mx.isinf(self._process_logits(engine, uniform))
+            if mx.sum(mask).item() != 1:
+                return forced, mask
+            forced.extend(self._sample(engine, uniform[0], sampler, mask))
+            if forced[-1] in self.tokenizer.stop_tokens:
+                break
+
+        return forced, None
+
+    def _propose_draft(self, token_ids: list[int], num_draft_tokens: int) -> list[int]:
+        """
+        Greedily propose the next tokens with the draft model.
+
+        The draft cache is synchronized with the accepted tokens first,
+        discarding previously rejected proposals.
+        """
+        if self.draft_model is None or num_draft_tokens <= 0:
+            return []
+
+        if not self.draft_cache:
+            self.draft_cache = BaseCache.make_kv_cache(self.draft_model)
+            self.draft_token_ids = []
+
+        reusable = common_prefix_length(self.draft_token_ids, token_ids[:-1])
+        _trim_cache(self.draft_cache, len(self.draft_token_ids) - reusable)
+        self.draft_token_ids = token_ids[:reusable]
+
+        logits = self._forward(self.draft_model, self.draft_cache, token_ids[reusable:])
+        self.draft_token_ids = list(token_ids)
+
+        draft: list[int] = []
+        while True:
+            draft_token = int(mx.argmax(logits[-1]).item())
+            draft.append(draft_token)
+            if len(draft) >= num_draft_tokens:
+                return draft
+            logits = self._forward(self.draft_model, self.draft_cache, [draft_token])
+            self.draft_token_ids.append(draft_token)
+
+    def _record_draft(self, source: str, state: str, proposed: int, accepted: int) -> None:
+        if not proposed:
+            return
+        stats = self.speculative_stats.setdefault(source, {}).setdefault(state, {"proposed": 0, "accepted": 0})
+        stats["proposed"] += proposed
+        stats["accepted"] += accepted
+
+    @property
+    def acceptance_rates(self) -> dict[str, dict[str, float]]:
+        """
+        The fraction of proposed tokens accepted, per proposal source and agent state.
+        """
+        return {
+            source: {
+                state: stats["accepted"] / stats["proposed"]
+                for state, stats in states.items()
+                if stats["proposed"]
+            }
+            for source, states in self.speculative_stats.items()
+        }
+
+    @staticmethod
+    def _current_state(engine: StructuringEngine) -> str:
+        if live_output := engine.get_live_structured_output():
+            return live_output[0]
+        return "unknown"
+
+    def _prefill(self, prompt: list[int], reuse_prompt_cache: bool) -> mx.array:
+        """
+        Process the prompt, reusing the cached prefix shared with the processed tokens.
+
+        Returns:
+            The logits for every prompt token that was processed.
+        """
+        cached = min(len(self.processed_token_ids), self.cache[0].offset) if self.cache else 0
+        reusable = (
+            common_prefix_length(self.processed_token_ids[:cached], prompt[:-1])
+            if reuse_prompt_cache
+            else 0
+        )
+        if self.cache:
+            _trim_cache(self.cache, self.cache[0].offset - reusable)
+        self.processed_token_ids = prompt[:reusable]
+        return self._forward(self.model, self.cache, prompt[reusable:])
+
+    @staticmethod
+    def _forward(model: Any, cache: list[BaseCache], token_ids: list[int]) -> mx.array:
+        """
+        Run the model over the tokens, in chunks, updating the cache.
+
+        Returns:
+            The logits of the last chunk, one row per token.
+        """
+        while len(token_ids) > PREFILL_STEP_SIZE:
+            model(mx.array(token_ids[:PREFILL_STEP_SIZE])[None], cache=cache)
+            mx.eval([c.state for c in cache])
+            token_ids = token_ids[PREFILL_STEP_SIZE:]
+
+        logits = model(mx.array(token_ids)[None], cache=cache)
+        return logits[0]
+
+    def _sample(
+        self,
+        engine: StructuringEngine,
+        logits: mx.array,
+        sampler: Callable[..., Any],
+        mask: mx.array | None = None,
+    ) -> list[int]:
+        """
+        Mask the logits with the engine and sample the next token(s) through it.
+
+        A mask already computed for the current state is applied directly.
+        """
+        if mask is None and self._vectorized_mask:
+            mask = self._state_mask(engine, logits.shape[-1])
+        if mask is not None:
+            logits = mx.where(mask, logits[None], -mx.inf)
+        else:
+            logits = self._process_logits(engine, logits[None])
+        logprobs = logits - mx.logsumexp(logits, axis=-1, keepdims=True)
+        sampled: list[int] = mx.array(engine.sample(logprobs, sampler)).reshape(-1).tolist()  # type: ignore[reportAssignmentType]
+        self._track_boundary(engine, sampled)
+        return sampled
+
+    def _process_logits(self, engine: StructuringEngine, logits: mx.array) -> mx.array:
+        """
+        Mask the logits with the engine, intersected with the delimiter mask if there is one.
+
+        If no token is valid under both masks, the engine's mask alone is used.
+        """
+        delimiter_mask = self._delimiter_mask(logits.shape[-1])
+        if delimiter_mask is not None:
+            masked = engine.process_logits(None, mx.where(delimiter_mask, logits, -mx.inf))
+            if not mx.all(mx.isinf(masked)).item():
+                return masked
+        return engine.process_logits(None, logits)
+
+    def _state_mask(self, engine: StructuringEngine, vocab_size: int) -> mx.array | None:
+        """
+        Get the engine's dense mask inside a freeform state, memoized by state fingerprint.
+
+        Inside a freeform state the valid tokens only depend on how much of the end delimiter
+        was generated, as long as the text is between the state's minimum length and a margin
+        below its maximum. The fingerprint is the state and the pending end delimiter prefix,
+        so the mask is computed once and reused for the rest of a long freeform output.
+        """
+        live_output = engine.get_live_structured_output()
+        if live_output is None or live_output[0] not in self.freeform_states:
+            return None
+
+        state, text = live_output
+        end_delimiter, character_min, character_max = self.freeform_states[state]
+        if not character_min <= len(text) <= character_max - FREEFORM_LENGTH_MARGIN:
+            return None
+
+        pending = next(
+            (end_delimiter[:i] for i in range(len(end_delimiter) - 1, 0, -1) if text.endswith(end_delimiter[:i])),
+            "",
+        )
+        key = (state, pending)
+        if (mask := self._state_masks.get(key)) is not None:
+            self.decode_stats["mask_hits"] += 1
+            return mask
+
+        mask = ~mx.isinf(engine.process_logits(None, mx.zeros((1, vocab_size))))
+        self._state_masks[key] = mask
+        self.decode_stats["mask_misses"] += 1
+        return mask
+
+    def _delimiter_mask(self, vocab_size: int) -> mx.array | None:
+        """
+        Look up the precomputed mask while the start delimiter of a state is being generated.
+
+        The text generated since the last state boundary is tracked by `_track_boundary`.
+        Once it is a proper prefix of exactly one start delimiter, the tokens continuing
+        that delimiter are a row of its precomputed table, which narrows the engine's mask.
+        """
+        if self.vocabulary_masks is None or not self._boundary_text:
+            return None
+
+        key = (self._boundary_text.lstrip(), self.start_delimiters)
+        if len(key[0]) >= max(map(len, self.start_delimiters), default=0):
+            return None
+
+        if key not in self._delimiter_masks:
+            mask = self.vocabulary_masks.continuation_mask(key[0], self.start_delimiters)
+            if mask is not None and mask.any():
+                if len(mask) < vocab_size:
+                    mask = np.pad(mask, (0, vocab_size - len(mask)))
+                self._delimiter_masks[key] = mx.array(mask[:vocab_size])[None]
+            else:
+                self._delimiter_masks[key] = None
+
+        return self._delimiter_masks[key]
+
+    def _track_boundary(self, engine: StructuringEngine, token_ids: list[int]) -> None:
+        """
+        Track the text generated outside of any state, i.e. since the last state boundary.
+        """
+        if self.vocabulary_masks is None:
+            return
+
+        if engine.get_live_structured_output() is not None:
+            self._boundary_text = ""
+        elif self._boundary_text is not None:
+            token_texts = self.vocabulary_masks.token_texts
+            self._boundary_text += "".join(token_texts[t] for t in token_ids if t < len(token_texts))
+            if len(self._boundary_text) > MAX_BOUNDARY_TEXT_LENGTH:
+                self._boundary_text = None
+
+    def _resume_from_radix_cache(self, prompt: list[int]) -> None:
+        """
+        Restore the KV cache of the longest previously computed prefix of the prompt.
+
+        The branch computed so far is inserted into the radix cache first,
+        so that diverging from it does not throw its KV state away.
+        """
+        if self.radix_cache is None:
+            return
+
+        try:
+            computed = min(len(self.processed_token_ids), self.cache[0].offset) if self.cache else 0
+            if computed:
+                self.radix_cache.insert(self.processed_token_ids[:computed], self._extract_segment)
+
+            reusable = common_prefix_length(self.processed_token_ids[:computed], prompt)
+
+            # leave at least one token to process
+            matched, segments = self.radix_cache.match(prompt[:-1])
+            if matched > reusable:
+                self._restore_segments(segments)
+                self.processed_token_ids = prompt[:matched]
+                logger.debug(f"Resumed {matched} tokens from the radix cache")
+
+            logger.debug(f"Radix cache stats: {self.radix_cache.stats}")
+        except Exception as e:
+            logger.error(f"Failed to resume from the radix cache: {e}")
+            self.radix_cache.clear()
+
+    def _extract_segment(self, start: int, end: int) -> KVSegment:
+        """
+        Copy the keys and values of the tokens between two offsets out of the KV cache.
+        """
+        segment = []
+        for layer in self.cache:
+            keys, values = layer.state
+            segment.append(
+                (
+                    mx.contiguous(keys[..., start:end, :]),
+                    mx.contiguous(values[..., start:end, :]),
+                )
+            )
+        mx.eval(segment)
+        return segment
+
+    def _restore_segments(self, segments: list[KVSegment]) -> None:
+        """
+        Replace the KV cache with the concatenation of the given segments.
+        """
+        for i, layer in enumerate(self.cache):
+            keys = mx.concatenate([segment[i][0] for segment in segments], axis=2)
+            values = mx.concatenate([segment[i][1] for segment in segments], axis=2)
+            layer.state = (keys, values)
 
     def supports_reusing_prompt_cache(self) -> bool:
         return True
 
-    def save_cache_to_file(self, file_path: str, computed_ids: list[int]) -> None:
-        metadata = {"computed_ids": json.dumps(computed_ids)}
+    def prefill(self, token_ids: list[int], **kwargs: Any) -> int:
+        """
+        Process prompt tokens into the KV cache ahead of the next inference call.
+
+        The next call then only processes the tokens after the prefix it shares with these.
+        Rotating caches (`max_kv_size`) cannot be trimmed back, so nothing is prefilled for them.
+
+        Returns:
+            The number of tokens that were processed.
+        """
+        if kwargs.get("max_kv_size") or not token_ids:
+            return 0
+
+        if not self.cache:
+            self.cache = BaseCache.make_kv_cache(self.model, reusable=True)
+        self._resume_from_radix_cache(token_ids)
+
+        cached = min(len(self.processed_token_ids), self.cache[0].offset)
+        reusable = common_prefix_length(self.processed_token_ids[:cached], token_ids)
+        _trim_cache(self.cache, self.cache[0].offset - reusable)
+        if reusable < len(token_ids):
+            self._forward(self.model, self.cache, token_ids[reusable:])
+            mx.eval([c.state for c in self.cache])
+        self.processed_token_ids = list(token_ids)
+        return len(token_ids) - reusable
+
+    def fork(self) -> "MLXInference":
+        """
+        Create a frontend sharing the model, draft model and radix cache, with its own KV caches.
+
+        The radix cache only holds KV states computed by the shared model,
+        so forks can resume from branches computed by each other.
+        """
+        fork = super().fork()
+        assert isinstance(fork, MLXInference)
+        fork.draft_cache = []
+        fork.draft_token_ids = []
+        fork.prompt_lookup = PromptLookup(self.prompt_lookup.max_ngram_size)
+        fork.speculative_stats = {}
+        fork.decode_stats = {}
+        fork._boundary_text = None
+        fork._delimiter_masks = {}
+        fork._state_masks = {}
+        return fork
+
+    def save_cache_to_file(
+        self,
+        file_path: str,
+        computed_ids: list[int],
+        metadata: dict[str, str] | None = None,
+    ) -> None:
+        metadata = {**(metadata or {}), "computed_ids": json.dumps(computed_ids)}
         BaseCache.save_cache(file_path, self.cache, metadata)
 
     def load_cache_from_file(self, file_path: str) -> tuple[list[BaseCache], list[int]]:
@@ -113,3 +683,23 @@ class MLXInference(Frontend):
             return cached[0], computed_ids
         else:
             return cached, []
+
+
+def _trim_cache(cache: list[BaseCache], num_tokens: int) -> None:
+    """
+    Remove the last tokens from every layer of a KV cache.
+    """
+    if num_tokens <= 0:
+        return
+    for layer in cache:
+        layer.trim(num_tokens)
+
+
+def _split_segment(segment: KVSegment, offset: int) -> tuple[KVSegment, KVSegment]:
+    head = [(keys[..., :offset, :], values[..., :offset, :]) for keys, values in segment]
+    tail = [(keys[..., offset:, :], values[..., offset:, :]) for keys, values in segment]
+    return head, tail
+
+
+def _segment_nbytes(segment: KVSegment) -> int:
+    return sum(keys.nbytes + values.nbytes for keys, values in segment)
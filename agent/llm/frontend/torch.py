@@ -1,38 +1,156 @@
+import json
+import logging
+import mmap
+import queue
+import struct
 import threading
-from collections.abc import Iterator
+from collections.abc import Callable, Iterator
 from typing import Any
 
 import torch
 from pse.structuring_engine import StructuringEngine
 from pse.util.torch_mixin import PSETorchMixin
-from transformers import LlamaForCausalLM, TextIteratorStreamer
+from safetensors.torch import save_file
+from transformers import (
+    DynamicCache,
+    LlamaForCausalLM,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
+from transformers.generation.streamers import BaseStreamer
 
 from agent.llm.frontend import Frontend
+from agent.llm.radix_cache import common_prefix_length
 from agent.llm.tokenizer import Tokenizer
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_STREAM_QUEUE_SIZE = 64
+SAFETENSORS_DTYPES = {
+    "BOOL": torch.bool,
+    "U8": torch.uint8,
+    "I8": torch.int8,
+    "I16": torch.int16,
+    "I32": torch.int32,
+    "I64": torch.int64,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F32": torch.float32,
+    "F64": torch.float64,
+}
+
 
 class PSE_Torch(PSETorchMixin, LlamaForCausalLM):
     pass
 
 
+class TokenIdStreamer(BaseStreamer):
+    """
+    A streamer handing generated token ids from the generate thread to the consumer.
+
+    The queue between both threads is bounded, so the generate thread blocks
+    when the consumer falls behind. Cancelling the streamer unblocks the generate thread
+    and stops generation at the next decoding step. An error raised by generate
+    ends the stream, and is raised again in the consumer.
+    """
+
+    def __init__(self, engine: StructuringEngine, max_queue_size: int = DEFAULT_STREAM_QUEUE_SIZE) -> None:
+        self.engine = engine
+        self.token_queue: queue.Queue[int | None] = queue.Queue(maxsize=max_queue_size)
+        self.cancelled = threading.Event()
+        self.skip_prompt = True
+        self.error: Exception | None = None
+        self._ended = False
+
+    def run(self, generate: Callable[..., Any], **kwargs: Any) -> None:
+        """
+        Call `generate` on the current thread, ending the stream however it returns.
+        """
+        try:
+            generate(**kwargs)
+        except Exception as e:
+            logger.error(f"Generation failed: {e}")
+            self.error = e
+        finally:
+            self.end()
+
+    def put(self, value: torch.Tensor) -> None:
+        if self.skip_prompt:
+            # the first call receives the prompt
+            self.skip_prompt = False
+            return
+
+        for token_id in value.flatten().tolist():
+            self._enqueue(token_id)
+
+    def end(self) -> None:
+        if not self._ended:
+            self._ended = True
+            self._enqueue(None)
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    @property
+    def should_stop(self) -> bool:
+        return self.cancelled.is_set() or self.engine.has_reached_accept_state
+
+    def _enqueue(self, item: int | None) -> None:
+        while not self.cancelled.is_set():
+            try:
+                self.token_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self) -> Iterator[int]:
+        while (token_id := self.token_queue.get()) is not None:
+            yield token_id
+        if self.error is not None:
+            raise self.error
+
+
+class StreamerStoppingCriteria(StoppingCriteria):
+    """
+    Stops generation once the streamer is cancelled or the engine reached an accept state.
+    """
+
+    def __init__(self, streamer: TokenIdStreamer) -> None:
+        self.streamer = streamer
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full(  # type: ignore[reportReturnType]
+            (input_ids.shape[0],),
+            self.streamer.should_stop,
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
 class TorchInference(Frontend):
     """
     Front-end for PyTorch models.
     """
 
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, draft_model_path: str | None = None):
         """
         Initialize the TorchFrontEnd.
 
         Args:
             model_path (str): The path to the model.
+            draft_model_path (str | None): Unused, speculative decoding is only
+                supported by the MLX frontend.
         """
+        if draft_model_path:
+            logger.warning("Speculative decoding is not supported by the torch frontend, ignoring draft model")
+
         # Load the model from the specified path
         self.model = PSE_Torch.from_pretrained(model_path)
         assert isinstance(self.model, LlamaForCausalLM)
 
         # Initialize tokenizer with appropriate model type
         self.tokenizer = Tokenizer.load(model_path)
+        self.cache: DynamicCache | None = None
         self.processed_token_ids: list[int] = []
         # Configure padding token to match EOS token
         eos_token_id = self.model.config.eos_token_id
@@ -51,53 +169,168 @@ class TorchInference(Frontend):
             else:
                 self.model.generation_config.pad_token_id = self.model.generation_config.pad_token_id
 
-    def inference(self, prompt: list[int], engine: StructuringEngine, **kwargs: Any) -> Iterator[str]:
+    def inference(self, prompt: list[int], engine: StructuringEngine, **kwargs: Any) -> Iterator[int]:
+        """
+        A generator producing token ids based on the given prompt from the model.
+
+        Generation runs on a separate thread, and token ids are handed over through
+        a bounded queue. Closing the generator cancels generation, and an error raised
+        by the model's generate method is raised here.
+
+        Args:
+            prompt (list[int]): The input prompt.
+            engine (StructuringEngine): The engine structuring the output.
+            **kwargs: Keyword arguments for generation.
+        """
         assert isinstance(self.model, PSE_Torch)
         self.model.engine = engine
         if seed := kwargs.get("seed", None):
             torch.random.manual_seed(seed)
 
+        self._prepare_cache(prompt, kwargs.get("reuse_prompt_cache", False))
+
         tensor = torch.tensor(prompt)
         tensor = tensor.unsqueeze(0).to(self.model.device)
 
-        streamer = TextIteratorStreamer(self.tokenizer._tokenizer, skip_prompt=True) # type: ignore [reportArgumentType]
+        stop_tokens = self.tokenizer.stop_tokens
+        streamer = TokenIdStreamer(engine, kwargs.get("stream_queue_size", DEFAULT_STREAM_QUEUE_SIZE))
         generate_kwargs = {
             "inputs": tensor,
             "do_sample": True,
             "streamer": streamer,
+            "stopping_criteria": StoppingCriteriaList([StreamerStoppingCriteria(streamer)]),
+            "past_key_values": self.cache,
+            "eos_token_id": list(stop_tokens) or None,
             "max_new_tokens": kwargs.get("max_tokens", None),
             "top_k": kwargs.get("top_k", 10),
             "top_p": kwargs.get("top_p", None),
             "temperature": kwargs.get("temp", 0.7),
         }
-        thread = threading.Thread(target=self.model.generate, kwargs=generate_kwargs)
+        thread = threading.Thread(target=streamer.run, args=(self.model.generate,), kwargs=generate_kwargs)
         thread.start()
-        yield from streamer
+        try:
+            # the engine runs on the generate thread, which stops once it reaches an accept state;
+            # checking it here could drop tokens that are still queued
+            for token_id in streamer:
+                if token_id in stop_tokens:
+                    break
+                yield token_id
+        finally:
+            streamer.cancel()
+            thread.join()
+
+    def _prepare_cache(self, prompt: list[int], reuse_prompt_cache: bool) -> None:
+        """
+        Keep the part of the KV cache shared with the prompt, or start a new cache.
+
+        At least one prompt token is always left uncached so that generation
+        has an input to compute logits from.
+        """
+        if not reuse_prompt_cache or self.cache is None:
+            self.cache = DynamicCache()
+            self.processed_token_ids = []
+            return
+
+        cached_length = min(self.cache.get_seq_length(), len(self.processed_token_ids))
+        reusable = common_prefix_length(self.processed_token_ids[:cached_length], prompt[:-1])
+
+        self.cache.crop(reusable)
+        self.processed_token_ids = self.processed_token_ids[:reusable]
+        logger.debug(f"Reusing {reusable} cached prompt tokens")
+
+    def supports_reusing_prompt_cache(self) -> bool:
+        return True
+
+    def supports_forking(self) -> bool:
+        return False
+
+    def reset_cache(self) -> None:
+        self.cache = None
+        self.processed_token_ids = []
 
-    def load_cache_from_file(self, file_path: str) -> tuple[list[Any], list[int]]:
+    def fork(self) -> Frontend:
+        """
+        Not supported: the structuring engine is attached to the shared model,
+        and generation runs on a separate thread per call.
+        """
+        raise NotImplementedError("Forking is not supported by the torch frontend")
+
+    def load_cache_from_file(self, file_path: str) -> tuple[Any, list[int]]:
         """
         Load a KV cache from a file.
 
-        PyTorch implementation does not support caching yet.
+        The tensors are memory-mapped from the file rather than read into memory,
+        so pages are only read as the cache is used. Models on another device
+        than the CPU get a copy of the tensors on their device.
 
         Args:
             file_path (str): Path to the cache file.
 
         Returns:
-            tuple[list[Any], list[int]]: Empty lists as PyTorch doesn't support caching yet.
+            tuple[DynamicCache, list[int]]: The loaded cache and the computed token IDs.
         """
-        # Return empty lists as PyTorch doesn't support caching yet
-        return [], []
+        tensors, metadata = _map_safetensors(file_path)
+        num_layers = len({key.split(".")[1] for key in tensors})
+        legacy_cache = tuple(
+            (
+                tensors[f"layers.{i}.keys"].to(self.model.device),
+                tensors[f"layers.{i}.values"].to(self.model.device),
+            )
+            for i in range(num_layers)
+        )
+
+        computed_ids = json.loads(metadata.get("computed_ids", "[]"))
+        assert isinstance(computed_ids, list)
+        return DynamicCache.from_legacy_cache(legacy_cache), computed_ids
 
-    def save_cache_to_file(self, file_path: str, computed_ids: list[int]) -> None:
+    def save_cache_to_file(
+        self,
+        file_path: str,
+        computed_ids: list[int],
+        metadata: dict[str, str] | None = None,
+    ) -> None:
         """
         Save a KV cache to a file.
 
-        PyTorch implementation does not support caching yet.
-
         Args:
             file_path (str): Path to the cache file.
             computed_ids (list[int]): The token IDs that have been processed.
+            metadata (dict[str, str] | None): Additional metadata stored with the cache.
         """
-        # No-op as PyTorch doesn't support caching yet
-        pass
+        tensors = {}
+        for i, (keys, values) in enumerate(self.cache.to_legacy_cache() if self.cache is not None else ()):
+            tensors[f"layers.{i}.keys"] = keys.contiguous()
+            tensors[f"layers.{i}.values"] = values.contiguous()
+
+        save_file(tensors, file_path, metadata={**(metadata or {}), "computed_ids": json.dumps(computed_ids)})
+
+
+def _map_safetensors(file_path: str) -> tuple[dict[str, torch.Tensor], dict[str, str]]:
+    """
+    Memory-map the tensors of a safetensors file.
+
+    The mapping is copy-on-write, so the tensors can be modified without changing the file.
+
+    Returns:
+        The tensors by name, and the metadata of the file.
+    """
+    with open(file_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    (header_size,) = struct.unpack("<Q", mapped[:8])
+    header = json.loads(mapped[8 : 8 + header_size])
+    metadata = header.pop("__metadata__", None) or {}
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if start == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(
+            mapped,
+            dtype=dtype,
+            count=(end - start) // dtype.itemsize,
+            offset=8 + header_size + start,
+        ).reshape(info["shape"])
+    return tensors, metadata
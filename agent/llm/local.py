@@ -1,25 +1,53 @@
-import hashlib
-import json
+from __future__ import annotations
+
+import asyncio
+import copy
 import logging
 import pathlib
-from collections.abc import Iterable
-from typing import Any
+import threading
+import time
+from collections.abc import AsyncIterator, Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
 
 from pse.structuring_engine import StructuringEngine
 
+from agent.llm.encoder import IncrementalEncoder
 from agent.llm.frontend import Frontend
+from agent.llm.prefix_cache import DEFAULT_BLOCK_SIZE, DEFAULT_MAX_BYTES, PrefixCache
+from agent.llm.vocabulary import MASKS_FILE_NAME, VocabularyMasks
 from agent.system.interaction import Interaction
 
+if TYPE_CHECKING:
+    from agent.state_machine import AgentStateMachine
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_MAX_BUFFERED_TOKENS = 32
+_END_OF_STREAM = object()
+
 
 class LocalInference:
-    def __init__(self, model_path: str, frontend: str | None = "mlx"):
+    def __init__(
+        self,
+        model_path: str,
+        frontend: str | None = "mlx",
+        draft_model_path: str | None = None,
+        prompt_cache_max_bytes: int = DEFAULT_MAX_BYTES,
+        prompt_cache_block_size: int = DEFAULT_BLOCK_SIZE,
+        precompute_vocabulary_masks: bool = True,
+    ):
         """
         Initialize the Inference class.
 
         Args:
             model_path (str): Path to the model.
+            frontend (str | None): The inference backend to use.
+            draft_model_path (str | None): Optional draft model for speculative decoding.
+            prompt_cache_max_bytes (int): Disk budget for cached prompt prefixes.
+            prompt_cache_block_size (int): Number of tokens per hashed prefix block.
+            precompute_vocabulary_masks (bool): Whether to precompute the vocabulary masks
+                of the state delimiters, cached on disk per model.
 
         This method sets up the necessary components for inference, including:
         - Loading the model configuration
@@ -27,12 +55,234 @@ class LocalInference:
         - Setting up caches and data structures for efficient inference
         """
         self.model_path = model_path
-        self.front_end = Frontend.from_path(model_path, frontend)
-        self.engine = StructuringEngine(
-            self.front_end.tokenizer._tokenizer,
-            whitelist_control_tokens=self.front_end.tokenizer.whitelist_control_tokens,
-            multi_token_sampling=True,
+        self.front_end = Frontend.from_path(model_path, frontend, draft_model_path=draft_model_path)
+        self.engine = self._make_engine()
+        self.encoder = IncrementalEncoder(self.front_end.tokenizer)
+        model_name = self.model_path.rstrip("/").split("/")[-1]
+        self.cache_directory = self._get_cache_directory() / model_name
+        self.prefix_cache = PrefixCache(
+            self.cache_directory,
+            block_size=prompt_cache_block_size,
+            max_bytes=prompt_cache_max_bytes,
+            namespace=model_name,
         )
+        self.vocabulary_masks = (
+            self._build_vocabulary_masks()
+            if precompute_vocabulary_masks
+            else None
+        )
+        self.front_end.vocabulary_masks = self.vocabulary_masks
+        self.step_timings: dict[str, float] = {}
+        self._prefill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefill")
+        self._pending_prefill: Future[Any] | None = None
+        self._prefix_cached = False
+        self._last_inference_end: float | None = None
+        self._inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self._cancel_inference: threading.Event | None = None
+
+    def configure(self, state_machine: AgentStateMachine) -> None:
+        """
+        Configure the engine with a state machine.
+
+        The start delimiters of its states are handed to the frontend,
+        which masks the logits with precomputed tables while a delimiter is generated,
+        along with the end delimiter and character limits of the freeform states.
+        """
+        self.engine.configure(state_machine)
+        start_delimiters = tuple(state.start_delimiter for state in state_machine.states.values())
+        if self.vocabulary_masks is not None:
+            try:
+                self.vocabulary_masks.add_delimiters(start_delimiters)
+                self.vocabulary_masks.save(self.cache_directory / MASKS_FILE_NAME)
+            except Exception as e:
+                logger.error(f"Failed to update vocabulary masks: {e}")
+        self.front_end.start_delimiters = start_delimiters
+        self.front_end.freeform_states = {
+            state.identifier: (state.delimiters[1], state.character_min, state.character_max)
+            for state in state_machine.states.values()
+            if hasattr(state, "character_min")
+        }
+
+    def fork(self) -> LocalInference:
+        """
+        Create an inference session sharing the loaded model and the prefix cache.
+
+        The fork has its own structuring engine, incremental encoder and KV cache,
+        so it can be configured and prompted independently of this instance.
+        """
+        fork = copy.copy(self)
+        fork.front_end = self.front_end.fork()
+        fork.engine = fork._make_engine()
+        fork.encoder = IncrementalEncoder(fork.front_end.tokenizer)
+        fork.step_timings = {}
+        fork._pending_prefill = None
+        fork._prefix_cached = False
+        fork._last_inference_end = None
+        fork._cancel_inference = None
+        return fork
+
+    def prefill(
+        self,
+        prompt: list[dict[str, Any]],
+        placeholder: str,
+        **inference_kwargs,
+    ) -> None:
+        """
+        Start processing the known part of the next prompt in the background.
+
+        The prompt is the next step's conversation, with `placeholder` standing in for
+        content that is not known yet, such as the result of a running tool.
+        The prompt is encoded and the tokens before the placeholder are prefilled on the
+        prefill worker, after any pending prefill or prefix cache write, so this returns
+        right away and the next inference call only has to process the rest.
+
+        Args:
+            prompt (list[dict[str, Any]]): The next prompt, containing the placeholder.
+            placeholder (str): The text standing in for the unknown content.
+            **inference_kwargs: The keyword arguments of the next inference call.
+        """
+        if not (
+            self.front_end.supports_reusing_prompt_cache()
+            and inference_kwargs.get("reuse_prompt_cache", True)
+        ):
+            return
+
+        previous = self._pending_prefill
+
+        def prefill() -> int:
+            if previous is not None:
+                # a failed prefill is handled by wait_for_prefill
+                previous.result()
+            token_ids = self._tokens_before(self.encode_prompt(prompt, **inference_kwargs), placeholder)
+            if not token_ids:
+                return 0
+            return self._timed_prefill(token_ids, max_kv_size=inference_kwargs.get("max_kv_size"))
+
+        self._pending_prefill = self._prefill_executor.submit(prefill)
+
+    def cache_prompt_prefix(self, **inference_kwargs) -> None:
+        """
+        Save the KV cache of the processed tokens to the prefix cache in the background.
+
+        Meant for stable points of a session, such as the end of a turn, rather than every step:
+        each entry is a full copy of the KV cache. The write runs on the prefill worker after any
+        pending prefill, and the next inference call waits for it, so the cache is not modified
+        while it is written. Entries whose blocks are all cached already are skipped.
+
+        Args:
+            **inference_kwargs: The inference keyword arguments; `cache_system_prompt`
+                and `reuse_prompt_cache` disable the prefix cache.
+        """
+        if not (
+            self.front_end.supports_reusing_prompt_cache()
+            and inference_kwargs.get("cache_system_prompt", True)
+            and inference_kwargs.get("reuse_prompt_cache", True)
+        ):
+            return
+
+        previous = self._pending_prefill
+
+        def write() -> None:
+            if previous is not None:
+                # a failed prefill is handled by wait_for_prefill
+                previous.result()
+            token_ids = list(self.front_end.processed_token_ids)
+            if token_ids and not self.prefix_cache.contains(token_ids):
+                self._cache_prompt_prefix(token_ids)
+
+        self._prefix_cached = True
+        self._pending_prefill = self._prefill_executor.submit(write)
+
+    def warm_start(
+        self,
+        prompt: list[dict[str, Any]],
+        **inference_kwargs,
+    ) -> int:
+        """
+        Load the KV cache of the longest cached prefix of a prompt, e.g. of a resumed session.
+
+        The prompt is encoded so the incremental encoder is ready for the next step,
+        and the prefix cache entry sharing the most blocks with it is attached to the frontend.
+
+        Returns:
+            int: The number of prompt tokens covered by the loaded cache.
+        """
+        encoded_prompt = self.encode_prompt(prompt, **inference_kwargs)
+        if not (
+            self.front_end.supports_reusing_prompt_cache()
+            and inference_kwargs.get("reuse_prompt_cache", True)
+        ):
+            return 0
+
+        self.wait_for_prefill()
+        start = time.perf_counter()
+        self.front_end.reset_cache()
+        self._load_cached_prompt_prefix(encoded_prompt)
+        cached = len(self.front_end.processed_token_ids)
+        logger.info(
+            f"Warm started {cached}/{len(encoded_prompt)} prompt tokens from the prefix cache "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        return cached
+
+    def save_checkpoint(self, file_path: str, metadata: dict[str, str]) -> None:
+        """
+        Save the KV cache and the processed token ids, along with metadata, to a single file.
+
+        Args:
+            file_path (str): Path to the checkpoint file.
+            metadata (dict[str, str]): The caller's state to store with the cache.
+        """
+        self.wait_for_prefill()
+        self.front_end.save_cache_to_file(file_path, list(self.front_end.processed_token_ids), metadata)
+
+    def load_checkpoint(self, file_path: str) -> dict[str, str]:
+        """
+        Replace the KV cache and the processed token ids with those of a checkpoint.
+
+        The metadata is read from the file's header first; the cache tensors are then
+        loaded by the frontend. The torch frontend memory-maps them from the file,
+        the MLX frontend loads them with the MLX cache loader.
+
+        Returns:
+            dict[str, str]: The metadata stored with the cache.
+        """
+        self.wait_for_prefill()
+        start = time.perf_counter()
+        metadata = Frontend.read_cache_metadata(file_path)
+        cache, computed_ids = self.front_end.load_cache_from_file(file_path)
+        self.front_end.cache = cache
+        self.front_end.processed_token_ids = computed_ids
+        logger.info(
+            f"Loaded a checkpoint with {len(computed_ids)} processed tokens "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        return metadata
+
+    def release_cache(self) -> None:
+        """
+        Drop the KV cache, freeing its memory for other sessions.
+        """
+        self.wait_for_prefill()
+        self.front_end.reset_cache()
+
+    def wait_for_prefill(self) -> None:
+        """
+        Wait for a background prefill to finish.
+        """
+        if self._pending_prefill is None:
+            return
+
+        start = time.perf_counter()
+        try:
+            self._pending_prefill.result()
+        except Exception as e:
+            logger.error(f"Background prefill failed: {e}")
+            # the KV cache may be partially updated
+            self.front_end.reset_cache()
+        finally:
+            self._pending_prefill = None
+        self.step_timings["prefill_wait_seconds"] = time.perf_counter() - start
 
     def run_inference(
         self,
@@ -46,12 +296,9 @@ class LocalInference:
             prompt (str | list[dict[str, Any]] | list[Event]): The input prompt for completion.
             **inference_kwargs: Additional keyword arguments to use for inference.
         """
-        tokenizer_config = {
-            "prompt": prompt,
-            **inference_kwargs,
-            **self.front_end.tokenizer.control_tokens.model_dump(),
-        }
-        encoded_prompt = self.front_end.tokenizer.encode(**tokenizer_config)
+        self.wait_for_prefill()
+        self._log_idle_time()
+        encoded_prompt = self.encode_prompt(prompt, **inference_kwargs)
 
         # Try to load from cache first if caching is enabled
         cache_system_prompt = inference_kwargs.get("cache_system_prompt", True)
@@ -63,29 +310,231 @@ class LocalInference:
             and self.front_end.supports_reusing_prompt_cache()
             and not self.front_end.processed_token_ids
         ):
-            # Check if we have a cached prompt
-            self._load_cached_system_prompt(encoded_prompt)
+            # Check if we have a cached prompt prefix
+            self._load_cached_prompt_prefix(encoded_prompt)
 
         logger.info(f"PROMPT:\n{self.front_end.tokenizer.decode(encoded_prompt)}")
-        for n, token_id in enumerate(
-            self.front_end.inference(
-                encoded_prompt,
-                self.engine,
-                **inference_kwargs,
-            )
-        ):
-            yield token_id
-
-            if self.front_end.supports_reusing_prompt_cache():
+        start = time.perf_counter()
+        n = -1
+        try:
+            for n, token_id in enumerate(
+                self.front_end.inference(
+                    encoded_prompt,
+                    self.engine,
+                    **inference_kwargs,
+                )
+            ):
                 if n == 0:
-                    if (
-                        cache_system_prompt
-                        and encoded_prompt[100:] != self.front_end.processed_token_ids[100:]
-                    ):
-                        self._cache_system_prompt(encoded_prompt)
-                    self.front_end.processed_token_ids = encoded_prompt
-                else:
-                    self.front_end.processed_token_ids.append(token_id)
+                    self.step_timings["first_token_seconds"] = time.perf_counter() - start
+                yield token_id
+
+                if self.front_end.supports_reusing_prompt_cache():
+                    if n == 0:
+                        logger.debug(
+                            f"First token after {self.step_timings['first_token_seconds']:.3f}s "
+                            f"for a {len(encoded_prompt)} token prompt"
+                        )
+                        self.front_end.processed_token_ids = encoded_prompt
+                    else:
+                        self.front_end.processed_token_ids.append(token_id)
+        finally:
+            self._last_inference_end = time.perf_counter()
+            if not self._prefix_cached and n >= 0:
+                # the first call of a session covers the system prompt
+                self.cache_prompt_prefix(**inference_kwargs)
+
+    async def stream_inference(
+        self,
+        prompt: str | list[dict[str, Any]] | list[Interaction],
+        snapshot: Callable[[StructuringEngine], Any] | None = None,
+        max_buffered_tokens: int = DEFAULT_MAX_BUFFERED_TOKENS,
+        **inference_kwargs,
+    ) -> AsyncIterator[tuple[int, Any]]:
+        """
+        Generate a completion on a worker thread, streaming the tokens to the event loop.
+
+        The event loop stays free while the model runs. The worker waits whenever
+        `max_buffered_tokens` tokens have not been consumed yet, so a slow consumer
+        pauses generation instead of piling up tokens. Closing or cancelling the stream
+        stops generation at the next token and waits for the worker, so the engine and
+        the KV cache are no longer in use once the stream is closed. Consumers that may stop
+        early should close it explicitly, e.g. with `contextlib.aclosing`, since an abandoned
+        async generator is only closed when it is garbage collected.
+
+        Args:
+            prompt (str | list[dict[str, Any]] | list[Event]): The input prompt for completion.
+            snapshot (Callable[[StructuringEngine], Any] | None): Called with the engine on the
+                worker thread after every token; the result is yielded with the token id.
+                Defaults to the engine's live structured output.
+            max_buffered_tokens (int): The number of tokens generated ahead of the consumer.
+            **inference_kwargs: Additional keyword arguments to use for inference.
+
+        Yields:
+            tuple[int, Any]: The token id and the engine snapshot taken after it.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Any] = asyncio.Queue()
+        capacity = threading.Semaphore(max(1, max_buffered_tokens))
+        cancelled = threading.Event()
+        take_snapshot = snapshot or (lambda engine: engine.get_live_structured_output())
+
+        def put(item: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # the event loop was closed
+                cancelled.set()
+
+        def produce() -> None:
+            try:
+                for token_id in self.run_inference(prompt, **inference_kwargs):
+                    item = (token_id, take_snapshot(self.engine))
+                    while not capacity.acquire(timeout=0.05):
+                        if cancelled.is_set():
+                            return
+                    if cancelled.is_set():
+                        return
+                    put(item)
+            except Exception as e:
+                put(e)
+            finally:
+                put(_END_OF_STREAM)
+
+        self._cancel_inference = cancelled
+        worker = loop.run_in_executor(self._inference_executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                capacity.release()
+                yield item
+                # tokens may already be buffered, let other coroutines run in between
+                await asyncio.sleep(0)
+        finally:
+            cancelled.set()
+            # the engine and the KV cache are in use until the worker returns, even if cancelled again
+            interrupted = False
+            while not worker.done():
+                try:
+                    await asyncio.shield(worker)
+                except asyncio.CancelledError:
+                    interrupted = True
+            if self._cancel_inference is cancelled:
+                self._cancel_inference = None
+            if interrupted:
+                raise asyncio.CancelledError
+
+    def cancel(self) -> None:
+        """
+        Stop the streamed inference at its next token. Safe to call from any thread.
+        """
+        if self._cancel_inference is not None:
+            self._cancel_inference.set()
+
+    def count_tokens(self, interaction: dict[str, Any]) -> int:
+        """
+        Count the prompt tokens of an interaction.
+
+        Interactions that were already encoded are counted exactly,
+        others are estimated from the tokens of their content and tool result.
+        """
+        if (length := self.encoder.segment_length(interaction.get("event_id", ""))) is not None:
+            return length
+
+        text = str(interaction.get("content", ""))
+        if isinstance(tool_result := interaction.get("tool_result"), dict):
+            text += str(tool_result.get("content", ""))
+        if tool_call := interaction.get("tool_call"):
+            text += str(tool_call)
+        return len(self.front_end.tokenizer.encode(text, add_special_tokens=False))
+
+    def encode_prompt(
+        self,
+        prompt: str | list[dict[str, Any]] | list[Interaction],
+        **inference_kwargs,
+    ) -> list[int]:
+        """
+        Encode a prompt into token ids.
+
+        Conversations of interaction dictionaries are encoded incrementally,
+        so that only interactions that were not seen before are rendered and tokenized.
+
+        Args:
+            prompt (str | list[dict[str, Any]] | list[Event]): The input prompt to encode.
+            **inference_kwargs: Additional keyword arguments passed to the chat template.
+                `incremental_encoding` (default True) toggles the incremental encoder,
+                `verify_incremental_encoding` cross-checks it against a full re-render.
+        """
+        template_kwargs = {
+            **inference_kwargs,
+            **self.front_end.tokenizer.control_tokens.model_dump(),
+        }
+        incremental = template_kwargs.pop("incremental_encoding", True)
+        self.encoder.verify = template_kwargs.pop("verify_incremental_encoding", False)
+
+        if incremental and isinstance(prompt, list) and all(isinstance(e, dict) for e in prompt):
+            return self.encoder.encode(prompt, **template_kwargs)  # type: ignore[reportArgumentType]
+
+        return self.front_end.tokenizer.encode(prompt=prompt, **template_kwargs)  # type: ignore[reportArgumentType]
+
+    def _tokens_before(self, token_ids: list[int], placeholder: str) -> list[int]:
+        """
+        Get the tokens of a prompt that precede a placeholder.
+
+        The tokens around the placeholder may merge with it, so the boundary token is dropped too;
+        prefilling a few tokens less only costs a few tokens of the next inference call.
+        """
+        tokenizer = self.front_end.tokenizer
+        if placeholder not in tokenizer.decode(token_ids):
+            return []
+
+        # the shortest prefix whose text contains the placeholder
+        low, high = 0, len(token_ids)
+        while low < high:
+            mid = (low + high) // 2
+            if placeholder in tokenizer.decode(token_ids[:mid]):
+                high = mid
+            else:
+                low = mid + 1
+
+        num_placeholder_tokens = len(tokenizer.encode(placeholder, add_special_tokens=False))
+        return token_ids[: max(0, low - num_placeholder_tokens - 1)]
+
+    def _timed_prefill(self, token_ids: list[int], **kwargs) -> int:
+        start = time.perf_counter()
+        processed = self.front_end.prefill(token_ids, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.step_timings["prefill_seconds"] = elapsed
+        self.step_timings["prefilled_tokens"] = processed
+        logger.debug(f"Prefilled {processed} tokens of the next prompt in the background in {elapsed:.3f}s")
+        return processed
+
+    def _log_idle_time(self) -> None:
+        """
+        Log how long the model sat idle since the previous inference call ended.
+
+        Time spent prefilling in the background while tools ran does not count as idle.
+        """
+        if self._last_inference_end is None:
+            return
+
+        gap = time.perf_counter() - self._last_inference_end
+        overlapped = min(self.step_timings.pop("prefill_seconds", 0.0), gap)
+        self.step_timings["idle_seconds"] = gap - overlapped
+        logger.debug(
+            f"Model idle for {gap - overlapped:.3f}s between steps "
+            f"({overlapped:.3f}s of the {gap:.3f}s gap spent prefilling)"
+        )
+
+    def _make_engine(self) -> StructuringEngine:
+        return StructuringEngine(
+            self.front_end.tokenizer._tokenizer,
+            whitelist_control_tokens=self.front_end.tokenizer.whitelist_control_tokens,
+            multi_token_sampling=True,
+        )
 
     def _get_cache_directory(self) -> pathlib.Path:
         """
@@ -105,36 +554,27 @@ class LocalInference:
 
         return cache_dir
 
-    def _compute_prompt_hash(self, token_ids: list[int]) -> str:
+    def _build_vocabulary_masks(self) -> VocabularyMasks | None:
         """
-        Compute a hash of the token IDs and model path to use as the cache key.
-
-        This function creates a deterministic hash by taking the first half of the token sequence
-        and converting it to a JSON string before hashing. The model path is prepended to the hash
-        to ensure uniqueness across different models using the same prompts.
-
-        Note: Only the first half of tokens is used for efficiency, as system prompts typically
-        contain sufficient uniqueness in their initial portion.
-
-        Args:
-            token_ids (list[int]): The token IDs to hash.
-
-        Returns:
-            str: A composite string containing the model path and hexadecimal hash digest,
-                 formatted as "{model_path}:{hash_digest}".
+        Load or compute the vocabulary masks for the tokenizer's state delimiters.
         """
-        model_name = self.model_path.split("/")[-1]
-        # Use a fixed number of tokens (first 100) for consistent hashing
-        # This ensures the same system prompt always produces the same hash
-        # regardless of the total prompt length
-        fixed_token_count = min(100, len(token_ids))
-        token_ids_str = json.dumps(token_ids[:fixed_token_count])
-        hash_obj = hashlib.sha256(token_ids_str.encode())
-        return f"{model_name}:{hash_obj.hexdigest()}"
+        tokenizer = self.front_end.tokenizer
+        try:
+            start = time.perf_counter()
+            masks = VocabularyMasks.build(
+                tokenizer,
+                self.cache_directory,
+                delimiters=[delimiter[0] for delimiter in tokenizer.delimiters.values() if delimiter],
+            )
+            logger.debug(f"Prepared vocabulary masks in {time.perf_counter() - start:.2f}s")
+            return masks
+        except Exception as e:
+            logger.error(f"Failed to precompute vocabulary masks: {e}")
+            return None
 
-    def _cache_system_prompt(self, token_ids: list[int]) -> None:
+    def _cache_prompt_prefix(self, token_ids: list[int]) -> None:
         """
-        Cache the system prompt token IDs and KV cache to a file.
+        Cache the prompt token IDs and KV cache in the prefix cache.
 
         Args:
             token_ids (list[int]): The token IDs to cache.
@@ -144,49 +584,39 @@ class LocalInference:
             return
 
         try:
-            # Get the cache directory and compute the hash
-            cache_dir = self._get_cache_directory()
-            prompt_hash = self._compute_prompt_hash(token_ids)
-            cache_path = cache_dir / f"{prompt_hash}.safetensors"
-            # Save the cache
-            self.front_end.save_cache_to_file(str(cache_path), token_ids)
-            logger.debug(f"Cached system prompt to {cache_path}")
+            cache_path = self.prefix_cache.store(
+                token_ids,
+                lambda path: self.front_end.save_cache_to_file(str(path), token_ids),
+            )
+            if cache_path:
+                logger.debug(f"Cached prompt prefix to {cache_path}")
         except Exception as e:
-            logger.error(f"Failed to cache system prompt: {e}")
+            logger.error(f"Failed to cache prompt prefix: {e}")
 
-    def _load_cached_system_prompt(self, token_ids: list[int]) -> None:
+    def _load_cached_prompt_prefix(self, token_ids: list[int]) -> None:
         """
-        Load a cached system prompt if available.
+        Load the cached KV cache sharing the longest prefix with the token IDs, if any.
 
         Args:
             token_ids (list[int]): The token IDs to look up in the cache.
-
-        Returns:
-            Optional[list[int]]: The cached token IDs if available, None otherwise.
         """
         if not self.front_end.supports_reusing_prompt_cache():
             return
 
         try:
-            # Get the cache directory and compute the hash
-            cache_dir = self._get_cache_directory()
-            prompt_hash = self._compute_prompt_hash(token_ids)
-            cache_path = cache_dir / f"{prompt_hash}.safetensors"
-
-            # Check if the cache file exists
-            if not cache_path.exists():
-                logger.debug(f"No cache found for prompt hash {prompt_hash}")
+            match = self.prefix_cache.lookup(token_ids)
+            if match is None:
+                logger.debug("No cached prompt prefix found")
                 return
 
-            # Load the cache
+            cache_path, matched_tokens = match
             cache, computed_ids = self.front_end.load_cache_from_file(str(cache_path))
             if cache:
                 # Set the cache on the frontend
                 self.front_end.cache = cache
                 self.front_end.processed_token_ids = computed_ids
-                logger.debug(f"Loaded cached system prompt from {cache_path}")
-
-            return
+                logger.debug(
+                    f"Loaded cached prompt prefix ({matched_tokens} matching tokens) from {cache_path}"
+                )
         except Exception as e:
-            logger.error(f"Failed to load cached system prompt: {e}")
-            return
+            logger.error(f"Failed to load cached prompt prefix: {e}")
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import time
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 256
+DEFAULT_MAX_BYTES = 8 * 1024**3
+INDEX_FILE_NAME = "index.json"
+INDEX_VERSION = 1
+
+
+class PrefixCache:
+    """
+    A content-addressed, on-disk cache of KV prompt caches.
+
+    Token prefixes are hashed block by block, where the hash of each block chains the
+    hash of the previous one. An entry is registered under the hash of every complete
+    block it covers, so a lookup can find the entry sharing the longest block-aligned
+    prefix with a new prompt.
+
+    Entries are tracked in an index file, which records their size and last use.
+    An entry that is a prefix of a newer one is removed when the newer one is stored.
+    When the total size exceeds the disk budget, least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        directory: str | pathlib.Path,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        namespace: str = "",
+    ) -> None:
+        """
+        Args:
+            directory: Directory holding the cache files and the index.
+            block_size: Number of tokens per hashed block.
+            max_bytes: Disk budget for all cache files.
+            namespace: Seed for the block hashes, e.g. the model name,
+                so that different models never share entries.
+        """
+        self.directory = pathlib.Path(directory)
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.index_path = self.directory / INDEX_FILE_NAME
+        self._index: dict[str, Any] | None = None
+
+    def block_hashes(self, token_ids: list[int]) -> list[str]:
+        """
+        Compute the chained hashes of every complete block of a token sequence.
+
+        Args:
+            token_ids: The token ids to hash.
+
+        Returns:
+            One hash per complete block, the i-th hash covering the first (i + 1) blocks.
+        """
+        hashes = []
+        digest = hashlib.sha256(self.namespace.encode()).hexdigest()
+        for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+            block = token_ids[start : start + self.block_size]
+            digest = hashlib.sha256(f"{digest}:{json.dumps(block)}".encode()).hexdigest()
+            hashes.append(digest)
+        return hashes
+
+    def lookup(self, token_ids: list[int]) -> tuple[pathlib.Path, int] | None:
+        """
+        Find the cache entry sharing the longest block-aligned prefix with the tokens.
+
+        Args:
+            token_ids: The token ids of the prompt.
+
+        Returns:
+            The path of the cache file and the number of matched tokens, or None.
+        """
+        index = self._load_index()
+        hashes = self.block_hashes(token_ids)
+        for block_count in range(len(hashes), 0, -1):
+            entry_ids = index["blocks"].get(hashes[block_count - 1], [])
+            for entry_id in reversed(entry_ids):
+                entry = index["entries"].get(entry_id)
+                if not entry:
+                    continue
+                path = self.directory / entry["file"]
+                if not path.exists():
+                    self._remove_entry(entry_id)
+                    continue
+                entry["last_used"] = time.time()
+                self._save_index()
+                return path, block_count * self.block_size
+
+        return None
+
+    def contains(self, token_ids: list[int]) -> bool:
+        """
+        Check whether every complete block of the tokens is already cached.
+        """
+        hashes = self.block_hashes(token_ids)
+        if not hashes:
+            return True
+        return bool(self._load_index()["blocks"].get(hashes[-1]))
+
+    def store(
+        self,
+        token_ids: list[int],
+        write: Callable[[pathlib.Path], None],
+    ) -> pathlib.Path | None:
+        """
+        Store a new entry for the given tokens.
+
+        Args:
+            token_ids: The token ids covered by the cache being written.
+            write: A callback writing the cache file to the given path.
+
+        Returns:
+            The path of the new cache file, or None if nothing was stored.
+        """
+        hashes = self.block_hashes(token_ids)
+        if not hashes:
+            logger.debug("Prompt is shorter than one block, skipping prefix cache")
+            return None
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry_id = uuid.uuid4().hex
+        path = self.directory / f"{entry_id}.safetensors"
+        write(path)
+
+        index = self._load_index()
+        index["entries"][entry_id] = {
+            "file": path.name,
+            "num_tokens": len(token_ids),
+            "size_bytes": path.stat().st_size,
+            "last_used": time.time(),
+            "blocks": hashes,
+        }
+        for block_hash in hashes:
+            index["blocks"].setdefault(block_hash, []).append(entry_id)
+
+        self._remove_superseded(entry_id)
+        self._evict(keep=entry_id)
+        self._save_index()
+        return path
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["size_bytes"] for entry in self._load_index()["entries"].values())
+
+    def _remove_superseded(self, entry_id: str) -> None:
+        """
+        Remove the entries whose blocks are all covered by an entry.
+
+        Block hashes are chained, so an entry whose last block hash belongs to the given entry
+        is a prefix of it, and never a longer match than it.
+        """
+        index = self._load_index()
+        hashes = set(index["entries"][entry_id]["blocks"])
+        superseded = [
+            other_id
+            for other_id, entry in index["entries"].items()
+            if other_id != entry_id and entry["blocks"] and entry["blocks"][-1] in hashes
+        ]
+        for other_id in superseded:
+            self._remove_entry(other_id)
+            logger.debug(f"Removed prefix cache entry {other_id}, superseded by {entry_id}")
+
+    def _evict(self, keep: str | None = None) -> None:
+        """
+        Evict least recently used entries until the cache fits within the disk budget.
+        """
+        entries = self._load_index()["entries"]
+        total = self.total_bytes
+        for entry_id in sorted(entries, key=lambda e: entries[e]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if entry_id == keep:
+                continue
+            total -= entries[entry_id]["size_bytes"]
+            self._remove_entry(entry_id)
+            logger.debug(f"Evicted prefix cache entry {entry_id}")
+
+    def _remove_entry(self, entry_id: str) -> None:
+        index = self._load_index()
+        entry = index["entries"].pop(entry_id, None)
+        if not entry:
+            return
+
+        for block_hash in entry["blocks"]:
+            entry_ids = index["blocks"].get(block_hash, [])
+            if entry_id in entry_ids:
+                entry_ids.remove(entry_id)
+            if not entry_ids:
+                index["blocks"].pop(block_hash, None)
+
+        try:
+            (self.directory / entry["file"]).unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"Failed to remove prefix cache file {entry['file']}: {e}")
+
+    def _load_index(self) -> dict[str, Any]:
+        if self._index is not None:
+            return self._index
+
+        self._index = {"version": INDEX_VERSION, "entries": {}, "blocks": {}}
+        if self.index_path.exists():
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                if index.get("version") == INDEX_VERSION:
+                    self._index = index
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Failed to read prefix cache index, starting fresh: {e}")
+
+        return self._index
+
+    def _save_index(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp_path = self.index_path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(self._load_index(), f)
+        os.replace(temp_path, self.index_path)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from agent.llm.radix_cache import common_prefix_length
+
+DEFAULT_MAX_NGRAM_SIZE = 3
+
+
+class PromptLookup:
+    """
+    Proposes continuations by matching the latest n-gram against earlier tokens.
+
+    Tool results, file paths and code are often echoed back verbatim, so the tokens
+    that followed the most recent earlier occurrence of the last n tokens are a cheap
+    draft for speculative decoding, without a draft model.
+
+    N-grams are indexed incrementally as tokens are appended, so a proposal costs
+    a few dictionary lookups rather than a scan of the history.
+    """
+
+    def __init__(self, max_ngram_size: int = DEFAULT_MAX_NGRAM_SIZE) -> None:
+        """
+        Args:
+            max_ngram_size: The longest n-gram to match. Shorter n-grams are tried
+                when the longest one has no earlier occurrence.
+        """
+        self.max_ngram_size = max_ngram_size
+        self.token_ids: list[int] = []
+        self.index: dict[tuple[int, ...], int] = {}
+        self.indexed = 0
+
+    def reset(self, token_ids: list[int]) -> None:
+        """
+        Track a new token buffer.
+
+        The buffer is referenced, not copied, so tokens appended to it are picked up.
+        Index entries beyond the prefix shared with the previous buffer are re-indexed.
+        """
+        self.indexed = min(self.indexed, common_prefix_length(self.token_ids, token_ids))
+        self.token_ids = token_ids
+
+    def propose(self, num_tokens: int) -> list[int]:
+        """
+        Propose up to `num_tokens` tokens continuing the buffer.
+
+        Returns:
+            The tokens that followed the most recent earlier occurrence of the longest
+            matching n-gram, or an empty list if there is no match.
+        """
+        if num_tokens <= 0:
+            return []
+
+        self._update_index()
+        token_ids = self.token_ids
+        for n in range(min(self.max_ngram_size, len(token_ids)), 0, -1):
+            ngram = tuple(token_ids[-n:])
+            position = self.index.get(ngram)
+            if position is None or tuple(token_ids[position - n : position]) != ngram:
+                continue
+            return token_ids[position : position + num_tokens]
+
+        return []
+
+    def _update_index(self) -> None:
+        """
+        Index every n-gram that ends before the last token, mapped to the position after it.
+        """
+        token_ids = self.token_ids
+        while self.indexed < len(token_ids) - 1:
+            end = self.indexed + 1
+            for n in range(1, min(self.max_ngram_size, end) + 1):
+                self.index[tuple(token_ids[end - n : end])] = end
+            self.indexed = end
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import itertools
+import logging
+from collections.abc import Callable, Sequence
+from typing import Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RadixNode(Generic[T]):
+    """
+    A node of the radix tree.
+
+    Each node owns the token ids on the edge leading to it, along with the
+    cache segment computed for exactly those tokens.
+    """
+
+    def __init__(
+        self,
+        token_ids: tuple[int, ...] = (),
+        segment: T | None = None,
+        parent: RadixNode[T] | None = None,
+    ) -> None:
+        self.token_ids = token_ids
+        self.segment = segment
+        self.parent = parent
+        self.children: dict[int, RadixNode[T]] = {}
+        self.last_access = 0
+        self.size = 0
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self.children
+
+
+class RadixCache(Generic[T]):
+    """
+    An in-memory radix tree of cache segments keyed by token sequences.
+
+    Every path from the root spells out a token sequence that was computed before,
+    and the segments along the path can be joined to restore the cache for that sequence.
+    This allows resuming from the longest prefix shared with any previously computed branch,
+    instead of only the most recent one.
+
+    The segment type is opaque to the tree; the caller provides how to split a segment
+    at a token offset and how to measure its size. When the total size exceeds the
+    configured maximum, least recently used leaves are evicted.
+    """
+
+    def __init__(
+        self,
+        split_segment: Callable[[T, int], tuple[T, T]],
+        size_of: Callable[[T], int],
+        max_size: int,
+    ) -> None:
+        """
+        Args:
+            split_segment: Splits a segment into the parts before and after a token offset.
+            size_of: Returns the size of a segment, in the same unit as `max_size`.
+            max_size: The maximum total size of all segments in the tree.
+        """
+        self.split_segment = split_segment
+        self.size_of = size_of
+        self.max_size = max_size
+        self.root: RadixNode[T] = RadixNode()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.hit_tokens = 0
+        self.evicted_tokens = 0
+        self._clock = itertools.count(1)
+
+    def match(self, token_ids: Sequence[int]) -> tuple[int, list[T]]:
+        """
+        Find the longest cached prefix of a token sequence.
+
+        Args:
+            token_ids: The token ids to match.
+
+        Returns:
+            The number of matched tokens and the segments covering them, in order.
+        """
+        segments: list[T] = []
+        matched = 0
+        node = self.root
+        tick = next(self._clock)
+        while matched < len(token_ids):
+            child = node.children.get(token_ids[matched])
+            if child is None or child.segment is None:
+                break
+
+            common = common_prefix_length(child.token_ids, token_ids[matched:])
+            if common < len(child.token_ids):
+                # partial edge match, only use the shared part of the segment
+                segment, _ = self.split_segment(child.segment, common)
+                segments.append(segment)
+                matched += common
+                child.last_access = tick
+                break
+
+            segments.append(child.segment)
+            matched += common
+            child.last_access = tick
+            node = child
+
+        if matched:
+            self.hits += 1
+            self.hit_tokens += matched
+        else:
+            self.misses += 1
+
+        return matched, segments
+
+    def insert(self, token_ids: Sequence[int], extract: Callable[[int, int], T]) -> None:
+        """
+        Insert a token sequence into the tree.
+
+        Only the part of the sequence that is not cached yet is extracted.
+
+        Args:
+            token_ids: The token ids that were computed.
+            extract: Returns the cache segment for the tokens between two offsets.
+        """
+        node = self.root
+        offset = 0
+        tick = next(self._clock)
+        while offset < len(token_ids):
+            child = node.children.get(token_ids[offset])
+            if child is None:
+                segment = extract(offset, len(token_ids))
+                leaf = RadixNode(tuple(token_ids[offset:]), segment, node)
+                leaf.size = self.size_of(segment)
+                leaf.last_access = tick
+                node.children[leaf.token_ids[0]] = leaf
+                self.total_size += leaf.size
+                break
+
+            common = common_prefix_length(child.token_ids, token_ids[offset:])
+            if common < len(child.token_ids):
+                child = self._split(child, common)
+
+            child.last_access = tick
+            offset += common
+            node = child
+
+        self._evict()
+
+    def clear(self) -> None:
+        """
+        Remove all segments from the tree.
+        """
+        self.root = RadixNode()
+        self.total_size = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_tokens": self.hit_tokens,
+            "evicted_tokens": self.evicted_tokens,
+            "total_size": self.total_size,
+        }
+
+    def _split(self, node: RadixNode[T], offset: int) -> RadixNode[T]:
+        """
+        Split a node's edge at a token offset, returning the new upper node.
+        """
+        assert node.segment is not None and node.parent is not None
+        head, tail = self.split_segment(node.segment, offset)
+        upper = RadixNode(node.token_ids[:offset], head, node.parent)
+        upper.size = self.size_of(head)
+        upper.last_access = node.last_access
+        node.parent.children[upper.token_ids[0]] = upper
+
+        self.total_size -= node.size
+        node.token_ids = node.token_ids[offset:]
+        node.segment = tail
+        node.size = self.size_of(tail)
+        node.parent = upper
+        upper.children[node.token_ids[0]] = node
+        self.total_size += upper.size + node.size
+        return upper
+
+    def _evict(self) -> None:
+        """
+        Evict least recently used leaves until the tree fits within its maximum size.
+        """
+        while self.total_size > self.max_size:
+            leaves = [node for node in self._nodes() if node.is_leaf]
+            if not leaves:
+                break
+
+            leaf = min(leaves, key=lambda node: node.last_access)
+            assert leaf.parent is not None
+            del leaf.parent.children[leaf.token_ids[0]]
+            self.total_size -= leaf.size
+            self.evicted_tokens += len(leaf.token_ids)
+            logger.debug(f"Evicted {len(leaf.token_ids)} tokens from the radix cache")
+
+    def _nodes(self) -> list[RadixNode[T]]:
+        nodes = []
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children.values())
+        return nodes
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    """
+    Get the number of leading tokens two sequences have in common.
+    """
+    length = 0
+    for x, y in zip(a, b, strict=False):
+        if x != y:
+            break
+        length += 1
+    return length
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections.abc import AsyncIterator, Callable
+from contextlib import aclosing
+from typing import Any
+
+from agent.llm.server import DEFAULT_SOCKET_PATH, InferenceClient
+from agent.llm.tokenizer import Tokenizer
+from agent.state_machine import AgentStateMachine
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteEngine:
+    """
+    The structured output of a session's generation on an inference server,
+    as reported by the server's events.
+
+    The completed outputs are only known once the generation is done.
+    """
+
+    def __init__(self) -> None:
+        self.live_output: tuple[str, str] | None = None
+        self.output: list[tuple[str, Any]] = []
+
+    def reset(self) -> None:
+        self.live_output = None
+        self.output = []
+
+    def get_live_structured_output(self) -> tuple[str, str] | None:
+        return self.live_output
+
+    def get_stateful_structured_output(self) -> list[tuple[str, Any]]:
+        return self.output
+
+
+class RemoteFrontend:
+    """
+    The tokenizer of a model served by an inference server.
+    """
+
+    def __init__(self, tokenizer: Tokenizer) -> None:
+        self.tokenizer = tokenizer
+
+    def supports_forking(self) -> bool:
+        return False
+
+    def supports_reusing_prompt_cache(self) -> bool:
+        return False
+
+
+class RemoteInference:
+    """
+    Runs an agent's inference in a session of an `InferenceServer`,
+    sharing the server's loaded model with other agents.
+
+    Used in place of `LocalInference`. Only the tokenizer is loaded locally,
+    to count tokens and build the agent's state machine. Prefilling, the prefix cache
+    and checkpoints are handled by, or not available on, the server; the planning token
+    budget is not enforced, since completed outputs are only reported at the end of a generation.
+    """
+
+    def __init__(self, model_path: str, socket_path: str = DEFAULT_SOCKET_PATH) -> None:
+        """
+        Args:
+            model_path: Path to the model served by the server, for its tokenizer.
+            socket_path: The Unix socket the server listens on.
+        """
+        self.model_path = model_path
+        self.front_end = RemoteFrontend(Tokenizer.load(model_path))
+        self.engine = RemoteEngine()
+        self.client = InferenceClient(socket_path)
+        self.session_id: str | None = None
+        self._configuration: dict[str, Any] | None = None
+        self._cancelled = threading.Event()
+
+    async def connect(self) -> None:
+        """
+        Connect to the server and open a session.
+        """
+        await self.client.connect()
+        self.session_id = await self.client.open_session()
+
+    async def close(self) -> None:
+        if self.session_id is not None:
+            await self.client.close_session(self.session_id)
+            self.session_id = None
+        await self.client.close()
+
+    def configure(self, state_machine: AgentStateMachine) -> None:
+        """
+        Configure the session with a state machine, before its next generation.
+
+        The server builds the state machine again from its options,
+        with the delimiters of its own tokenizer.
+        """
+        options = dict(state_machine.options)
+        options.pop("delimiters_kwargs", None)
+        self._configuration = options
+
+    async def stream_inference(
+        self,
+        prompt: list[dict[str, Any]],
+        snapshot: Callable[[RemoteEngine], Any] | None = None,
+        max_buffered_tokens: int = 0,
+        **inference_kwargs,
+    ) -> AsyncIterator[tuple[int, Any]]:
+        """
+        Generate a completion on the server, streaming the tokens.
+
+        Closing the stream cancels the generation on the server and waits for it to end.
+
+        Args:
+            prompt: The conversation to generate a response for.
+            snapshot: Called with the engine after every token; the result is yielded
+                with the token id. Defaults to the live structured output.
+            max_buffered_tokens: Unused, the server's events are buffered by the socket.
+            **inference_kwargs: Additional keyword arguments to use for inference.
+
+        Yields:
+            tuple[int, Any]: The token id and the engine snapshot taken after it.
+        """
+        if self.session_id is None:
+            await self.connect()
+        assert self.session_id is not None
+        if self._configuration is not None:
+            await self.client.configure_session(self.session_id, **self._configuration)
+            self._configuration = None
+
+        self._cancelled.clear()
+        take_snapshot = snapshot or (lambda engine: engine.get_live_structured_output())
+        async with aclosing(self.client.generate(self.session_id, prompt, **inference_kwargs)) as events:
+            async for event in events:
+                if event.get("done"):
+                    if "error" in event:
+                        raise RuntimeError(event["error"])
+                    self.engine.output = [tuple(output) for output in event.get("output", [])]
+                    return
+                self.engine.live_output = (event["state"], event["text"]) if "state" in event else None
+                yield event["token"], take_snapshot(self.engine)
+                if self._cancelled.is_set():
+                    return
+
+    def cancel(self) -> None:
+        """
+        Stop the streamed inference at its next token. Safe to call from any thread.
+        """
+        self._cancelled.set()
+
+    def count_tokens(self, interaction: dict[str, Any]) -> int:
+        """
+        Estimate the prompt tokens of an interaction from its content and tool result.
+        """
+        text = str(interaction.get("content", ""))
+        if isinstance(tool_result := interaction.get("tool_result"), dict):
+            text += str(tool_result.get("content", ""))
+        if tool_call := interaction.get("tool_call"):
+            text += str(tool_call)
+        return len(self.front_end.tokenizer.encode(text, add_special_tokens=False))
+
+    def prefill(self, prompt: list[dict[str, Any]], placeholder: str, **inference_kwargs) -> None:
+        pass
+
+    def cache_prompt_prefix(self, **inference_kwargs) -> None:
+        pass
+
+    def wait_for_prefill(self) -> None:
+        pass
+
+    def warm_start(self, prompt: list[dict[str, Any]], **inference_kwargs) -> int:
+        return 0
+
+    def fork(self) -> RemoteInference:
+        raise NotImplementedError("Remote inference sessions cannot be forked")
+
+    def save_checkpoint(self, file_path: str, metadata: dict[str, str]) -> None:
+        raise NotImplementedError("Checkpoints are not available with an inference server")
+
+    def load_checkpoint(self, file_path: str) -> dict[str, str]:
+        raise NotImplementedError("Checkpoints are not available with an inference server")
+
+    def release_cache(self) -> None:
+        pass
@@ -0,0 +1,518 @@
+"""
+Inference server hosting one loaded model for many sessions.
+
+Each session is a fork of a `LocalInference` instance, with its own structuring engine
+and KV cache, sharing the model weights, the radix cache and the prefix cache.
+A single scheduler thread owns the model and interleaves the decode steps of all
+active generations, one token at a time, so that sessions make progress concurrently.
+Decode steps are not batched: every step is its own forward pass, so the combined
+throughput is that of one session, shared by all of them. What the server saves is
+loading the model, and prefilling shared prompt prefixes, once for every agent.
+
+Clients talk to the server over a Unix socket, using one JSON object per line.
+Every request carries an `id`, which is echoed in its reply:
+
+    {"id": 1, "op": "open"}                                         -> {"id": 1, "session": "..."}
+    {"id": 2, "op": "configure", "session": "...", "tools": [...]}  -> {"id": 2, "states": [...], "prompt": "..."}
+    {"id": 3, "op": "generate", "session": "...", "prompt": [...]}  -> {"id": 3, "generating": true}
+    {"id": 4, "op": "cancel", "session": "..."}                     -> {"id": 4, "cancelled": true}
+    {"id": 5, "op": "close", "session": "..."}                      -> {"id": 5, "closed": true}
+
+Tools are given by name, to be loaded from the server's tools directory, or as
+{"name": ..., "description": ..., "schema": ...} objects. Failed requests are answered with {"id": ..., "error": "..."}. Generations stream their
+events without an id, tagged with the session instead:
+
+    {"session": "...", "token": 128, "state": "thinking", "text": "..."} ... {"session": "...", "done": true, "output": [...]}
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from collections.abc import AsyncIterator, Callable, Iterator
+from concurrent.futures import Future
+from typing import Any
+
+from agent.llm.local import LocalInference
+from agent.state_machine import STATE_MACHINE_CACHE, AgentStateMachine
+from agent.tools import Tool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/agent-inference.sock"
+STREAM_LIMIT = 64 * 1024**2
+
+
+class Generation:
+    """
+    A generation request of a session, advanced one token at a time by the scheduler.
+    """
+
+    def __init__(
+        self,
+        session: LocalInference,
+        prompt: list[dict[str, Any]],
+        emit: Callable[[dict[str, Any]], None],
+        **inference_kwargs,
+    ) -> None:
+        """
+        Args:
+            session: The inference session to generate with.
+            prompt: The conversation to generate a response for.
+            emit: Called with every event of the generation, from the scheduler thread.
+            **inference_kwargs: Keyword arguments for inference.
+        """
+        self.session = session
+        self.prompt = prompt
+        self.emit = emit
+        self.inference_kwargs = inference_kwargs
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self._tokens: Iterator[int] | None = None
+
+    def step(self) -> bool:
+        """
+        Generate the next token.
+
+        Returns:
+            Whether the generation is still active.
+        """
+        try:
+            if self._tokens is None:
+                self.session.engine.reset()
+                self._tokens = iter(self.session.run_inference(self.prompt, **self.inference_kwargs))
+
+            if self.cancelled.is_set():
+                self._finish({"done": True, "cancelled": True})
+                return False
+
+            token_id = next(self._tokens)
+        except StopIteration:
+            output = list(self.session.engine.get_stateful_structured_output())
+            self._finish({"done": True, "output": output})
+            return False
+        except Exception as e:
+            logger.error(f"Generation failed: {e}")
+            self._finish({"done": True, "error": str(e)})
+            return False
+
+        event: dict[str, Any] = {"token": token_id}
+        if live_output := self.session.engine.get_live_structured_output():
+            event["state"], event["text"] = live_output
+        self.emit(event)
+        return True
+
+    def _finish(self, event: dict[str, Any]) -> None:
+        if self._tokens is not None and hasattr(self._tokens, "close"):
+            self._tokens.close()  # type: ignore[reportAttributeAccessIssue]
+        # finished before the client hears of it, so it can generate again right away
+        self.finished.set()
+        self.emit(event)
+
+
+class InferenceServer:
+    """
+    Hosts one loaded model for many inference sessions.
+
+    Decode steps of concurrent generations are interleaved round-robin on the
+    scheduler thread. They are not batched into a single forward pass, since every
+    session keeps its own per-sequence KV cache and structuring engine.
+    Session configuration also runs on the scheduler thread, between decode steps,
+    since it updates the vocabulary masks shared by all sessions.
+    """
+
+    def __init__(self, inference: LocalInference, socket_path: str = DEFAULT_SOCKET_PATH) -> None:
+        """
+        Args:
+            inference: The inference instance whose model is shared by all sessions.
+            socket_path: The Unix socket to listen on.
+        """
+        self.inference = inference
+        self.socket_path = socket_path
+        self.sessions: dict[str, LocalInference] = {}
+        self.generations: dict[str, Generation] = {}
+        self._pending: queue.Queue[Generation | tuple[Callable[[], Any], Future[Any]]] = queue.Queue()
+        self._stopped = threading.Event()
+        self._scheduler: threading.Thread | None = None
+
+    def open_session(self) -> str:
+        """
+        Open a new session sharing the loaded model.
+
+        Returns:
+            The session id.
+        """
+        if not self.inference.front_end.supports_forking():
+            raise ValueError(f"The {type(self.inference.front_end).__name__} frontend cannot fork sessions")
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = self.inference.fork()
+        logger.info(f"Opened session {session_id} ({len(self.sessions)} open)")
+        return session_id
+
+    def configure_session(
+        self,
+        session_id: str,
+        tools: list[str | dict[str, Any]] | None = None,
+        **state_machine_kwargs: Any,
+    ) -> Future[AgentStateMachine]:
+        """
+        Configure the structuring engine of a session with an agent state machine.
+
+        The configuration runs on the scheduler thread, after the decode steps already scheduled.
+
+        Args:
+            session_id: The session to configure.
+            tools: Names of the tools to load from the tools directory, or tool schemas.
+            **state_machine_kwargs: Keyword arguments for the `AgentStateMachine`.
+
+        Returns:
+            A future of the state machine the session was configured with.
+        """
+        session = self._get_session(session_id)
+        if self.is_generating(session_id):
+            raise ValueError(f"Session {session_id} is generating, cannot reconfigure it")
+
+        def configure() -> AgentStateMachine:
+            state_machine, _ = STATE_MACHINE_CACHE.get(
+                tools=self._load_tools(tools) if tools else None,
+                delimiters_kwargs=session.front_end.tokenizer.delimiters,
+                **state_machine_kwargs,
+            )
+            session.configure(state_machine)
+            return state_machine
+
+        future: Future[AgentStateMachine] = Future()
+        self._pending.put((configure, future))
+        return future
+
+    def generate(
+        self,
+        session_id: str,
+        prompt: list[dict[str, Any]],
+        emit: Callable[[dict[str, Any]], None],
+        **inference_kwargs,
+    ) -> Generation:
+        """
+        Schedule a generation for a session.
+
+        Args:
+            session_id: The session to generate with.
+            prompt: The conversation to generate a response for.
+            emit: Called with every event of the generation, from the scheduler thread.
+            **inference_kwargs: Keyword arguments for inference.
+        """
+        session = self._get_session(session_id)
+        if self.is_generating(session_id):
+            raise ValueError(f"Session {session_id} is already generating")
+
+        generation = Generation(session, prompt, emit, **inference_kwargs)
+        self.generations[session_id] = generation
+        self._pending.put(generation)
+        return generation
+
+    def is_generating(self, session_id: str) -> bool:
+        generation = self.generations.get(session_id)
+        return generation is not None and not generation.finished.is_set()
+
+    def cancel(self, session_id: str) -> None:
+        if generation := self.generations.get(session_id):
+            generation.cancelled.set()
+
+    def close_session(self, session_id: str) -> None:
+        self.cancel(session_id)
+        self.generations.pop(session_id, None)
+        if self.sessions.pop(session_id, None):
+            logger.info(f"Closed session {session_id} ({len(self.sessions)} open)")
+
+    def start(self) -> None:
+        """
+        Start the scheduler thread.
+        """
+        if self._scheduler and self._scheduler.is_alive():
+            return
+        self._stopped.clear()
+        self._scheduler = threading.Thread(target=self._schedule, name="inference-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def stop(self) -> None:
+        """
+        Stop the scheduler thread, cancelling all active generations.
+        """
+        for generation in self.generations.values():
+            generation.cancelled.set()
+        self._stopped.set()
+        if self._scheduler:
+            self._scheduler.join()
+            self._scheduler = None
+
+    async def serve(self) -> None:
+        """
+        Serve sessions over the Unix socket until cancelled.
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self.start()
+        server = await asyncio.start_unix_server(
+            self._handle_connection,
+            path=self.socket_path,
+            limit=STREAM_LIMIT,
+        )
+        logger.info(f"Serving {self.inference.model_path} on {self.socket_path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _schedule(self) -> None:
+        """
+        Interleave the decode steps of all active generations until stopped.
+        """
+        active: list[Generation] = []
+        while not self._stopped.is_set() or active:
+            try:
+                while True:
+                    # block only when there is nothing to decode
+                    item = self._pending.get(block=not active, timeout=0.1)
+                    if isinstance(item, Generation):
+                        active.append(item)
+                    else:
+                        self._run_job(*item)
+            except queue.Empty:
+                pass
+
+            for generation in list(active):
+                if self._stopped.is_set():
+                    generation.cancelled.set()
+                if not generation.step():
+                    active.remove(generation)
+
+    @staticmethod
+    def _run_job(job: Callable[[], Any], future: Future[Any]) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(job())
+        except Exception as e:
+            logger.error(f"Scheduler job failed: {e}")
+            future.set_exception(e)
+
+    @staticmethod
+    def _load_tools(tools: list[str | dict[str, Any]]) -> list[Tool]:
+        names = [tool for tool in tools if isinstance(tool, str)]
+        schemas = [tool for tool in tools if isinstance(tool, dict)]
+        return (Tool.load(file_name=names) if names else []) + [
+            Tool(tool["name"], tool.get("description", ""), schema=tool.get("schema")) for tool in schemas
+        ]
+
+    def _get_session(self, session_id: str) -> LocalInference:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"Unknown session: {session_id}")
+        return session
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Handle the requests of one client until it disconnects.
+
+        Sessions opened over a connection are closed when it ends.
+        """
+        loop = asyncio.get_running_loop()
+        write_lock = asyncio.Lock()
+        opened: set[str] = set()
+        streams: set[asyncio.Task] = set()
+
+        async def send(message: dict[str, Any]) -> None:
+            async with write_lock:
+                writer.write(json.dumps(message, default=str).encode() + b"\n")
+                await writer.drain()
+
+        async def stream(session_id: str, events: asyncio.Queue[dict[str, Any]]) -> None:
+            while True:
+                event = await events.get()
+                await send({"session": session_id, **event})
+                if event.get("done"):
+                    return
+
+        try:
+            while line := await reader.readline():
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.pop("id", None)
+                    op = request.pop("op")
+                    session_id = request.pop("session", None)
+                    match op:
+                        case "open":
+                            session_id = self.open_session()
+                            opened.add(session_id)
+                            await send({"id": request_id, "session": session_id})
+                        case "configure":
+                            state_machine = await asyncio.wrap_future(self.configure_session(session_id, **request))
+                            await send(
+                                {
+                                    "id": request_id,
+                                    "states": list(state_machine.states),
+                                    "prompt": state_machine.prompt,
+                                }
+                            )
+                        case "generate":
+                            events: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+                            self.generate(
+                                session_id,
+                                request.pop("prompt"),
+                                lambda event, events=events: loop.call_soon_threadsafe(events.put_nowait, event),
+                                **request.pop("kwargs", {}),
+                            )
+                            await send({"id": request_id, "generating": True})
+                            task = asyncio.create_task(stream(session_id, events))
+                            streams.add(task)
+                            task.add_done_callback(streams.discard)
+                        case "cancel":
+                            self.cancel(session_id)
+                            await send({"id": request_id, "cancelled": True})
+                        case "close":
+                            self.close_session(session_id)
+                            opened.discard(session_id)
+                            await send({"id": request_id, "closed": True})
+                        case _:
+                            raise ValueError(f"Unknown operation: {op}")
+                except Exception as e:
+                    await send({"id": request_id, "error": str(e)})
+        finally:
+            for session_id in opened:
+                self.close_session(session_id)
+            for task in streams:
+                task.cancel()
+            writer.close()
+
+
+class InferenceClient:
+    """
+    Client for an `InferenceServer` listening on a Unix socket.
+
+    Requests are sent over a single connection; generations of different
+    sessions can be consumed concurrently.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH) -> None:
+        self.socket_path = socket_path
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.pending: dict[int, asyncio.Future[dict[str, Any]]] = {}
+        self.events: dict[str, asyncio.Queue[dict[str, Any]]] = {}
+        self._request_ids = itertools.count(1)
+        self._receiver: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path, limit=STREAM_LIMIT)
+        self._receiver = asyncio.create_task(self._receive())
+
+    async def open_session(self) -> str:
+        reply = await self._request("open")
+        return reply["session"]
+
+    async def configure_session(self, session_id: str, **kwargs: Any) -> dict[str, Any]:
+        """
+        Configure the session's state machine.
+
+        Returns:
+            The names of the agent states and the state machine's prompt.
+        """
+        return await self._request("configure", session=session_id, **kwargs)
+
+    async def generate(
+        self,
+        session_id: str,
+        prompt: list[dict[str, Any]],
+        **inference_kwargs,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        Generate a response, yielding the server's events until the generation is done.
+
+        Closing the stream early cancels the generation, and waits for the server to end it,
+        so the session can generate again once the stream is closed.
+        """
+        events = self.events.setdefault(session_id, asyncio.Queue())
+        await self._request("generate", session=session_id, prompt=prompt, kwargs=inference_kwargs)
+        done = False
+        try:
+            while not done:
+                event = await events.get()
+                done = bool(event.get("done"))
+                yield event
+        finally:
+            if not done:
+                await self.cancel(session_id)
+                while not (await events.get()).get("done"):
+                    pass
+
+    async def cancel(self, session_id: str) -> None:
+        await self._request("cancel", session=session_id)
+
+    async def close_session(self, session_id: str) -> None:
+        await self._request("close", session=session_id)
+        self.events.pop(session_id, None)
+
+    async def close(self) -> None:
+        if self._receiver:
+            self._receiver.cancel()
+        if self.writer:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+    async def _request(self, op: str, **kwargs: Any) -> dict[str, Any]:
+        assert self.writer is not None, "Client is not connected"
+        request_id = next(self._request_ids)
+        reply = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps({"id": request_id, "op": op, **kwargs}).encode() + b"\n")
+        await self.writer.drain()
+
+        result = await reply
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result
+
+    async def _receive(self) -> None:
+        """
+        Resolve replies to requests, and route generation events to their session.
+        """
+        assert self.reader is not None
+        while line := await self.reader.readline():
+            message = json.loads(line)
+            if (reply := self.pending.pop(message.get("id"), None)) is not None:
+                reply.set_result(message)
+            elif session_id := message.get("session"):
+                await self.events.setdefault(session_id, asyncio.Queue()).put(message)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve one model to many agent sessions, interleaving their decode steps."
+    )
+    parser.add_argument("model_path", help="Path to the model")
+    parser.add_argument("--frontend", default="mlx", choices=["mlx"], help="Inference backend")
+    parser.add_argument("--draft-model-path", default=None, help="Draft model for speculative decoding")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    inference = LocalInference(args.model_path, args.frontend, draft_model_path=args.draft_model_path)
+    try:
+        asyncio.run(InferenceServer(inference, args.socket).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,9 @@ from __future__ import annotations
 import json
 import logging
 import os
+from collections.abc import Mapping
 from pathlib import Path
+from types import MappingProxyType
 from typing import Any
 
 from transformers import AutoTokenizer, PreTrainedTokenizer, PreTrainedTokenizerFast
@@ -34,6 +36,41 @@ class Tokenizer:
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
         self._tokenizer = tokenizer
         self._control_tokens = control_tokens
+        self._freeze_control_token_data()
+
+    def _freeze_control_token_data(self) -> None:
+        """Precompute all data derived from the control tokens.
+
+        Stop tokens are checked for every generated token, so their ids are
+        encoded once here instead of on every access.
+        """
+        self._stop_tokens: frozenset[int] = frozenset()
+        self._whitelist_control_tokens: tuple[str, ...] = ()
+        self._delimiters: Mapping[str, tuple[str, str] | None] = MappingProxyType({})
+        self._delimiter_token_ids: Mapping[str, tuple[tuple[int, ...], tuple[int, ...]]] = (
+            MappingProxyType({})
+        )
+        if not self._control_tokens:
+            return
+
+        self._stop_tokens = frozenset(
+            self._tokenizer.encode(stop_token, add_special_tokens=False)[0]
+            for stop_token in self._control_tokens.end_tokens()
+        )
+        self._whitelist_control_tokens = tuple(
+            self._control_tokens.get_whitelist_control_tokens()
+        )
+        self._delimiters = MappingProxyType(self._control_tokens.delimiters())
+        self._delimiter_token_ids = MappingProxyType(
+            {
+                name: (
+                    tuple(self._tokenizer.encode(delimiter[0], add_special_tokens=False)),
+                    tuple(self._tokenizer.encode(delimiter[1], add_special_tokens=False)),
+                )
+                for name, delimiter in self._delimiters.items()
+                if delimiter
+            }
+        )
 
     @property
     def control_tokens(self) -> ControlTokens:
@@ -53,37 +90,39 @@ class Tokenizer:
         Returns:
             List of control tokens
         """
-        return self.control_tokens.get_whitelist_control_tokens()
+        if self._control_tokens is None:
+            raise ValueError("Control tokens are not set")
+        return list(self._whitelist_control_tokens)
 
     @property
-    def stop_tokens(self) -> set[int]:
+    def stop_tokens(self) -> frozenset[int]:
         """Get the set of token IDs that indicate stopping generation.
 
         Returns:
             Set of token IDs for EOS and EOM tokens from control_tokens.
             Returns empty set if no control tokens configured.
         """
-        if not self._control_tokens:
-            return set()
+        return self._stop_tokens
 
-        # Get all end token IDs without special tokens to avoid duplicates
-        stop_tokens = set()
-        for stop_token in self._control_tokens.end_tokens():
-            stop_tokens.add(
-                self._tokenizer.encode(stop_token, add_special_tokens=False)[0]
-            )
+    @property
+    def delimiters(self) -> Mapping[str, tuple[str, str] | None]:
+        """Get the delimiters for the control tokens.
 
-        # Flatten and deduplicate token IDs into a set
-        return stop_tokens
+        Returns:
+            Read-only mapping of control token names to their delimiters
+        """
+        if self._control_tokens is None:
+            raise ValueError("Control tokens are not set")
+        return self._delimiters
 
     @property
-    def delimiters(self) -> dict[str, tuple[str, str] | None]:
-        """Get the delimiters for the control tokens.
+    def delimiter_token_ids(self) -> Mapping[str, tuple[tuple[int, ...], tuple[int, ...]]]:
+        """Get the token IDs of the start and end delimiters for the control tokens.
 
         Returns:
-            Dictionary of control token names to their delimiters
+            Read-only mapping of control token names to their encoded delimiters
         """
-        return self.control_tokens.delimiters()
+        return self._delimiter_token_ids
 
     def decode(self, tokens: list[int], **kwargs) -> str:
         """Decode token IDs back to text.
@@ -134,6 +173,23 @@ class Tokenizer:
                 return templated  # type: ignore[reportReturnValue]
             raise ValueError(f"Unsupported prompt format: {templated}")
 
+    def render(self, prompt: list[dict[str, Any]], **kwargs) -> str:
+        """Render chat messages with the chat template, without tokenizing.
+
+        Args:
+            prompt: List of chat messages to render
+            **kwargs: Additional template variables
+
+        Returns:
+            The templated string
+        """
+        kwargs["interactions"] = prompt
+        kwargs["tokenize"] = False
+        templated = self._tokenizer.apply_chat_template(prompt, **kwargs)
+        if not isinstance(templated, str):
+            raise ValueError(f"Unsupported prompt format: {templated}")
+        return templated
+
     @staticmethod
     def load(model_path: str | Path, **kwargs) -> Tokenizer:
         """Create a TokenizerWrapper by loading a Hugging Face tokenizer.
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import pathlib
+from collections.abc import Iterable
+
+import numpy as np
+
+from agent.llm.tokenizer import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+MASKS_FILE_NAME = "vocabulary_masks.npz"
+
+
+class VocabularyMasks:
+    """
+    Precomputed vocabulary masks for the delimiters of the agent states.
+
+    Every delimiter gets a table with one boolean row per character offset.
+    Row `i` marks the tokens whose text is a prefix of the delimiter from offset `i`,
+    i.e. the tokens that continue the delimiter once its first `i` characters were generated.
+    Masking the logits while a delimiter is being generated is then a single array lookup,
+    instead of walking the vocabulary.
+
+    Tables are computed once per tokenizer and persisted to disk.
+    """
+
+    def __init__(self, token_texts: list[str], fingerprint: str) -> None:
+        """
+        Args:
+            token_texts: The decoded text of every token id.
+            fingerprint: A hash identifying the tokenizer's vocabulary.
+        """
+        self.token_texts = token_texts
+        self.fingerprint = fingerprint
+        self.tables: dict[str, np.ndarray] = {}
+        self._dirty = False
+
+    @property
+    def vocab_size(self) -> int:
+        return len(self.token_texts)
+
+    def add_delimiters(self, delimiters: Iterable[str]) -> None:
+        for delimiter in delimiters:
+            self.table(delimiter)
+
+    def table(self, delimiter: str) -> np.ndarray:
+        """
+        Get the table of a delimiter, computing it if needed.
+
+        Returns:
+            A boolean array of shape (len(delimiter), vocab_size).
+        """
+        if (table := self.tables.get(delimiter)) is not None:
+            return table
+
+        table = np.zeros((len(delimiter), self.vocab_size), dtype=bool)
+        for token_id, text in enumerate(self.token_texts):
+            # cheap substring check first, most tokens never occur in a delimiter
+            if not text or text not in delimiter:
+                continue
+            for offset in range(len(delimiter) - len(text) + 1):
+                if delimiter.startswith(text, offset):
+                    table[offset, token_id] = True
+
+        self.tables[delimiter] = table
+        self._dirty = True
+        return table
+
+    def continuation_mask(self, partial: str, delimiters: Iterable[str]) -> np.ndarray | None:
+        """
+        Get the mask of tokens continuing a partially generated delimiter.
+
+        Args:
+            partial: The text generated since the last state boundary.
+            delimiters: The delimiters that can start at the boundary.
+
+        Returns:
+            The mask, or None unless the text is a proper prefix of exactly one delimiter.
+        """
+        partial = partial.lstrip()
+        if not partial:
+            return None
+
+        matches = [d for d in delimiters if len(partial) < len(d) and d.startswith(partial)]
+        if len(matches) != 1:
+            return None
+        return self.table(matches[0])[len(partial)]
+
+    def save(self, path: str | pathlib.Path) -> None:
+        """
+        Persist the tables, if any were computed since they were loaded.
+        """
+        if not self._dirty:
+            return
+
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        delimiters = list(self.tables)
+        arrays = {f"table_{i}": np.packbits(self.tables[d], axis=-1) for i, d in enumerate(delimiters)}
+        temp_path = path.with_name(f"{path.stem}.tmp.npz")
+        np.savez_compressed(
+            temp_path,
+            fingerprint=np.array(self.fingerprint),
+            token_texts=np.array(json.dumps(self.token_texts)),
+            delimiters=np.array(json.dumps(delimiters)),
+            **arrays,
+        )
+        temp_path.replace(path)
+        self._dirty = False
+        logger.debug(f"Saved vocabulary masks for {len(delimiters)} delimiters to {path}")
+
+    @staticmethod
+    def load(path: str | pathlib.Path, fingerprint: str) -> VocabularyMasks | None:
+        """
+        Load persisted tables, unless they were computed for a different vocabulary.
+        """
+        path = pathlib.Path(path)
+        if not path.exists():
+            return None
+
+        try:
+            with np.load(path) as data:
+                if str(data["fingerprint"]) != fingerprint:
+                    logger.info("Vocabulary changed, recomputing vocabulary masks")
+                    return None
+
+                masks = VocabularyMasks(json.loads(str(data["token_texts"])), fingerprint)
+                for i, delimiter in enumerate(json.loads(str(data["delimiters"]))):
+                    packed = data[f"table_{i}"]
+                    masks.tables[delimiter] = np.unpackbits(packed, axis=-1, count=masks.vocab_size).astype(bool)
+            return masks
+        except Exception as e:
+            logger.warning(f"Failed to load vocabulary masks from {path}: {e}")
+            return None
+
+    @staticmethod
+    def build(
+        tokenizer: Tokenizer,
+        cache_directory: str | pathlib.Path,
+        delimiters: Iterable[str] = (),
+    ) -> VocabularyMasks:
+        """
+        Load the masks of a tokenizer from disk, or compute them.
+
+        Args:
+            tokenizer: The tokenizer whose vocabulary is masked.
+            cache_directory: The directory holding the persisted masks.
+            delimiters: Delimiters to precompute tables for.
+        """
+        vocabulary = tokenizer._tokenizer.get_vocab()
+        fingerprint = hashlib.sha256(
+            json.dumps(sorted(vocabulary.items(), key=lambda item: item[1])).encode()
+        ).hexdigest()
+
+        path = pathlib.Path(cache_directory) / MASKS_FILE_NAME
+        masks = VocabularyMasks.load(path, fingerprint)
+        if masks is None:
+            vocab_size = max(len(tokenizer._tokenizer), max(vocabulary.values(), default=-1) + 1)
+            token_texts = tokenizer._tokenizer.batch_decode([[token_id] for token_id in range(vocab_size)])
+            masks = VocabularyMasks(token_texts, fingerprint)
+
+        masks.add_delimiters(delimiters)
+        masks.save(path)
+        return masks
@@ -28,6 +28,13 @@ class AgentState(ABC):
     def state_prompt(self) -> str:
         pass
 
+    @property
+    def start_delimiter(self) -> str:
+        """
+        The first text the model generates when it enters this state.
+        """
+        return self.delimiters[0]
+
     def format(self, string: str) -> str:
         return f"{self.delimiters[0]}{string}{self.delimiters[1]}"
 
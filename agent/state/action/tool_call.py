@@ -1,18 +1,47 @@
+import hashlib
+import json
+import logging
 import textwrap
+import threading
+from collections import OrderedDict
 
+from pse.types.base.any import AnyStateMachine
+from pse.types.base.encapsulated import EncapsulatedStateMachine
 from pse.types.json import json_schema_state_machine
 from pse_core.state_machine import StateMachine
 
 from agent.state import AgentState
 from agent.tools import Tool
 
+logger = logging.getLogger(__name__)
+
+MAX_COMPILED_TOOL_SCHEMAS = 1024
+
+# compiled tool schema state machines, keyed by a hash of the schema, least recently used first
+_tool_state_machines: OrderedDict[str, StateMachine] = OrderedDict()
+_tool_state_machines_lock = threading.Lock()
+
 
 class ToolCallState(AgentState):
+    """
+    The state for calling one of the available tools.
+
+    Every tool's schema is compiled into its own state machine, memoized by the schema,
+    and the tool call state machine is the union of them. Rebuilding the state with tools
+    added or removed therefore only compiles the schemas of the new tools.
+
+    In parallel mode, the state holds a JSON list of tool calls instead of a single call,
+    wrapped in the tool calls delimiters if the model defines them.
+    """
+
     def __init__(
         self,
         tools: list[Tool],
         delimiters: tuple[str, str] | None = None,
         list_delimiters: tuple[str, str] | None = None,
+        compact: bool = False,
+        parallel: bool = False,
+        calls_delimiters: tuple[str, str] | None = None,
     ):
         super().__init__(
             identifier="tool_call",
@@ -22,19 +51,73 @@ class ToolCallState(AgentState):
             emoji="wrench",
         )
         self.list_delimiters = list_delimiters or ("", "")
-        self.tools = tools
+        self.compact = compact
+        self.parallel = parallel
+        self.calls_delimiters = calls_delimiters
+        self.tools = list(tools)
+        self._state_machine: StateMachine | None = None
 
     @property
     def state_machine(self) -> StateMachine:
-        _, state_machine = json_schema_state_machine(
-            [tool.to_dict() for tool in self.tools],
-            delimiters=self.delimiters
+        if self._state_machine is None:
+            if self.parallel:
+                state_machine = EncapsulatedStateMachine(
+                    state_machine=self._tool_list_state_machine(self.tools),
+                    delimiters=self.delimiters,
+                )
+                if self.calls_delimiters:
+                    state_machine = EncapsulatedStateMachine(
+                        state_machine=state_machine,
+                        delimiters=self.calls_delimiters,
+                    )
+            else:
+                tool_state_machines = [self._tool_state_machine(tool) for tool in self.tools]
+                state_machine = EncapsulatedStateMachine(
+                    state_machine=(
+                        tool_state_machines[0]
+                        if len(tool_state_machines) == 1
+                        else AnyStateMachine(tool_state_machines)
+                    ),
+                    delimiters=self.delimiters,
+                )
+            state_machine.identifier = self.identifier
+            self._state_machine = state_machine
+        return self._state_machine
+
+    @property
+    def start_delimiter(self) -> str:
+        if self.parallel and self.calls_delimiters:
+            return self.calls_delimiters[0]
+        return self.delimiters[0]
+
+    @staticmethod
+    def _tool_state_machine(tool: Tool) -> StateMachine:
+        """
+        Get the compiled state machine for a single tool's schema.
+
+        Each tool's schema pins its name with a `const`, so the union only
+        keeps following the tool whose name is being generated.
+        """
+        return _compile_schema(tool.to_dict())
+
+    @staticmethod
+    def _tool_list_state_machine(tools: list[Tool]) -> StateMachine:
+        """
+        Get the compiled state machine for a non-empty list of calls to any of the tools.
+        """
+        return _compile_schema(
+            {
+                "type": "array",
+                "items": {"anyOf": [tool.to_dict() for tool in tools]},
+                "minItems": 1,
+            }
         )
-        state_machine.identifier = self.identifier
-        return state_machine
 
     @property
     def state_prompt(self) -> str:
+        if self.compact:
+            return self.compact_state_prompt
+
         tool_list_start = self.list_delimiters[0]
         tool_list_end = self.list_delimiters[1]
         if tool_list_end.startswith("\n"):
@@ -49,8 +132,60 @@ class ToolCallState(AgentState):
     {tool_list_end}
 
     No other tools are available, and these tools are not available in any other state.
-    Always encapsulate your tool calls within {self.delimiters[0]!r} and {self.delimiters[1]!r} tags.
+    Always encapsulate your tool calls within {self.delimiters[0]!r} and {self.delimiters[1]!r} tags.{self.parallel_prompt}
         """
 
+    @property
+    def compact_state_prompt(self) -> str:
+        """
+        The state prompt listing only the name and a one-line description of every tool.
+
+        Full schemas are left out of the system prompt; the `describe_tool` tool returns them
+        on demand, and the tool call grammar still enforces them.
+        """
+        tool_list = "\n    ".join(f"- {tool.name}: {tool.summary}" for tool in self.tools)
+        return f"""
+    The tool_call state represents your interface for invoking external tools or APIs.
+    You should use this state to call tools or interact with the user.
+
+    The following tools are available:
+    {self.list_delimiters[0]}
+    {tool_list}
+    {self.list_delimiters[1]}
+
+    If you are unsure about a tool's arguments, call the describe_tool tool to get its full schema first.
+    No other tools are available, and these tools are not available in any other state.
+    Always encapsulate your tool calls within {self.delimiters[0]!r} and {self.delimiters[1]!r} tags.{self.parallel_prompt}
+        """
+
+    @property
+    def parallel_prompt(self) -> str:
+        if not self.parallel:
+            return ""
+        return """
+    Tool calls are a JSON list of one or more calls, which are executed concurrently.
+    Only batch calls that do not depend on each other's results."""
+
     def readable_format(self, string: str) -> str:
         return f"```json\n{string}\n```"
+
+
+def _compile_schema(schema: dict) -> StateMachine:
+    """
+    Compile a JSON schema into a state machine, memoized by the schema.
+
+    At most `MAX_COMPILED_TOOL_SCHEMAS` schemas are kept, evicting the least recently used.
+    """
+    key = hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+    with _tool_state_machines_lock:
+        if (state_machine := _tool_state_machines.get(key)) is not None:
+            _tool_state_machines.move_to_end(key)
+            return state_machine
+
+    _, state_machine = json_schema_state_machine(schema)
+    logger.debug(f"Compiled tool schema state machine {key[:8]}")
+    with _tool_state_machines_lock:
+        _tool_state_machines[key] = state_machine
+        while len(_tool_state_machines) > MAX_COMPILED_TOOL_SCHEMAS:
+            _tool_state_machines.popitem(last=False)
+    return state_machine
@@ -13,6 +13,7 @@ class InnerMonologue(AgentState):
             color="dim magenta",
             emoji="speech_balloon",
         )
+        self.character_min = 50
         self.character_max = character_max
 
     @property
@@ -20,7 +21,7 @@ class InnerMonologue(AgentState):
         return FencedFreeformStateMachine(
             self.identifier,
             self.delimiters,
-            char_min=50,
+            char_min=self.character_min,
             char_max=self.character_max,
         )
 
@@ -13,6 +13,7 @@ class Reasoning(AgentState):
             color="dim yellow",
             emoji="bulb",
         )
+        self.character_min = 100
         self.character_max = character_max
 
     @property
@@ -20,7 +21,7 @@ class Reasoning(AgentState):
         return FencedFreeformStateMachine(
             self.identifier,
             self.delimiters,
-            char_min=100,
+            char_min=self.character_min,
             char_max=self.character_max,
         )
 
@@ -14,6 +14,7 @@ class Scratchpad(AgentState):
             color="dim white",
             emoji="pencil",
         )
+        self.character_min = 50
         self.character_max = character_max
 
     @property
@@ -21,7 +22,7 @@ class Scratchpad(AgentState):
         return FencedFreeformStateMachine(
             self.identifier,
             self.delimiters,
-            char_min=50,
+            char_min=self.character_min,
             char_max=self.character_max,
         )
 
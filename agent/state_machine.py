@@ -1,3 +1,16 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import pathlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any
+
 from pse.types.base.any import AnyStateMachine
 from pse.types.base.loop import LoopStateMachine
 from pse_core.state_machine import StateMachine
@@ -14,6 +27,10 @@ from agent.state import (
 )
 from agent.tools import Tool
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CACHED_STATE_MACHINES = 16
+
 
 class AgentStateMachine(StateMachine):
     """
@@ -50,6 +67,7 @@ class AgentStateMachine(StateMachine):
     - The agent begins in PLAN, iteratively cycling (0 to 3 loops) through the unordered states: THINKING, SCRATCHPAD, REASONING, and INNER MONOLOGUE.
     - After planning, it transitions into TAKE ACTION, selecting among TOOLS, PYTHON, or BASH (if enabled).
     - Upon completing the action phase, the agent transitions into DONE.
+    - Without planning, the agent starts in TAKE ACTION, e.g. to act once a planning budget is spent.
     """
 
     def __init__(
@@ -59,32 +77,63 @@ class AgentStateMachine(StateMachine):
         use_bash: bool = False,
         force_planning: bool = True,
         max_planning_loops: int = 3,
-        delimiters_kwargs: dict[str, tuple[str, str] | None] | None = None,
+        delimiters_kwargs: Mapping[str, tuple[str, str] | None] | None = None,
         character_max: int | None = None,
+        compact_tool_catalog: bool = False,
+        include_planning: bool = True,
+        parallel_tool_calls: bool = False,
     ) -> None:
+        # the options the state machine was built with, with tools as their schemas,
+        # so it can be built again elsewhere, e.g. on an inference server
+        self.options: dict[str, Any] = {
+            "tools": [
+                {"name": tool.name, "description": tool.description, "schema": tool.schema}
+                for tool in tools or []
+            ],
+            "use_python": use_python,
+            "use_bash": use_bash,
+            "force_planning": force_planning,
+            "max_planning_loops": max_planning_loops,
+            "delimiters_kwargs": delimiters_kwargs,
+            "character_max": character_max,
+            "compact_tool_catalog": compact_tool_catalog,
+            "include_planning": include_planning,
+            "parallel_tool_calls": parallel_tool_calls,
+        }
         self.states: dict[str, AgentState] = {}
+        self.planning_states: set[str] = set()
         delimiters = delimiters_kwargs or {}
-        planning_states = self.create_planning_states(character_max=character_max, **delimiters)
+        planning_states = (
+            self.create_planning_states(character_max=character_max, **delimiters)
+            if include_planning
+            else []
+        )
         action_states = self.create_action_states(
-            tools=tools, use_python=use_python, use_bash=use_bash, **delimiters
+            tools=tools,
+            use_python=use_python,
+            use_bash=use_bash,
+            compact_tool_catalog=compact_tool_catalog,
+            parallel_tool_calls=parallel_tool_calls,
+            **delimiters,
         )
 
+        state_graph = {"take_action": [(action, "done") for action in action_states]}
+        if planning_states:
+            state_graph["plan"] = [
+                (
+                    LoopStateMachine(
+                        AnyStateMachine(planning_states),
+                        min_loop_count=int(force_planning),
+                        max_loop_count=max_planning_loops,
+                        whitespace_seperator=True,
+                    ),
+                    "take_action",
+                )
+            ]
+
         super().__init__(
-            {
-                "plan": [
-                    (
-                        LoopStateMachine(
-                            AnyStateMachine(planning_states),
-                            min_loop_count=int(force_planning),
-                            max_loop_count=max_planning_loops,
-                            whitespace_seperator=True,
-                        ),
-                        "take_action",
-                    )
-                ],
-                "take_action": [(action, "done") for action in action_states],
-            },
-            start_state="plan",
+            state_graph,
+            start_state="plan" if planning_states else "take_action",
             end_states=["done"],
         )
 
@@ -101,6 +150,12 @@ class AgentStateMachine(StateMachine):
         reasoning_state = Reasoning(delimiters.get("reasoning"), character_max=character_max or 1000)
         self.states[reasoning_state.identifier] = reasoning_state
 
+        self.planning_states = {
+            thinking_state.identifier,
+            scratchpad_state.identifier,
+            inner_monologue_state.identifier,
+            reasoning_state.identifier,
+        }
         return [
             thinking_state.state_machine,
             scratchpad_state.state_machine,
@@ -113,6 +168,8 @@ class AgentStateMachine(StateMachine):
         tools: list[Tool] | None = None,
         use_python: bool = False,
         use_bash: bool = False,
+        compact_tool_catalog: bool = False,
+        parallel_tool_calls: bool = False,
         **delimiters: tuple[str, str] | None,
     ) -> list[StateMachine]:
 
@@ -122,6 +179,9 @@ class AgentStateMachine(StateMachine):
                 tools,
                 delimiters.get("tool_call"),
                 delimiters.get("tool_list"),
+                compact=compact_tool_catalog,
+                parallel=parallel_tool_calls,
+                calls_delimiters=delimiters.get("tool_calls"),
             )
             self.states[tool_state.identifier] = tool_state
             action_states.append(tool_state.state_machine)
@@ -153,3 +213,146 @@ Encapsulate all outputs with the correct delimiters corresponding to your curren
 When operating in any state, embody the state's intended purpose rather than verbally confirming your state.
         """
         return explanation
+
+
+class StateMachineCache:
+    """
+    A process-wide cache of compiled agent state machines.
+
+    Building an `AgentStateMachine` compiles a JSON schema state machine over every tool,
+    which is slow with many tools. State machines are cached under a fingerprint of
+    everything they are built from, so agents with the same tools and options share one,
+    and can optionally be persisted to disk to skip the build across processes.
+    """
+
+    def __init__(
+        self,
+        directory: str | pathlib.Path | None = None,
+        max_entries: int = DEFAULT_MAX_CACHED_STATE_MACHINES,
+    ) -> None:
+        """
+        Args:
+            directory: Directory for persisted state machines.
+                Defaults to `.cache/state_machines` next to this module.
+            max_entries: Number of state machines kept in memory.
+        """
+        self.directory = pathlib.Path(directory or pathlib.Path(__file__).parent / ".cache" / "state_machines")
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, AgentStateMachine] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.build_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(
+        tools: list[Tool] | None = None,
+        use_python: bool = False,
+        use_bash: bool = False,
+        force_planning: bool = True,
+        max_planning_loops: int = 3,
+        delimiters_kwargs: Mapping[str, tuple[str, str] | None] | None = None,
+        character_max: int | None = None,
+        compact_tool_catalog: bool = False,
+        include_planning: bool = True,
+        parallel_tool_calls: bool = False,
+    ) -> str:
+        """
+        Hash the options of an `AgentStateMachine`, including every tool's schema.
+        """
+        options = {
+            "tools": [tool.to_dict() for tool in tools or []],
+            "use_python": use_python,
+            "use_bash": use_bash,
+            "force_planning": force_planning,
+            "max_planning_loops": max_planning_loops,
+            "delimiters": dict(delimiters_kwargs or {}),
+            "character_max": character_max,
+            "compact_tool_catalog": compact_tool_catalog,
+            "include_planning": include_planning,
+            "parallel_tool_calls": parallel_tool_calls,
+        }
+        return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, persist: bool = False, **kwargs) -> tuple[AgentStateMachine, str]:
+        """
+        Get the state machine for the given options, building it on a miss.
+
+        Args:
+            persist: Whether to look up and store the state machine on disk.
+            **kwargs: The options of the `AgentStateMachine`.
+
+        Returns:
+            The state machine and its fingerprint.
+        """
+        fingerprint = self.fingerprint(**kwargs)
+        with self._lock:
+            if (state_machine := self.entries.get(fingerprint)) is not None:
+                self.entries.move_to_end(fingerprint)
+                self.hits += 1
+                return state_machine, fingerprint
+
+            self.misses += 1
+            state_machine = self._load(fingerprint) if persist else None
+            if state_machine is None:
+                start = time.perf_counter()
+                state_machine = AgentStateMachine(**kwargs)
+                elapsed = time.perf_counter() - start
+                self.build_seconds += elapsed
+                logger.info(
+                    f"Built state machine with {len(kwargs.get('tools') or [])} tools in {elapsed:.2f}s"
+                )
+                if persist:
+                    self._store(fingerprint, state_machine)
+
+            self.entries[fingerprint] = state_machine
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+            logger.debug(f"State machine cache stats: {self.stats}")
+            return state_machine, fingerprint
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "build_seconds": round(self.build_seconds, 3),
+            "entries": len(self.entries),
+        }
+
+    def _load(self, fingerprint: str) -> AgentStateMachine | None:
+        path = self.directory / f"{fingerprint}.pkl"
+        if not path.exists():
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                state_machine = pickle.load(f)
+            if isinstance(state_machine, AgentStateMachine):
+                self.disk_hits += 1
+                return state_machine
+        except Exception as e:
+            logger.warning(f"Failed to load persisted state machine {fingerprint}: {e}")
+        return None
+
+    def _store(self, fingerprint: str, state_machine: AgentStateMachine) -> None:
+        path = self.directory / f"{fingerprint}.pkl"
+        temp_path = path.with_suffix(".tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                pickle.dump(state_machine, f)
+            temp_path.replace(path)
+        except Exception as e:
+            logger.warning(f"Failed to persist state machine {fingerprint}: {e}")
+            temp_path.unlink(missing_ok=True)
+
+
+STATE_MACHINE_CACHE = StateMachineCache()
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Any
+
+from pse.types.misc.fenced_freeform import FencedFreeformStateMachine
+
+from agent.system.interaction import Interaction
+from agent.system.memory import Memory
+
+if TYPE_CHECKING:
+    from agent.llm.local import LocalInference
+
+logger = logging.getLogger(__name__)
+
+DIGEST_DELIMITERS = ("```summary\n", "\n```")
+DEFAULT_KEEP_RECENT_TURNS = 2
+DEFAULT_MAX_DIGEST_CHARACTERS = 4000
+# characters of a single interaction shown to the summarizer
+MAX_SUMMARIZED_CHARACTERS = 4000
+# stands in for the next user message while the compacted history is prefilled
+PENDING_USER_MESSAGE = "[[pending user message]]"
+
+SUMMARY_PROMPT = f"""
+You maintain the long-term memory of an AI agent.
+You will be given the earlier part of a conversation between the agent, its user and its tools,
+possibly starting with a summary of what happened before it.
+
+Write a concise summary of it that the agent can continue the conversation from.
+Keep facts, decisions, user preferences, open tasks, and the results of tool calls that still matter.
+Leave out verbatim tool output, repetition, and anything that no longer matters.
+
+Encapsulate the summary within {DIGEST_DELIMITERS[0]!r} and {DIGEST_DELIMITERS[1]!r} tags.
+"""
+
+
+class MemoryCompactor:
+    """
+    Summarizes old turns of the agent's memory into a single digest interaction.
+
+    Compaction runs in the background while the agent waits for user input.
+    Once the history exceeds `trigger_tokens`, every turn but the most recent ones
+    (including the previous digest) is summarized by the loaded model, on a fork of the
+    inference session that shares the inference worker, so it never runs concurrently with
+    the agent's generation; a background prefill of the agent's session is waited for first.
+    The digest is swapped into memory in one step, and the KV cache is prefilled with the
+    compacted history so the next turn does not pay for it.
+
+    Compaction requires a frontend that can fork inference sessions, which the torch frontend cannot.
+    Compaction is cancelled, leaving memory untouched, as soon as the user sends a message.
+    """
+
+    def __init__(
+        self,
+        memory: Memory,
+        inference: LocalInference,
+        trigger_tokens: int,
+        keep_recent_turns: int = DEFAULT_KEEP_RECENT_TURNS,
+        max_digest_characters: int = DEFAULT_MAX_DIGEST_CHARACTERS,
+    ) -> None:
+        """
+        Args:
+            memory: The memory to compact.
+            inference: The agent's inference session.
+            trigger_tokens: The number of history tokens, besides the system prompt, that triggers compaction.
+            keep_recent_turns: The number of most recent turns that are never summarized.
+            max_digest_characters: The maximum length of the digest.
+        """
+        self.memory = memory
+        self.inference = inference
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent_turns = max(1, keep_recent_turns)
+        self.max_digest_characters = max_digest_characters
+
+        self.compactions = 0
+        self.compacted_tokens = 0
+        self.summarize_seconds = 0.0
+        self._session: LocalInference | None = None
+        self._task: asyncio.Task[Interaction | None] | None = None
+
+    def start(self, **inference_kwargs) -> None:
+        """
+        Start compacting in the background, if the history is long enough.
+        """
+        if self._task is not None and not self._task.done():
+            return
+        if self.history_tokens() > self.trigger_tokens:
+            self._task = asyncio.create_task(self.compact(**inference_kwargs))
+
+    async def stop(self) -> None:
+        """
+        Cancel a compaction in progress, and wait for it to stop.
+        """
+        task, self._task = self._task, None
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+            logger.debug("Cancelled memory compaction")
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Memory compaction failed: {e}")
+
+    def history_tokens(self) -> int:
+        return sum(
+            self.inference.count_tokens(event.to_dict())
+            for turn in self.memory.turns()
+            for event in turn
+        )
+
+    async def compact(self, **inference_kwargs) -> Interaction | None:
+        """
+        Summarize all but the most recent turns into a digest, and swap it into memory.
+
+        Args:
+            **inference_kwargs: The agent's inference keyword arguments.
+
+        Returns:
+            The digest, or None if there was nothing to compact.
+        """
+        turns = self.memory.turns()[: -self.keep_recent_turns]
+        window = [event for turn in turns for event in turn]
+        if len(window) < 2:
+            return None
+
+        start = time.perf_counter()
+        summary = await self._summarize(window, **inference_kwargs)
+        elapsed = time.perf_counter() - start
+        self.summarize_seconds += elapsed
+        if not summary:
+            logger.warning("Memory compaction produced no summary")
+            return None
+
+        digest = Interaction(
+            role=Interaction.Role.SYSTEM,
+            content=f"Summary of the earlier conversation:\n{summary}",
+            title="Memory Digest",
+            digest=True,
+        )
+        window_tokens = sum(self.inference.count_tokens(event.to_dict()) for event in window)
+        self.memory.replace_events([event.event_id for event in window], digest)
+        self.compactions += 1
+        self.compacted_tokens += window_tokens - self.inference.count_tokens(digest.to_dict())
+        logger.info(
+            f"Compacted {len(window)} interactions ({window_tokens} tokens) into a digest in {elapsed:.1f}s"
+        )
+
+        self._rewarm(**inference_kwargs)
+        return digest
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "compactions": self.compactions,
+            "compacted_tokens": self.compacted_tokens,
+            "summarize_seconds": round(self.summarize_seconds, 3),
+        }
+
+    async def _summarize(self, window: list[Interaction], **inference_kwargs) -> str | None:
+        # a prefill started before the agent went idle still uses the shared model and radix cache
+        await asyncio.to_thread(self.inference.wait_for_prefill)
+        session = self._summarizer()
+        session.engine.reset()
+        prompt = [
+            Interaction(role=Interaction.Role.SYSTEM, content=SUMMARY_PROMPT).to_dict(),
+            Interaction(role=Interaction.Role.USER, content=self._transcript(window)).to_dict(),
+        ]
+        kwargs = {**inference_kwargs, "prefill": None, "cache_system_prompt": False}
+        stream = session.stream_inference(prompt, **kwargs)
+        async with aclosing(stream):
+            async for _ in stream:
+                pass
+
+        for state, output in session.engine.get_stateful_structured_output():
+            if state == "summary":
+                return str(output).strip()
+        return None
+
+    def _summarizer(self) -> LocalInference:
+        """
+        Get the inference session used for summaries, forking it from the agent's on first use.
+        """
+        if self._session is None:
+            session = self.inference.fork()
+            session.engine.configure(
+                FencedFreeformStateMachine(
+                    "summary",
+                    DIGEST_DELIMITERS,
+                    char_min=1,
+                    char_max=self.max_digest_characters,
+                )
+            )
+            # the fork inherits the agent's states, which do not apply to summaries
+            session.front_end.start_delimiters = (DIGEST_DELIMITERS[0],)
+            session.front_end.freeform_states = {}
+            self._session = session
+        return self._session
+
+    def _rewarm(self, **inference_kwargs: Any) -> None:
+        """
+        Prefill the compacted history, up to the next user message, in the background.
+        """
+        pending = Interaction(role=Interaction.Role.USER, content=PENDING_USER_MESSAGE)
+        prompt = [event.to_dict() for event in self.memory.events.values()] + [pending.to_dict()]
+        try:
+            self.inference.prefill(prompt, PENDING_USER_MESSAGE, **inference_kwargs)
+        except Exception as e:
+            logger.error(f"Failed to prefill the compacted history: {e}")
+
+    @staticmethod
+    def _transcript(window: list[Interaction]) -> str:
+        lines = []
+        for event in window:
+            text = str(event.content).strip()
+            if event.tool_call:
+                text += f"\nTool call: {event.tool_call}"
+            if isinstance(event.tool_result, dict):
+                text += f"\nTool result: {event.tool_result.get('content', '')}"
+            if len(text) > MAX_SUMMARIZED_CHARACTERS:
+                text = text[:MAX_SUMMARIZED_CHARACTERS] + " [...]"
+            lines.append(f"{event.name or event.role.value}: {text}")
+        return "\n\n".join(lines)
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable
+from enum import Enum
+from typing import Any
+
+from agent.system.interaction import Interaction
+from agent.system.memory import Memory
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOW_WATER_RATIO = 0.5
+DEFAULT_KEEP_LAST_TURNS = 8
+
+
+class ContextPolicy(Enum):
+    """
+    How the context window chooses what to evict.
+    """
+
+    # evict the oldest turns
+    SLIDING_WINDOW = "sliding_window"
+    # evict the oldest turns, keeping the interactions that carry tool results for as long as possible
+    KEEP_TOOL_RESULTS = "keep_tool_results"
+    # keep only the last turns once the window is full
+    KEEP_LAST_N = "keep_last_n"
+
+    def __str__(self):
+        return self.value
+
+
+class ContextWindow:
+    """
+    Keeps the prompt built from the agent's memory within a token budget.
+
+    Every interaction's token count is tracked, and the system prompt is always kept.
+    Once the window exceeds `max_tokens`, whole turns are evicted from memory at once,
+    down to a low-water mark well below the budget. Every eviction changes the start
+    of the conversation and invalidates the cached KV prefix after the system prompt,
+    so evicting in large chunks keeps the cache valid for many steps in between.
+
+    A turn starts at a user message and includes the agent's actions that follow it.
+    """
+
+    def __init__(
+        self,
+        memory: Memory,
+        count_tokens: Callable[[dict[str, Any]], int],
+        max_tokens: int,
+        policy: ContextPolicy | str = ContextPolicy.SLIDING_WINDOW,
+        low_water_ratio: float = DEFAULT_LOW_WATER_RATIO,
+        keep_last_turns: int = DEFAULT_KEEP_LAST_TURNS,
+    ) -> None:
+        """
+        Args:
+            memory: The memory holding the conversation.
+            count_tokens: Returns the number of prompt tokens of an interaction dictionary.
+            max_tokens: The token budget of the prompt.
+            policy: The eviction policy.
+            low_water_ratio: The fraction of `max_tokens` the window is evicted down to.
+            keep_last_turns: The number of turns kept by the `KEEP_LAST_N` policy.
+        """
+        self.memory = memory
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.policy = ContextPolicy(policy)
+        self.low_water_tokens = int(max_tokens * min(max(low_water_ratio, 0.0), 1.0))
+        self.keep_last_turns = max(1, keep_last_turns)
+
+        self.evictions = 0
+        self.evicted_interactions = 0
+        self.evicted_tokens = 0
+        self.prefill_tokens_saved = 0
+        self.window_tokens = 0
+        self._token_counts: dict[str, tuple[int, int]] = {}
+
+    def prompt(self) -> list[dict[str, Any]]:
+        """
+        Get the prompt, evicting old turns first if the window is full.
+
+        Returns:
+            The interaction dictionaries of the conversation.
+        """
+        interactions = [event.to_dict() for event in self.memory.events.values()]
+        counts = {interaction["event_id"]: self._count(interaction) for interaction in interactions}
+        self.window_tokens = sum(counts.values())
+
+        if self.window_tokens > self.max_tokens:
+            evicted = self._select_evictions(counts)
+            if evicted:
+                evicted_tokens = sum(counts[event_id] for event_id in evicted)
+                self.memory.remove_events(evicted)
+                interactions = [i for i in interactions if i["event_id"] not in evicted]
+                self.window_tokens -= evicted_tokens
+                self.evictions += 1
+                self.evicted_interactions += len(evicted)
+                self.evicted_tokens += evicted_tokens
+                # the evicted tokens are no longer prefilled, counted once when they are evicted
+                self.prefill_tokens_saved += evicted_tokens
+                logger.info(
+                    f"Evicted {len(evicted)} interactions ({evicted_tokens} tokens) from the context window "
+                    f"({self.policy}), {self.window_tokens}/{self.max_tokens} tokens left"
+                )
+
+        self._token_counts = {
+            event_id: value for event_id, value in self._token_counts.items() if event_id in counts
+        }
+        return interactions
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "window_tokens": self.window_tokens,
+            "max_tokens": self.max_tokens,
+            "evictions": self.evictions,
+            "evicted_interactions": self.evicted_interactions,
+            "evicted_tokens": self.evicted_tokens,
+            "prefill_tokens_saved": self.prefill_tokens_saved,
+        }
+
+    def _count(self, interaction: dict[str, Any]) -> int:
+        """
+        Count an interaction's tokens, memoized until its content changes.
+        """
+        event_id = interaction["event_id"]
+        key = hash((str(interaction.get("content")), str(interaction.get("tool_result"))))
+        cached = self._token_counts.get(event_id)
+        if cached is None or cached[0] != key:
+            cached = (key, self.count_tokens(interaction))
+            self._token_counts[event_id] = cached
+        return cached[1]
+
+    def _select_evictions(self, counts: dict[str, int]) -> set[str]:
+        """
+        Choose the interactions to evict to get down to the low-water mark.
+
+        The current turn is never evicted.
+        """
+        turns = self.memory.turns()[:-1]
+        evicted: set[str] = set()
+        tokens = self.window_tokens
+
+        def evict(events: list[Interaction]) -> None:
+            nonlocal tokens
+            for event in events:
+                if event.event_id not in evicted:
+                    evicted.add(event.event_id)
+                    tokens -= counts.get(event.event_id, 0)
+
+        match self.policy:
+            case ContextPolicy.KEEP_LAST_N:
+                for turn in turns[: max(0, len(turns) + 1 - self.keep_last_turns)]:
+                    evict(turn)
+            case ContextPolicy.KEEP_TOOL_RESULTS:
+                for turn in turns:
+                    if tokens <= self.low_water_tokens:
+                        break
+                    evict([event for event in turn if event.tool_result is None])
+
+        for turn in turns:
+            if tokens <= self.low_water_tokens:
+                break
+            evict(turn)
+
+        return evicted
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from agent.agent import Agent
+    from agent.system.interaction import Interaction
+
+
+class AgentHooks:
+    """
+    Callbacks for the lifecycle of an agent session.
+
+    A session is a sequence of turns; a turn starts with a user message
+    and runs the agent for one or more steps, each generating and taking an action.
+    Subclass and override the events of interest, e.g. for metrics or checkpointing.
+    Every callback is a no-op by default, and errors raised by callbacks are logged, not raised.
+    """
+
+    async def on_turn_start(self, agent: Agent, turn_number: int, message: Interaction) -> None:
+        """
+        Called after a user message was received, before the agent acts on it.
+        """
+
+    async def on_turn_end(self, agent: Agent, turn_number: int) -> None:
+        """
+        Called when the agent hands control back to the user.
+        """
+
+    async def on_step_start(self, agent: Agent, step_number: int) -> None:
+        """
+        Called before the agent generates an action.
+        """
+
+    async def on_step_end(self, agent: Agent, step_number: int) -> None:
+        """
+        Called after the agent took an action.
+        """
+
+    async def on_shutdown(self, agent: Agent) -> None:
+        """
+        Called once when the agent shuts down, before its resources are released.
+        """
@@ -1,17 +1,50 @@
 from __future__ import annotations
 
 import json
+import time
 import uuid
-from datetime import datetime
+from collections.abc import Mapping
 from enum import Enum
+from types import MappingProxyType
 from typing import Any
 
+# optional fields, in the order they are serialized
+FIELDS = (
+    "tool_call",
+    "tool_result",
+    "image_url",
+    "title",
+    "subtitle",
+    "color",
+    "emoji",
+    "last",
+    "silent",
+)
+_NO_EXTRAS: Mapping[str, Any] = MappingProxyType({})
+
 
 class Interaction:
     """
     An interaction in the agent's environment.
+
+    The metadata keys used throughout the agent are typed fields;
+    any other keyword arguments are kept in the `extras` mapping.
+    The dictionary form is cached, and invalidated whenever a field is assigned.
+    Mutating a value in place (e.g. a `tool_result` dictionary) does not invalidate it;
+    assign a new value instead.
     """
 
+    __slots__ = (
+        "event_id",
+        "name",
+        "role",
+        "content",
+        "created_at",
+        *FIELDS,
+        "extras",
+        "_dict",
+    )
+
     class Role(Enum):
         ASSISTANT = "assistant"
         SYSTEM = "system"
@@ -24,14 +57,63 @@ class Interaction:
         name: str | None = None,
         role: Role = Role.SYSTEM,
         content: Any = "",
-        **kwargs,
+        tool_call: dict[str, Any] | list[dict[str, Any]] | str | None = None,
+        tool_result: Interaction | dict[str, Any] | None = None,
+        image_url: str | None = None,
+        title: str | None = None,
+        subtitle: str | None = None,
+        color: str | None = None,
+        emoji: str | None = None,
+        last: bool | None = None,
+        silent: bool | None = None,
+        **extras: Any,
     ) -> None:
         self.content = content
-        self.created_at = datetime.now()
+        self.created_at = time.time()
         self.event_id = event_id or str(uuid.uuid4())
-        self.metadata = kwargs
         self.name = name
         self.role = role
+        self.tool_call = tool_call
+        self.tool_result = tool_result
+        self.image_url = image_url
+        self.title = title
+        self.subtitle = subtitle
+        self.color = color
+        self.emoji = emoji
+        self.last = last
+        self.silent = silent
+        self.extras: Mapping[str, Any] = extras or _NO_EXTRAS
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if name != "_dict":
+            object.__setattr__(self, "_dict", None)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes that are not fields
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return object.__getattribute__(self, "extras").get(name)
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = {name: getattr(self, name) for name in self.__slots__ if name != "_dict"}
+        state["extras"] = dict(self.extras)
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "extras", state.get("extras") or _NO_EXTRAS)
+        object.__setattr__(self, "_dict", None)
+
+    @property
+    def metadata(self) -> Mapping[str, Any]:
+        """
+        A read-only view of the fields that are set, and the extras.
+        """
+        metadata = {field: getattr(self, field) for field in FIELDS if getattr(self, field) is not None}
+        metadata.update(self.extras)
+        return MappingProxyType(metadata)
 
     @property
     def styling(self) -> dict[str, str]:
@@ -39,9 +121,9 @@ class Interaction:
         Get styling information for this event type.
         Returns a dict with title, color, and emoji fields.
         """
-        title: str | None = self.metadata.get("title", self.name)
-        color: str | None = self.metadata.get("color", None)
-        emoji: str | None = self.metadata.get("emoji", None)
+        title: str | None = self.title if self.title is not None else self.name
+        color: str | None = self.color
+        emoji: str | None = self.emoji
 
         match self.role:
             case Interaction.Role.ASSISTANT:
@@ -76,24 +158,38 @@ class Interaction:
                 }
 
     def to_dict(self) -> dict:
-        dict = {
-            "event_id": self.event_id,
-            "role": self.role.value,
-            "content": str(self.content),
-        }
-        for key, value in self.metadata.items():
-            if value and hasattr(value, "to_dict"):
-                dict[key] = value.to_dict()
-            elif isinstance(value, str):
-                dict[key] = value
-            else:
-                dict[key] = value
+        if self._dict is None:
+            dict = {
+                "event_id": self.event_id,
+                "role": self.role.value,
+                "content": str(self.content),
+            }
+            for key, value in self.metadata.items():
+                if value and hasattr(value, "to_dict"):
+                    dict[key] = value.to_dict()
+                else:
+                    dict[key] = value
 
-        if self.role == Interaction.Role.TOOL:
-            dict["tool_call_id"] = str(self.event_id)  # openai
-            dict["tool_used_id"] = str(self.event_id)  # anthropic
+            if self.role == Interaction.Role.TOOL:
+                dict["tool_call_id"] = str(self.event_id)  # openai
+                dict["tool_used_id"] = str(self.event_id)  # anthropic
+            object.__setattr__(self, "_dict", dict)
 
-        return dict
+        return {**self._dict}
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> Interaction:
+        """
+        Create an interaction from its dictionary form.
+
+        Nested interactions, such as tool results, stay dictionaries.
+        """
+        kwargs = {
+            key: value
+            for key, value in data.items()
+            if key not in ("role", "tool_call_id", "tool_used_id")
+        }
+        return cls(role=cls.Role(data.get("role", cls.Role.SYSTEM.value)), **kwargs)
 
     def __str__(self) -> str:
         return json.dumps(self.to_dict(), indent=2)
@@ -108,12 +204,3 @@ class Interaction:
 
     def __hash__(self):
         return hash(self.event_id)
-
-    def __getattribute__(self, name: str) -> Any:
-        try:
-            return object.__getattribute__(self, name)
-        except AttributeError:
-            metadata = object.__getattribute__(self, "metadata")
-            if name in metadata:
-                return metadata[name]
-            return None
@@ -1,15 +1,57 @@
+from __future__ import annotations
+
+from typing import Any
+
 from agent.system.interaction import Interaction
+from agent.system.session_store import SessionStore
 
 
 class Memory:
     """Central memory management system for the agent."""
 
-    def __init__(self):
+    def __init__(self, store: SessionStore | None = None):
         """
         Initialize the Memory with different memory components.
+
+        Args:
+            store: An optional session store journaling every change to the history.
         """
         self.events: dict[str, Interaction] = {}
         self.system_prompt: Interaction | None = None
+        self.store = store
+
+    @staticmethod
+    def from_store(store: SessionStore) -> Memory:
+        """
+        Restore the memory of a stored session, and keep journaling to it.
+        """
+        memory = Memory()
+        memory.restore(*store.load())
+        memory.store = store
+        return memory
+
+    def restore(self, events: list[dict[str, Any]], system_prompt_id: str | None) -> None:
+        """
+        Replace the history with serialized events.
+
+        Args:
+            events: The event dictionaries, as produced by `serialize`.
+            system_prompt_id: The event id of the system prompt, if any.
+        """
+        restored: dict[str, Interaction] = {}
+        for event in events:
+            interaction = Interaction.from_dict(event)
+            restored[interaction.event_id] = interaction
+        self.events = restored
+        self.system_prompt = restored.get(system_prompt_id) if system_prompt_id else None
+        if self.store is not None:
+            self.store.snapshot(self.serialize(), system_prompt_id)
+
+    def serialize(self) -> list[dict[str, Any]]:
+        """
+        Serialize the history, including the names of the events.
+        """
+        return [_serialize(event) for event in self.events.values()]
 
     def append_to_history(self, input_events: list[Interaction] | Interaction) -> None:
         """
@@ -23,9 +65,67 @@ class Memory:
                 raise ValueError("All items in list must be Events")
             for event in input_events:
                 self.events[event.event_id] = event
+            self._record("append", events=[_serialize(event) for event in input_events])
             return
 
         self.events[input_events.event_id] = input_events
+        self._record("append", events=[_serialize(input_events)])
+
+    def remove_events(self, event_ids: set[str] | list[str]) -> None:
+        """
+        Remove events from the agent's history.
+
+        Args:
+            event_ids: The ids of the events to remove. The system prompt is never removed.
+        """
+        removed = []
+        for event_id in event_ids:
+            if self.system_prompt is not None and event_id == self.system_prompt.event_id:
+                continue
+            if self.events.pop(event_id, None) is not None:
+                removed.append(event_id)
+        if removed:
+            self._record("remove", event_ids=removed)
+
+    def replace_events(self, event_ids: set[str] | list[str], replacement: Interaction) -> None:
+        """
+        Replace events with a single event, at the position of the first replaced event.
+
+        The new history is built aside and swapped in with one assignment,
+        so readers never see it half replaced.
+
+        Args:
+            event_ids: The ids of the events to replace. The system prompt is never replaced.
+            replacement: The event taking their place.
+        """
+        replaced = set(event_ids)
+        if self.system_prompt is not None:
+            replaced.discard(self.system_prompt.event_id)
+
+        events: dict[str, Interaction] = {}
+        for event_id, event in self.events.items():
+            if event_id in replaced:
+                events.setdefault(replacement.event_id, replacement)
+            else:
+                events[event_id] = event
+        self.events = events
+        self._record("replace", event_ids=sorted(replaced), event=_serialize(replacement))
+
+    def turns(self) -> list[list[Interaction]]:
+        """
+        Group the history into turns, oldest first.
+
+        A turn starts at a user message and includes the events that follow it.
+        The system prompt is not part of any turn.
+        """
+        turns: list[list[Interaction]] = []
+        for event in self.events.values():
+            if event is self.system_prompt:
+                continue
+            if not turns or event.role == Interaction.Role.USER:
+                turns.append([])
+            turns[-1].append(event)
+        return turns
 
     def update_system_prompt(self, system_prompt: Interaction):
         """
@@ -36,9 +136,26 @@ class Memory:
 
         self.system_prompt = system_prompt
         self.events[system_prompt.event_id] = system_prompt
+        self._record("system_prompt", event=_serialize(system_prompt))
 
     def clear_messages(self):
         """
         Clear all messages from the current message list.
         """
         self.events = {}
+        self._record("clear")
+
+    def _record(self, operation: str, **data: Any) -> None:
+        if self.store is None:
+            return
+        self.store.record(operation, **data)
+        if self.store.should_snapshot():
+            system_prompt_id = self.system_prompt.event_id if self.system_prompt else None
+            self.store.snapshot(self.serialize(), system_prompt_id)
+
+
+def _serialize(event: Interaction) -> dict[str, Any]:
+    serialized = event.to_dict()
+    if event.name is not None:
+        serialized["name"] = event.name
+    return serialized
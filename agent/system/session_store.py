@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pathlib
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_INTERVAL = 200
+SESSIONS_DIRECTORY = pathlib.Path(__file__).parent.parent / ".cache" / "sessions"
+
+
+class SessionStore:
+    """
+    An append-only, on-disk journal of a session's memory.
+
+    Every change to the memory is appended to the journal as one JSON line, with an
+    increasing sequence number. Every `snapshot_interval` records, the whole history
+    is written to a snapshot and the journal is truncated, so loading a session reads
+    one snapshot and a bounded number of records.
+
+    Records already contained in the snapshot are skipped when loading, so a crash
+    between writing a snapshot and truncating the journal does not replay them twice.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        directory: str | pathlib.Path | None = None,
+        snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+        durable: bool = False,
+    ) -> None:
+        """
+        Args:
+            session_id: The name of the session.
+            directory: The directory holding the session files.
+                Defaults to `.cache/sessions` in the agent package.
+            snapshot_interval: The number of journal records between snapshots.
+            durable: Whether to fsync every record, surviving power loss rather than only crashes.
+        """
+        self.session_id = session_id
+        self.directory = pathlib.Path(directory or SESSIONS_DIRECTORY)
+        self.snapshot_interval = max(1, snapshot_interval)
+        self.durable = durable
+        self.journal_path = self.directory / f"{session_id}.jsonl"
+        self.snapshot_path = self.directory / f"{session_id}.snapshot.json"
+        self.sequence = 0
+        self._journal_records = 0
+
+    def exists(self) -> bool:
+        return self.journal_path.exists() or self.snapshot_path.exists()
+
+    def record(self, operation: str, **data: Any) -> None:
+        """
+        Append a record to the journal.
+
+        Args:
+            operation: The memory operation, e.g. "append" or "remove".
+            **data: The JSON serializable arguments of the operation.
+        """
+        self.sequence += 1
+        line = json.dumps({"seq": self.sequence, "op": operation, **data}, default=str)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, "a") as f:
+                f.write(line + "\n")
+                f.flush()
+                if self.durable:
+                    os.fsync(f.fileno())
+            self._journal_records += 1
+        except OSError as e:
+            logger.error(f"Failed to write to the session journal {self.journal_path}: {e}")
+
+    def should_snapshot(self) -> bool:
+        return self._journal_records >= self.snapshot_interval
+
+    def snapshot(self, events: list[dict[str, Any]], system_prompt_id: str | None) -> None:
+        """
+        Write the whole history to the snapshot, and truncate the journal.
+        """
+        snapshot = {
+            "seq": self.sequence,
+            "system_prompt_id": system_prompt_id,
+            "events": events,
+        }
+        temp_path = self.snapshot_path.with_suffix(".tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, "w") as f:
+                json.dump(snapshot, f, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            temp_path.replace(self.snapshot_path)
+            self.journal_path.write_text("")
+            self._journal_records = 0
+            logger.debug(f"Wrote session snapshot with {len(events)} events to {self.snapshot_path}")
+        except OSError as e:
+            logger.error(f"Failed to write the session snapshot {self.snapshot_path}: {e}")
+            temp_path.unlink(missing_ok=True)
+
+    def load(self) -> tuple[list[dict[str, Any]], str | None]:
+        """
+        Replay the snapshot and the journal.
+
+        Returns:
+            The event dictionaries of the history, in order, and the system prompt's event id.
+        """
+        events: dict[str, dict[str, Any]] = {}
+        system_prompt_id: str | None = None
+        sequence = 0
+
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            events = {event["event_id"]: event for event in snapshot["events"]}
+            system_prompt_id = snapshot.get("system_prompt_id")
+            sequence = snapshot.get("seq", 0)
+
+        records = 0
+        if self.journal_path.exists():
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a record torn by a crash can only be the last one
+                        logger.warning(f"Skipping a corrupt record in {self.journal_path}")
+                        continue
+                    if record["seq"] <= sequence:
+                        continue
+                    sequence = record["seq"]
+                    records += 1
+                    system_prompt_id = self._replay(record, events, system_prompt_id)
+
+        self.sequence = sequence
+        self._journal_records = records
+        logger.info(f"Loaded session {self.session_id!r} with {len(events)} events ({records} journal records)")
+        return list(events.values()), system_prompt_id
+
+    @staticmethod
+    def _replay(
+        record: dict[str, Any],
+        events: dict[str, dict[str, Any]],
+        system_prompt_id: str | None,
+    ) -> str | None:
+        match record["op"]:
+            case "append":
+                for event in record["events"]:
+                    events[event["event_id"]] = event
+            case "system_prompt":
+                event = record["event"]
+                events[event["event_id"]] = event
+                system_prompt_id = event["event_id"]
+            case "remove":
+                for event_id in record["event_ids"]:
+                    events.pop(event_id, None)
+            case "replace":
+                replaced = set(record["event_ids"])
+                replacement = record["event"]
+                replayed: dict[str, dict[str, Any]] = {}
+                for event_id, event in events.items():
+                    if event_id in replaced:
+                        replayed.setdefault(replacement["event_id"], replacement)
+                    else:
+                        replayed[event_id] = event
+                events.clear()
+                events.update(replayed)
+            case "clear":
+                events.clear()
+            case operation:
+                logger.warning(f"Unknown session journal operation: {operation}")
+        return system_prompt_id
@@ -1,7 +1,9 @@
 """Setup wizard for configuring and initializing an agent."""
 from agent.agent import Agent
 from agent.interface import Interface
+from agent.llm import get_available_models
 from agent.llm.local import LocalInference
+from agent.llm.remote import RemoteInference
 
 # Default agent configuration
 DEFAULT_AGENT_KWARGS = {
@@ -23,9 +25,35 @@ DEFAULT_AGENT_KWARGS = {
     # Planning behavior
     "max_planning_loops": 5,
     "force_planning": False,
+    "planning_token_budget": 0,
     # Caching options
     "reuse_prompt_cache": True,
     "cache_system_prompt": True,
+    "incremental_encoding": True,
+    "verify_incremental_encoding": False,
+    "persist_state_machines": False,
+    "compact_tool_catalog": False,
+    # Context window (0 tokens for unlimited)
+    "context_window_tokens": 0,
+    "context_policy": "sliding_window",
+    "context_low_water_ratio": 0.5,
+    "context_keep_last_turns": 8,
+    # Memory compaction (0 tokens to disable)
+    "compaction_trigger_tokens": 0,
+    "compaction_keep_recent_turns": 2,
+    # Session persistence
+    "persist_session": False,
+    # Tool execution
+    "parallel_tool_calls": False,
+    "tool_call_timeout": 0,
+    "overlap_prefill": True,
+    # Decoding optimizations
+    "num_draft_tokens": 4,
+    "prompt_lookup_tokens": 0,
+    "prompt_lookup_ngram_size": 3,
+    "fast_forward_forced_tokens": False,
+    "vectorized_logits_mask": False,
+    "max_buffered_tokens": 32,
     # MCP configuration
     "default_mcp_servers": [],
     "connect_default_mcp_servers": True,
@@ -94,13 +122,32 @@ async def configure_basic_options(interface: Interface) -> tuple[str, str, str,
     model_path = await Agent.get_model_path(interface)
     frontend_response = await interface.get_input(
         message="Inference Backend",
-        choices=["mlx", "torch"],
+        choices=["mlx", "torch", "server"],
         default="mlx",
     )
     chosen_frontend: str = frontend_response.content
 
     return agent_name, system_prompt_name, model_path, chosen_frontend
 
+async def configure_draft_model(interface: Interface, model_path: str) -> str | None:
+    """Optionally select a draft model for speculative decoding."""
+    if not await get_boolean_option(interface, "Use speculative decoding", False):
+        return None
+
+    available_models = {
+        name: path for name, path, _ in get_available_models() if path != model_path
+    }
+    if not available_models:
+        await interface.show_output("No other local models found to use as a draft model.")
+        return None
+
+    response = await interface.get_input(
+        message="Draft Model",
+        choices=list(available_models.keys()),
+        default=next(iter(available_models.keys())),
+    )
+    return available_models[response.content]
+
 async def setup_agent(interface: Interface) -> Agent:
     """
     Run an interactive setup wizard to configure and initialize an agent.
@@ -123,6 +170,7 @@ async def setup_agent(interface: Interface) -> Agent:
 
     # Start with default configuration
     agent_kwargs = DEFAULT_AGENT_KWARGS.copy()
+    draft_model_path: str | None = None
 
     # Ask for configuration mode (simple vs. advanced)
     config_mode_response = await interface.get_input(
@@ -153,6 +201,24 @@ async def setup_agent(interface: Interface) -> Agent:
             DEFAULT_AGENT_KWARGS["include_bash"]
         )
 
+        agent_kwargs["compact_tool_catalog"] = await get_boolean_option(
+            interface,
+            "Compact tool catalog (schemas on demand)",
+            DEFAULT_AGENT_KWARGS["compact_tool_catalog"]
+        )
+        agent_kwargs["parallel_tool_calls"] = await get_boolean_option(
+            interface,
+            "Parallel tool calls",
+            DEFAULT_AGENT_KWARGS["parallel_tool_calls"]
+        )
+        agent_kwargs["tool_call_timeout"] = await get_numeric_option(
+            interface,
+            "tool call timeout in seconds (0 for none)",
+            DEFAULT_AGENT_KWARGS["tool_call_timeout"],
+            min_value=0,
+            max_value=3600
+        )
+
         # Voice capabilities
         agent_kwargs["enable_voice"] = await get_boolean_option(
             interface,
@@ -174,6 +240,13 @@ async def setup_agent(interface: Interface) -> Agent:
             min_value=1,
             max_value=10
         )
+        agent_kwargs["planning_token_budget"] = await get_numeric_option(
+            interface,
+            "planning token budget per step (0 for unlimited)",
+            DEFAULT_AGENT_KWARGS["planning_token_budget"],
+            min_value=0,
+            max_value=10000
+        )
 
         # ----- Performance Options -----
         await show_section_header(interface, "PERFORMANCE")
@@ -187,6 +260,56 @@ async def setup_agent(interface: Interface) -> Agent:
             "Cache system prompt",
             DEFAULT_AGENT_KWARGS["cache_system_prompt"]
         )
+        agent_kwargs["context_window_tokens"] = await get_numeric_option(
+            interface,
+            "context window token budget (0 for unlimited)",
+            DEFAULT_AGENT_KWARGS["context_window_tokens"],
+            min_value=0,
+            max_value=1000000
+        )
+        agent_kwargs["persist_session"] = await get_boolean_option(
+            interface,
+            "Persist and resume the session",
+            DEFAULT_AGENT_KWARGS["persist_session"]
+        )
+        agent_kwargs["compaction_trigger_tokens"] = await get_numeric_option(
+            interface,
+            "summarize old turns above this many tokens (0 to disable)",
+            DEFAULT_AGENT_KWARGS["compaction_trigger_tokens"],
+            min_value=0,
+            max_value=1000000
+        )
+        agent_kwargs["overlap_prefill"] = await get_boolean_option(
+            interface,
+            "Prefill the next step while tools run",
+            DEFAULT_AGENT_KWARGS["overlap_prefill"]
+        )
+        agent_kwargs["fast_forward_forced_tokens"] = await get_boolean_option(
+            interface,
+            "Fast-forward grammar-forced tokens",
+            DEFAULT_AGENT_KWARGS["fast_forward_forced_tokens"]
+        )
+        agent_kwargs["vectorized_logits_mask"] = await get_boolean_option(
+            interface,
+            "Memoize logits masks in freeform states",
+            DEFAULT_AGENT_KWARGS["vectorized_logits_mask"]
+        )
+        agent_kwargs["prompt_lookup_tokens"] = await get_numeric_option(
+            interface,
+            "prompt lookup tokens per step",
+            DEFAULT_AGENT_KWARGS["prompt_lookup_tokens"],
+            min_value=0,
+            max_value=32,
+        )
+        draft_model_path = await configure_draft_model(interface, model_path)
+        if draft_model_path:
+            agent_kwargs["num_draft_tokens"] = await get_numeric_option(
+                interface,
+                "draft tokens per step",
+                DEFAULT_AGENT_KWARGS["num_draft_tokens"],
+                min_value=1,
+                max_value=16,
+            )
 
         # ----- Inference Parameters -----
         if await get_boolean_option(interface, "Configure inference parameters", False):
@@ -261,8 +384,17 @@ async def setup_agent(interface: Interface) -> Agent:
 
     # Initialize agent and model
     with interface.console.status("Loading model and initializing agent..."):
-        # Load the model
-        inference = LocalInference(model_path, frontend=chosen_frontend)
+        # Load the model, or connect to an inference server hosting it
+        inference: LocalInference | RemoteInference
+        if chosen_frontend == "server":
+            inference = RemoteInference(model_path)
+            await inference.connect()
+        else:
+            inference = LocalInference(
+                model_path,
+                frontend=chosen_frontend,
+                draft_model_path=draft_model_path,
+            )
 
         # Create the agent
         agent = Agent(
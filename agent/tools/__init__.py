@@ -209,6 +209,16 @@ class Tool:
                 return schema[name]
             return None
 
+    @property
+    def summary(self) -> str:
+        """
+        The first line of the tool's description.
+        """
+        for line in (self.description or "").strip().splitlines():
+            if line.strip():
+                return line.strip()
+        return self.name
+
     def __str__(self) -> str:
         tool = self.to_dict().get("properties", {})
         tool_str = f'\nTool name: "{self.name}"'
@@ -0,0 +1,36 @@
+from agent.agent import Agent
+from agent.system.interaction import Interaction
+
+
+def describe_tool(
+    self: Agent,
+    tool_name: str,
+) -> Interaction:
+    """
+    Get the full description and argument schema of an available tool.
+    Use this before calling a tool whose arguments you are unsure about,
+    since the tool list only contains the name and a one-line description of each tool.
+
+    Args:
+        tool_name (str): The name of the tool to describe.
+
+    Returns:
+        Interaction: An Interaction object containing the tool's description and schema.
+    """
+    tool = self.tools.get(tool_name)
+    if not tool:
+        return Interaction(
+            role=Interaction.Role.TOOL,
+            content=f"Tool '{tool_name}' not found. Available tools: {', '.join(self.tools)}.",
+            title="Tool Description",
+            color="yellow",
+            emoji="warning",
+        )
+
+    return Interaction(
+        role=Interaction.Role.TOOL,
+        content=str(tool),
+        title=f"{self.name} looked up the {tool_name} tool",
+        color="green",
+        emoji="mag",
+    )
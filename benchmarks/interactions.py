@@ -0,0 +1,105 @@
+"""
+Benchmark attribute access, serialization and memory of many interactions.
+
+Builds a history of synthetic interactions, as in a long session: user messages,
+assistant actions with tool calls, and tool results nesting an interaction. Then times
+reading the fields the CLI and the chat template read, `styling`, the first `to_dict`
+of every interaction and the cached one after it, and measures the memory allocated.
+
+Usage:
+    python -m benchmarks.interactions [--interactions 10000] [--repeat 5]
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+from collections.abc import Callable
+
+from agent.system.interaction import Interaction
+
+
+def synthetic_interactions(count: int) -> list[Interaction]:
+    interactions = []
+    for i in range(count):
+        match i % 3:
+            case 0:
+                interaction = Interaction(role=Interaction.Role.USER, content=f"Message number {i}.")
+            case 1:
+                interaction = Interaction(
+                    role=Interaction.Role.ASSISTANT,
+                    name="agent",
+                    content=f"Looking up item {i}.",
+                    tool_call={"name": "search", "arguments": {"query": f"item {i}"}},
+                )
+            case _:
+                interaction = Interaction(
+                    role=Interaction.Role.TOOL,
+                    content="",
+                    tool_result=Interaction(role=Interaction.Role.TOOL, content=f"Result {i}.", color="yellow"),
+                    silent=False,
+                )
+        interactions.append(interaction)
+    return interactions
+
+
+def read_fields(interactions: list[Interaction]) -> None:
+    for interaction in interactions:
+        interaction.role, interaction.content, interaction.name  # noqa: B018
+        interaction.tool_call, interaction.tool_result, interaction.image_url  # noqa: B018
+        interaction.title, interaction.last, interaction.silent, interaction.unknown_key  # noqa: B018
+
+
+def read_styling(interactions: list[Interaction]) -> None:
+    for interaction in interactions:
+        interaction.styling  # noqa: B018
+
+
+def serialize(interactions: list[Interaction]) -> None:
+    for interaction in interactions:
+        interaction.to_dict()
+
+
+def invalidate(interactions: list[Interaction]) -> None:
+    for interaction in interactions:
+        interaction.title = None
+        if isinstance(interaction.tool_result, Interaction):
+            interaction.tool_result.title = None
+
+
+def time_median(
+    run: Callable[[list[Interaction]], None],
+    interactions: list[Interaction],
+    repeat: int,
+    before: Callable[[list[Interaction]], None] | None = None,
+) -> float:
+    times = []
+    for _ in range(repeat):
+        if before:
+            before(interactions)
+        start = time.perf_counter()
+        run(interactions)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interactions", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    interactions = synthetic_interactions(args.interactions)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{args.interactions} interactions, {allocated / 1024**2:.1f} MB allocated")
+    print(f"{'attribute access':>18} {time_median(read_fields, interactions, args.repeat) * 1e3:>8.1f}ms")
+    print(f"{'styling':>18} {time_median(read_styling, interactions, args.repeat) * 1e3:>8.1f}ms")
+    print(f"{'to_dict':>18} {time_median(serialize, interactions, args.repeat, before=invalidate) * 1e3:>8.1f}ms")
+    print(f"{'to_dict, cached':>18} {time_median(serialize, interactions, args.repeat) * 1e3:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
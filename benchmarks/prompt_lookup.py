@@ -0,0 +1,156 @@
+"""
+Benchmark prompt-lookup speculative decoding on recorded sessions.
+
+Sessions recorded with `persist_session` are replayed from their session store.
+For every assistant step, the tokens of the step are taken from the chat template,
+and `PromptLookup` proposes continuations from the prompt and the tokens generated
+so far, as the MLX decode loop does. A proposal is accepted up to its first token
+that differs from the recorded one, and every verification pass also yields the
+next token, so the tokens per forward pass bound the speedup over one-token decoding.
+
+With `--generate`, the prompts of the last steps are also generated with the model,
+with and without prompt lookup, and the decode speed is reported.
+
+Usage:
+    python -m benchmarks.prompt_lookup <model_path> [session ...] [--lookup-tokens 8]
+        [--ngram-size 3] [--generate] [--max-tokens 256]
+"""
+
+import argparse
+import statistics
+import time
+from typing import Any
+
+from agent.llm.prompt_lookup import PromptLookup
+from agent.llm.radix_cache import common_prefix_length
+from agent.llm.tokenizer import Tokenizer
+from agent.system.session_store import SESSIONS_DIRECTORY, SessionStore
+
+
+def recorded_steps(tokenizer: Tokenizer, session_id: str) -> list[tuple[list[dict[str, Any]], list[int], list[int]]]:
+    """
+    The assistant steps of a recorded session.
+
+    Returns:
+        The prompt, its tokens, and the tokens of the assistant's response, for every step.
+    """
+    events, _ = SessionStore(session_id).load()
+    template_kwargs = tokenizer.control_tokens.model_dump()
+    steps = []
+    for i, event in enumerate(events):
+        if event.get("role") != "assistant":
+            continue
+        prompt = events[:i]
+        prompt_text = tokenizer.render(prompt, add_generation_prompt=True, **template_kwargs)
+        prompt_ids = tokenizer.encode(prompt_text, add_special_tokens=False)
+        step_ids = tokenizer.encode(tokenizer.render(events[: i + 1], **template_kwargs), add_special_tokens=False)
+        if common_prefix_length(prompt_ids, step_ids) == len(prompt_ids):
+            steps.append((prompt, prompt_ids, step_ids[len(prompt_ids) :]))
+    return steps
+
+
+def replay(prompt_ids: list[int], generated: list[int], lookup_tokens: int, ngram_size: int) -> dict[str, int]:
+    """
+    Decode the recorded tokens with prompt lookup, accepting proposals that match them.
+    """
+    lookup = PromptLookup(ngram_size)
+    token_ids = list(prompt_ids)
+    lookup.reset(token_ids)
+    stats = {"tokens": len(generated), "forward_passes": 0, "proposed": 0, "accepted": 0}
+    position = 0
+    while position < len(generated):
+        draft = lookup.propose(min(lookup_tokens, len(generated) - position))
+        accepted = common_prefix_length(draft, generated[position : position + len(draft)])
+        stats["forward_passes"] += 1
+        stats["proposed"] += len(draft)
+        stats["accepted"] += accepted
+        # the verification pass also samples the token after the accepted ones
+        step = min(accepted + 1, len(generated) - position)
+        token_ids.extend(generated[position : position + step])
+        position += step
+    return stats
+
+
+def generate(model_path: str, prompts: list[list[dict[str, Any]]], max_tokens: int, lookup_tokens: int, ngram_size: int) -> None:
+    from agent.llm.local import LocalInference
+    from agent.state_machine import STATE_MACHINE_CACHE
+
+    inference = LocalInference(model_path, "mlx")
+    state_machine, _ = STATE_MACHINE_CACHE.get(delimiters_kwargs=inference.front_end.tokenizer.delimiters)
+    inference.configure(state_machine)
+
+    print(f"{'lookup':>7} {'tokens':>7} {'tokens/sec':>11}")
+    for tokens in (0, lookup_tokens):
+        rates = []
+        generated = 0
+        for prompt in prompts:
+            inference.engine.reset()
+            inference.front_end.reset_cache()
+            start = time.perf_counter()
+            n = sum(
+                1
+                for _ in inference.run_inference(
+                    prompt,
+                    max_tokens=max_tokens,
+                    seed=11,
+                    prompt_lookup_tokens=tokens,
+                    prompt_lookup_ngram_size=ngram_size,
+                    reuse_prompt_cache=False,
+                    cache_system_prompt=False,
+                )
+            )
+            decode_seconds = time.perf_counter() - start - inference.step_timings.get("first_token_seconds", 0.0)
+            if n > 1 and decode_seconds > 0:
+                rates.append((n - 1) / decode_seconds)
+            generated += n
+        print(f"{tokens:>7} {generated:>7} {statistics.median(rates) if rates else 0:>11.1f}")
+        if tokens:
+            print(f"acceptance rates: {inference.front_end.acceptance_rates}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_path")
+    parser.add_argument("sessions", nargs="*", help=f"Session names in {SESSIONS_DIRECTORY}, defaults to all")
+    parser.add_argument("--lookup-tokens", type=int, default=8)
+    parser.add_argument("--ngram-size", type=int, default=3)
+    parser.add_argument("--generate", action="store_true", help="Also time generation with the model")
+    parser.add_argument("--steps", type=int, default=5, help="Number of recorded steps to generate")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    sessions = args.sessions or sorted(
+        {path.name.split(".")[0] for path in SESSIONS_DIRECTORY.glob("*.json*")}
+    )
+    if not sessions:
+        parser.error(f"No recorded sessions in {SESSIONS_DIRECTORY}, run the agent with persist_session")
+
+    tokenizer = Tokenizer.load(args.model_path)
+    prompts = []
+    totals = {"tokens": 0, "forward_passes": 0, "proposed": 0, "accepted": 0}
+    print(f"{'session':>20} {'steps':>6} {'tokens':>7} {'accepted':>9} {'tokens/pass':>12}")
+    for session_id in sessions:
+        steps = recorded_steps(tokenizer, session_id)
+        session_totals = dict.fromkeys(totals, 0)
+        for prompt, prompt_ids, generated in steps:
+            for key, value in replay(prompt_ids, generated, args.lookup_tokens, args.ngram_size).items():
+                session_totals[key] += value
+            prompts.append(prompt)
+        for key, value in session_totals.items():
+            totals[key] += value
+        print(
+            f"{session_id[:20]:>20} {len(steps):>6} {session_totals['tokens']:>7} "
+            f"{session_totals['accepted'] / max(session_totals['proposed'], 1):>9.1%} "
+            f"{session_totals['tokens'] / max(session_totals['forward_passes'], 1):>12.2f}"
+        )
+
+    print(
+        f"acceptance rate {totals['accepted'] / max(totals['proposed'], 1):.1%} of {totals['proposed']} proposed tokens, "
+        f"{totals['tokens'] / max(totals['forward_passes'], 1):.2f} tokens per forward pass"
+    )
+    if args.generate:
+        generate(args.model_path, prompts[-args.steps :], args.max_tokens, args.lookup_tokens, args.ngram_size)
+
+
+if __name__ == "__main__":
+    main()
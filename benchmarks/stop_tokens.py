@@ -0,0 +1,78 @@
+"""
+Benchmark the stop-token check of the decode loop.
+
+Every generated token is checked against the tokenizer's stop tokens. Before the
+control-token data was frozen at load, every access of `Tokenizer.stop_tokens`
+encoded the end tokens again; now it returns a precomputed frozenset, which the
+decode loop binds once per generation. Three per-token checks are compared:
+
+    encoded   encoding the end tokens on every check, as `stop_tokens` used to
+    property  accessing the frozen `stop_tokens` property on every check
+    bound     checking a frozenset bound once, as the decode loop does
+
+Only the tokenizer of the model is loaded.
+
+Usage:
+    python -m benchmarks.stop_tokens <model_path> [--tokens 100000] [--repeat 5]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from collections.abc import Callable
+
+from agent.llm.tokenizer import Tokenizer
+
+
+def encoded_stop_tokens(tokenizer: Tokenizer) -> set[int]:
+    """
+    The stop tokens, encoded on every call.
+    """
+    return {
+        tokenizer._tokenizer.encode(stop_token, add_special_tokens=False)[0]
+        for stop_token in tokenizer.control_tokens.end_tokens()
+    }
+
+
+def check_encoded(tokenizer: Tokenizer, token_ids: list[int]) -> int:
+    return sum(token_id in encoded_stop_tokens(tokenizer) for token_id in token_ids)
+
+
+def check_property(tokenizer: Tokenizer, token_ids: list[int]) -> int:
+    return sum(token_id in tokenizer.stop_tokens for token_id in token_ids)
+
+
+def check_bound(tokenizer: Tokenizer, token_ids: list[int]) -> int:
+    stop_tokens = tokenizer.stop_tokens
+    return sum(token_id in stop_tokens for token_id in token_ids)
+
+
+def time_check(check: Callable[[Tokenizer, list[int]], int], tokenizer: Tokenizer, token_ids: list[int]) -> float:
+    start = time.perf_counter()
+    check(tokenizer, token_ids)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_path")
+    parser.add_argument("--tokens", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tokenizer = Tokenizer.load(args.model_path)
+    assert encoded_stop_tokens(tokenizer) == tokenizer.stop_tokens
+    vocabulary_size = len(tokenizer._tokenizer)
+    rng = random.Random(0)
+    token_ids = [rng.randrange(vocabulary_size) for _ in range(args.tokens)]
+    print(f"{len(tokenizer.stop_tokens)} stop tokens, {args.tokens} generated tokens")
+
+    print(f"{'check':>9} {'per token':>11} {'total':>9}")
+    for name, check in (("encoded", check_encoded), ("property", check_property), ("bound", check_bound)):
+        seconds = statistics.median(time_check(check, tokenizer, token_ids) for _ in range(args.repeat))
+        print(f"{name:>9} {seconds / args.tokens * 1e9:>9.0f}ns {seconds:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark decoding long thinking outputs with and without the vectorized logits mask.
+
+With `vectorized_logits_mask`, the MLX decode loop applies the engine's mask as one dense
+array, memoized by state fingerprint inside freeform states such as thinking, instead of
+calling the engine's logits processor for every token. The model is asked to think at length,
+and the decode speed of the thinking tokens is compared, along with the mask reuse.
+
+Usage:
+    python -m benchmarks.thinking_mask <model_path> [--max-tokens 1000] [--repeat 3]
+"""
+
+import argparse
+import statistics
+import time
+from typing import Any
+
+from agent.llm.local import LocalInference
+from agent.state_machine import STATE_MACHINE_CACHE
+from agent.tools import Tool
+
+PROMPT = [
+    {
+        "role": "system",
+        "content": "Think step by step, at length, before acting.",
+    },
+    {
+        "role": "user",
+        "content": "Think through how you would design a cache for a web service, covering eviction, "
+        "invalidation, consistency and failure modes, then send me a one-line summary.",
+    },
+]
+
+
+def decode(inference: LocalInference, vectorized: bool, max_tokens: int, seed: int) -> tuple[int, float]:
+    """
+    Generate a response, timing the tokens generated in the thinking state.
+
+    Returns:
+        The number of thinking tokens, and the seconds spent decoding them.
+    """
+    inference.engine.reset()
+    inference.front_end.reset_cache()
+    thinking_tokens = 0
+    thinking_seconds = 0.0
+    last = time.perf_counter()
+    for n, _ in enumerate(
+        inference.run_inference(
+            PROMPT,
+            max_tokens=max_tokens,
+            seed=seed,
+            vectorized_logits_mask=vectorized,
+            reuse_prompt_cache=False,
+            cache_system_prompt=False,
+        )
+    ):
+        now = time.perf_counter()
+        live_output: Any = inference.engine.get_live_structured_output()
+        # the first token includes the prefill
+        if n and live_output and live_output[0] == "thinking":
+            thinking_tokens += 1
+            thinking_seconds += now - last
+        last = now
+    return thinking_tokens, thinking_seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_path")
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--character-max", type=int, default=5000, help="Character limit of the thinking state")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    inference = LocalInference(args.model_path, "mlx")
+    state_machine, _ = STATE_MACHINE_CACHE.get(
+        tools=Tool.load(file_name="send_message"),
+        force_planning=True,
+        max_planning_loops=1,
+        character_max=args.character_max,
+        delimiters_kwargs=inference.front_end.tokenizer.delimiters,
+    )
+    inference.configure(state_machine)
+
+    print(f"{'vectorized':>10} {'thinking tokens':>16} {'tokens/sec':>11} {'mask hits':>10} {'misses':>7}")
+    for vectorized in (False, True):
+        rates, tokens, hits, misses = [], 0, 0, 0
+        for run in range(args.repeat):
+            thinking_tokens, seconds = decode(inference, vectorized, args.max_tokens, seed=run)
+            tokens += thinking_tokens
+            if seconds:
+                rates.append(thinking_tokens / seconds)
+            if vectorized:
+                hits += inference.front_end.decode_stats["mask_hits"]
+                misses += inference.front_end.decode_stats["mask_misses"]
+        print(
+            f"{vectorized!s:>10} {tokens:>16} {statistics.median(rates) if rates else 0:>11.1f} "
+            f"{hits:>10} {misses:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark adding tools to an agent that already has many.
+
+Builds the agent state machine for a base set of synthetic tools, then adds
+1, 10 and 100 more, the way `Agent.add_tools` does: the state machine is rebuilt
+for the new set of tools, and only the schemas that were not compiled before are compiled.
+Each step is compared with a cold build, which compiles every schema.
+
+Usage:
+    python -m benchmarks.tool_registration [--base-tools 200] [--repeat 3]
+"""
+
+import argparse
+import statistics
+import time
+
+from agent.state.action import tool_call
+from agent.state_machine import StateMachineCache
+from agent.tools import Tool
+
+
+def synthetic_tools(count: int, offset: int = 0) -> list[Tool]:
+    return [
+        Tool(
+            f"tool_{i}",
+            f"Synthetic tool number {i}.",
+            schema={
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "What to look up."},
+                    "limit": {"type": "integer", "minimum": 1, "maximum": 100},
+                    "mode": {"enum": ["fast", "exact", f"custom_{i}"]},
+                },
+                "required": ["query"],
+            },
+        )
+        for i in range(offset, offset + count)
+    ]
+
+
+def build(tools: list[Tool]) -> tuple[float, int]:
+    """
+    Build the state machine for the tools, bypassing the state machine cache.
+
+    Returns:
+        The build time in seconds, and the number of schemas compiled.
+    """
+    compiled = set(tool_call._tool_state_machines)
+    start = time.perf_counter()
+    StateMachineCache().get(tools=tools)
+    return time.perf_counter() - start, len(set(tool_call._tool_state_machines) - compiled)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-tools", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if args.base_tools + 100 > tool_call.MAX_COMPILED_TOOL_SCHEMAS:
+        parser.error(f"At most {tool_call.MAX_COMPILED_TOOL_SCHEMAS - 100} base tools fit the compiled schema cache")
+
+    base_tools = synthetic_tools(args.base_tools)
+    tool_call._tool_state_machines.clear()
+    seconds, compiled = build(base_tools)
+    print(f"base: {args.base_tools} tools built in {seconds:.3f}s ({compiled} schemas compiled)")
+
+    print(f"{'added':>6} {'incremental':>12} {'compiled':>9} {'cold':>9} {'compiled':>9}")
+    for added in (1, 10, 100):
+        incremental, cold = [], []
+        for run in range(args.repeat):
+            # fresh tool names every run, so nothing is compiled yet
+            new_tools = synthetic_tools(added, offset=args.base_tools + 1000 * (run + 1) * added)
+            seconds, incremental_compiled = build(base_tools + new_tools)
+            incremental.append(seconds)
+
+            warm = tool_call._tool_state_machines.copy()
+            tool_call._tool_state_machines.clear()
+            seconds, cold_compiled = build(base_tools + new_tools)
+            cold.append(seconds)
+            tool_call._tool_state_machines.clear()
+            tool_call._tool_state_machines.update(warm)
+
+        print(
+            f"{added:>6} {statistics.median(incremental):>11.3f}s {incremental_compiled:>9} "
+            f"{statistics.median(cold):>8.3f}s {cold_compiled:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Tests for the token id stream of the torch frontend, with a stubbed model.
+
+They check the contract the MLX frontend's `inference` also follows:
+token ids are yielded as ints, stop tokens are not yielded, generation stops once
+the engine reaches an accept state, closing the generator stops generation,
+and errors raised while generating reach the consumer.
+"""
+
+import threading
+from collections.abc import Callable, Iterator
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("pse.structuring_engine")
+
+from agent.llm.frontend.torch import PSE_Torch, TorchInference  # noqa: E402
+
+EOS = 2
+TIMEOUT = 5.0
+
+
+class StubModel(PSE_Torch):
+    """
+    Emulates `generate`: the prompt is put first, then one token per step,
+    until the stopping criteria hold or the script runs out.
+    """
+
+    device = torch.device("cpu")
+
+    def __init__(self, script: Callable[[int], int]) -> None:
+        torch.nn.Module.__init__(self)
+        self.script = script
+        self.steps = 0
+
+    def generate(self, inputs, streamer, stopping_criteria, max_new_tokens=None, **kwargs):
+        streamer.put(inputs)
+        while max_new_tokens is None or self.steps < max_new_tokens:
+            token_id = self.script(self.steps)
+            self.steps += 1
+            streamer.put(torch.tensor([token_id]))
+            if token_id == EOS or stopping_criteria(inputs, None).all():
+                break
+        streamer.end()
+
+
+def make_frontend(script: Callable[[int], int]) -> TorchInference:
+    frontend = TorchInference.__new__(TorchInference)
+    frontend.model = StubModel(script)
+    frontend.tokenizer = SimpleNamespace(stop_tokens=frozenset({EOS}))
+    frontend.cache = None
+    frontend.processed_token_ids = []
+    return frontend
+
+
+def make_engine() -> SimpleNamespace:
+    return SimpleNamespace(has_reached_accept_state=False)
+
+
+def consume(tokens: Iterator[int], limit: int | None = None) -> tuple[list[int], Exception | None]:
+    """
+    Consume the stream on a thread, failing instead of hanging if it never ends.
+    """
+    result: dict = {"tokens": [], "error": None}
+
+    def run() -> None:
+        try:
+            for token_id in tokens:
+                result["tokens"].append(token_id)
+                if limit is not None and len(result["tokens"]) >= limit:
+                    break
+        except Exception as e:
+            result["error"] = e
+        finally:
+            tokens.close()  # type: ignore[attr-defined]
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    assert not thread.is_alive(), "the token stream did not end"
+    return result["tokens"], result["error"]
+
+
+def test_yields_token_ids_until_a_stop_token():
+    frontend = make_frontend(lambda step: [5, 6, 7, EOS][step])
+    tokens, error = consume(frontend.inference([1, 3, 4], make_engine()))
+
+    assert error is None
+    assert tokens == [5, 6, 7]
+    assert all(isinstance(token_id, int) for token_id in tokens)
+
+
+def test_stops_once_the_engine_accepts():
+    engine = make_engine()
+
+    def script(step: int) -> int:
+        engine.has_reached_accept_state = step == 2
+        return 10 + step
+
+    frontend = make_frontend(script)
+    tokens, error = consume(frontend.inference([1], engine))
+
+    assert error is None
+    assert tokens == [10, 11, 12]
+
+
+def test_closing_the_stream_stops_generation():
+    frontend = make_frontend(lambda step: 10 + step % 50)
+    tokens, error = consume(frontend.inference([1], make_engine(), stream_queue_size=4), limit=3)
+
+    assert error is None
+    assert tokens == [10, 11, 12]
+    # the generate thread was joined, within a few steps of the queue filling up
+    assert frontend.model.steps < 3 + 4 + 2
+
+
+@pytest.mark.parametrize("failing_step", [0, 3])
+def test_generate_errors_reach_the_consumer(failing_step: int):
+    def script(step: int) -> int:
+        if step == failing_step:
+            raise RuntimeError("out of memory")
+        return 10 + step
+
+    frontend = make_frontend(script)
+    tokens, error = consume(frontend.inference([1], make_engine()))
+
+    assert isinstance(error, RuntimeError)
+    assert str(error) == "out of memory"
+    assert tokens == [10 + step for step in range(failing_step)]
+
+
+def test_a_reset_cache_is_started_again():
+    frontend = make_frontend(lambda step: EOS)
+    frontend.reset_cache()
+    assert frontend.cache is None
+
+    frontend._prepare_cache([1, 3, 4], reuse_prompt_cache=True)
+    assert frontend.cache is not None
+    assert frontend.cache.get_seq_length() == 0
+    assert frontend.processed_token_ids == []
+
+
+def test_a_reset_cache_can_be_saved(tmp_path):
+    frontend = make_frontend(lambda step: EOS)
+    frontend.reset_cache()
+    frontend.save_cache_to_file(str(tmp_path / "checkpoint.safetensors"), [], {"agent": "test"})
+
+    assert TorchInference.read_cache_metadata(str(tmp_path / "checkpoint.safetensors"))["agent"] == "test"
+
+
+
+def test_checkpoint_tensors_are_memory_mapped(tmp_path):
+    from safetensors.torch import save_file
+
+    from agent.llm.frontend.torch import _map_safetensors
+
+    keys, values = torch.randn(1, 2, 3, 4), torch.randn(1, 2, 3, 4).to(torch.bfloat16)
+    path = str(tmp_path / "checkpoint.safetensors")
+    save_file(
+        {"layers.0.keys": keys, "layers.0.values": values, "layers.1.keys": torch.empty(0)},
+        path,
+        metadata={"computed_ids": "[1, 3, 4]"},
+    )
+
+    tensors, metadata = _map_safetensors(path)
+    assert metadata == {"computed_ids": "[1, 3, 4]"}
+    assert torch.equal(tensors["layers.0.keys"], keys)
+    assert torch.equal(tensors["layers.0.values"], values)
+    assert tensors["layers.0.values"].dtype == torch.bfloat16
+    assert tensors["layers.1.keys"].numel() == 0
+
+    # the mapping is copy-on-write
+    tensors["layers.0.keys"].zero_()
+    assert torch.equal(_map_safetensors(path)[0]["layers.0.keys"], keys)
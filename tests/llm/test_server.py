@@ -0,0 +1,167 @@
+"""
+Tests of the inference server and its client, with fake inference sessions in place of a model.
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from contextlib import aclosing
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+pytest.importorskip("pse.structuring_engine")
+
+from agent.llm import remote, server
+from agent.llm.remote import RemoteInference
+from agent.llm.server import InferenceClient, InferenceServer
+
+
+class FakeEngine:
+    def __init__(self) -> None:
+        self.tokens = 0
+
+    def reset(self) -> None:
+        self.tokens = 0
+
+    def get_live_structured_output(self) -> tuple[str, str]:
+        return "thinking", "x" * self.tokens
+
+    def get_stateful_structured_output(self) -> list[tuple[str, Any]]:
+        return [("thinking", "x" * self.tokens)]
+
+
+class FakeSession:
+    """
+    Stands in for a `LocalInference` session, generating a fixed number of tokens slowly.
+    """
+
+    def __init__(self, tokens: int = 20, delay: float = 0.005) -> None:
+        self.tokens = tokens
+        self.delay = delay
+        self.engine = FakeEngine()
+        self.front_end = SimpleNamespace(
+            tokenizer=SimpleNamespace(delimiters={}),
+            supports_forking=lambda: True,
+        )
+        self.configured_on: list[str] = []
+        self.model_path = "fake"
+
+    def fork(self) -> "FakeSession":
+        return FakeSession(self.tokens, self.delay)
+
+    def configure(self, state_machine: Any) -> None:
+        self.configured_on.append(threading.current_thread().name)
+
+    def run_inference(self, prompt: Any, **kwargs):
+        for token_id in range(self.tokens):
+            time.sleep(self.delay)
+            self.engine.tokens += 1
+            yield token_id
+
+
+@pytest.fixture
+def socket_path(monkeypatch):
+    monkeypatch.setattr(
+        server.STATE_MACHINE_CACHE,
+        "get",
+        lambda **kwargs: (SimpleNamespace(states={"thinking": None}, prompt="", options=kwargs), ""),
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        yield os.path.join(directory, "inference.sock")
+
+
+async def serve(socket_path: str) -> tuple[InferenceServer, asyncio.Task]:
+    inference_server = InferenceServer(FakeSession(), socket_path)  # type: ignore[arg-type]
+    task = asyncio.create_task(inference_server.serve())
+    while not os.path.exists(socket_path):
+        await asyncio.sleep(0.01)
+    return inference_server, task
+
+
+async def stop(task: asyncio.Task) -> None:
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def test_sessions_generate_concurrently_and_configure_on_the_scheduler(socket_path):
+    async def run() -> None:
+        inference_server, task = await serve(socket_path)
+        client = InferenceClient(socket_path)
+        await client.connect()
+        try:
+            sessions = [await client.open_session() for _ in range(2)]
+            for session_id in sessions:
+                reply = await client.configure_session(session_id, tools=[{"name": "a", "schema": {}}])
+                assert reply["states"] == ["thinking"]
+
+            async def generate(session_id: str) -> list[dict[str, Any]]:
+                return [event async for event in client.generate(session_id, [])]
+
+            results = await asyncio.gather(*(generate(session_id) for session_id in sessions))
+            for events in results:
+                assert [event["token"] for event in events[:-1]] == list(range(20))
+                assert events[-1]["output"] == [["thinking", "x" * 20]]
+            for session_id in sessions:
+                assert inference_server.sessions[session_id].configured_on == ["inference-scheduler"]
+        finally:
+            await client.close()
+            await stop(task)
+
+    asyncio.run(run())
+
+
+def test_closing_a_stream_early_cancels_the_generation(socket_path):
+    async def run() -> None:
+        inference_server, task = await serve(socket_path)
+        client = InferenceClient(socket_path)
+        await client.connect()
+        try:
+            session_id = await client.open_session()
+            async with aclosing(client.generate(session_id, [])) as events:
+                async for event in events:
+                    assert event["token"] == 0
+                    break
+            assert not inference_server.is_generating(session_id)
+
+            # the session can generate again, without leftover events
+            events = [event async for event in client.generate(session_id, [])]
+            assert events[0]["token"] == 0
+            assert events[-1]["done"]
+        finally:
+            await client.close()
+            await stop(task)
+
+    asyncio.run(run())
+
+
+def test_remote_inference_streams_like_local_inference(socket_path, monkeypatch):
+    monkeypatch.setattr(remote.Tokenizer, "load", lambda model_path: SimpleNamespace())
+
+    async def run() -> None:
+        _, task = await serve(socket_path)
+        inference = RemoteInference("fake", socket_path)
+        try:
+            inference.configure(SimpleNamespace(options={"tools": [], "delimiters_kwargs": {}}))  # type: ignore[arg-type]
+            inference.engine.reset()
+            tokens = [token_id async for token_id, _ in inference.stream_inference([])]
+            assert tokens == list(range(20))
+            assert inference.engine.get_stateful_structured_output() == [("thinking", "x" * 20)]
+
+            inference.engine.reset()
+            stream = inference.stream_inference([])
+            async for _, live_output in stream:
+                assert live_output == ("thinking", "x")
+                inference.cancel()
+            assert inference.engine.get_stateful_structured_output() == []
+        finally:
+            await inference.close()
+            await stop(task)
+
+    asyncio.run(run())
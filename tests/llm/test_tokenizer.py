@@ -0,0 +1,72 @@
+"""
+Tests of the tokenizer wrapper and the vocabulary masks, with a tiny word-level tokenizer.
+"""
+
+import pytest
+
+pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from transformers import PreTrainedTokenizerFast  # noqa: E402
+
+from agent.llm.tokenizer import Tokenizer  # noqa: E402
+from agent.llm.vocabulary import MASKS_FILE_NAME, VocabularyMasks  # noqa: E402
+
+SPECIAL_TOKENS = ["<|im_start|>", "<|im_end|>", "<tool_call>", "</tool_call>"]
+WORDS = ["[UNK]", "hello", "world", "tool", "to", "ol"]
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    vocabulary = {token: token_id for token_id, token in enumerate(WORDS + SPECIAL_TOKENS)}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocabulary, unk_token="[UNK]"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        unk_token="[UNK]",
+        eos_token="<|im_end|>",
+        additional_special_tokens=SPECIAL_TOKENS,
+    )
+    tokenizer.save_pretrained(tmp_path)
+    return tmp_path
+
+
+def test_control_token_data_is_encoded_once_and_read_only(model_path):
+    tokenizer = Tokenizer.load(model_path)
+
+    assert tokenizer.stop_tokens == frozenset({len(WORDS) + SPECIAL_TOKENS.index("<|im_end|>")})
+    assert tokenizer.stop_tokens is tokenizer.stop_tokens
+    assert tokenizer.delimiters["tool_call"] == ("<tool_call>", "</tool_call>")
+    assert tokenizer.delimiter_token_ids["tool_call"] == (
+        (len(WORDS) + SPECIAL_TOKENS.index("<tool_call>"),),
+        (len(WORDS) + SPECIAL_TOKENS.index("</tool_call>"),),
+    )
+    with pytest.raises(TypeError):
+        tokenizer.delimiters["tool_call"] = None  # type: ignore[index]
+
+
+def test_without_control_tokens_nothing_stops_generation(model_path):
+    tokenizer = Tokenizer(PreTrainedTokenizerFast.from_pretrained(model_path))
+
+    assert tokenizer.stop_tokens == frozenset()
+    assert tokenizer.delimiter_token_ids == {}
+    with pytest.raises(ValueError):
+        tokenizer.delimiters  # noqa: B018
+
+
+def test_vocabulary_masks_are_persisted_and_reloaded(model_path, tmp_path):
+    tokenizer = Tokenizer.load(model_path)
+    cache_directory = tmp_path / "cache"
+
+    masks = VocabularyMasks.build(tokenizer, cache_directory, delimiters=["tool\n"])
+    assert (cache_directory / MASKS_FILE_NAME).exists()
+    # "to" and "tool" start the delimiter, "ol" continues it after "to"
+    assert masks.continuation_mask("", ["tool\n"]) is None
+    continuation = masks.continuation_mask("to", ["tool\n"])
+    assert continuation is not None
+    assert [masks.token_texts[i] for i in continuation.nonzero()[0]] == ["ol"]
+
+    reloaded = VocabularyMasks.load(cache_directory / MASKS_FILE_NAME, masks.fingerprint)
+    assert reloaded is not None
+    assert (reloaded.table("tool\n") == masks.table("tool\n")).all()
+    assert VocabularyMasks.load(cache_directory / MASKS_FILE_NAME, "another vocabulary") is None
@@ -0,0 +1,178 @@
+"""
+Soak test of the agent loop: thousands of synthetic turns with a fake inference backend.
+
+Every turn is a user message answered with one `send_message` tool call, driven by
+`Agent.loop` as in a real session. With a bounded context window, memory use has to stay
+flat once the window is full; growth means the loop or memory keeps something alive per turn.
+
+The number of turns can be raised with the `SOAK_TURNS` environment variable.
+"""
+
+import asyncio
+import gc
+import io
+import os
+import sys
+from collections.abc import AsyncIterator
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+pytest.importorskip("pse.structuring_engine")
+if not sys.platform.startswith("linux"):
+    pytest.skip("resident memory is read from /proc", allow_module_level=True)
+
+# no keyboard listener is started, but importing pynput needs a backend
+os.environ.setdefault("PYNPUT_BACKEND", "dummy")
+
+from rich.console import Console
+
+from agent.agent import Agent
+from agent.interface import Interface
+from agent.system.interaction import Interaction
+
+TURNS = int(os.environ.get("SOAK_TURNS", "3000"))
+WARMUP_TURNS = 300
+CONTEXT_WINDOW_TOKENS = 8000
+MAX_RSS_GROWTH_BYTES = 4 * 1024**2
+
+
+def resident_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class FakeEngine:
+    """
+    Always produces a `send_message` call answering the user.
+    """
+
+    def reset(self) -> None:
+        pass
+
+    def get_live_structured_output(self) -> None:
+        return None
+
+    def get_stateful_structured_output(self) -> list[tuple[str, Any]]:
+        return [
+            (
+                "tool_call",
+                {
+                    "intention": "Answer the user's message.",
+                    "name": "send_message",
+                    "arguments": {"message": "A synthetic reply. " * 10},
+                },
+            )
+        ]
+
+
+class FakeInference:
+    """
+    Stands in for `LocalInference`, streaming a fixed number of tokens per step.
+    """
+
+    def __init__(self, tokens_per_step: int = 64) -> None:
+        self.tokens_per_step = tokens_per_step
+        self.engine = FakeEngine()
+        self.front_end = SimpleNamespace(
+            tokenizer=SimpleNamespace(
+                delimiters={},
+                encode=lambda text, **kwargs: list(range(len(text) // 4)),
+            ),
+            supports_forking=lambda: True,
+        )
+
+    def configure(self, state_machine: Any) -> None:
+        pass
+
+    async def stream_inference(self, prompt: list[dict[str, Any]], **kwargs) -> AsyncIterator[tuple[int, Any]]:
+        for token_id in range(self.tokens_per_step):
+            yield token_id, (None, [])
+
+    def count_tokens(self, interaction: dict[str, Any]) -> int:
+        return len(str(interaction.get("content", ""))) // 4 + len(str(interaction.get("tool_result", ""))) // 4 + 1
+
+    def prefill(self, prompt: list[dict[str, Any]], placeholder: str, **kwargs) -> None:
+        pass
+
+    def cache_prompt_prefix(self, **kwargs) -> None:
+        pass
+
+    def cancel(self) -> None:
+        pass
+
+
+class ScriptedInterface(Interface):
+    """
+    Sends numbered user messages, samples resident memory, and exits after the last turn.
+    """
+
+    def __init__(self, turns: int, warmup_turns: int) -> None:
+        self.console = Console(file=io.StringIO())
+        self.turns = turns
+        self.warmup_turns = warmup_turns
+        self.sent = 0
+        self.rss_after_warmup = 0
+        self.rss_at_end = 0
+
+    async def get_input(self, **kwargs) -> Interaction | None:  # type: ignore[override]
+        if self.sent == self.warmup_turns:
+            self.rss_after_warmup = self._sample()
+        if self.sent == self.turns:
+            self.rss_at_end = self._sample()
+            return None
+        self.sent += 1
+        return Interaction(role=Interaction.Role.USER, content=f"Synthetic message number {self.sent}.")
+
+    async def show_output(self, output: object | list[object]) -> None:
+        pass
+
+    def show_live_output(self, state: Any, output: object) -> None:
+        pass
+
+    def end_live_output(self) -> None:
+        pass
+
+    async def render_image(self, image_url: str) -> None:
+        pass
+
+    async def exit_program(self, error: Exception | None = None) -> None:
+        pass
+
+    async def clear(self) -> None:
+        pass
+
+    @staticmethod
+    def _sample() -> int:
+        gc.collect()
+        return resident_bytes()
+
+
+def test_resident_memory_stays_flat_over_a_long_session():
+    interface = ScriptedInterface(WARMUP_TURNS + TURNS, WARMUP_TURNS)
+    agent = Agent(
+        "soak",
+        "base",
+        interface,
+        FakeInference(),  # type: ignore[arg-type]
+        tools=["send_message"],
+        include_pause_button=False,
+        context_window_tokens=CONTEXT_WINDOW_TOKENS,
+    )
+
+    async def run() -> None:
+        try:
+            await agent.loop()
+        finally:
+            await agent.shutdown()
+
+    asyncio.run(run())
+
+    assert agent.turn_number == WARMUP_TURNS + TURNS
+    assert agent.context_window is not None
+    assert agent.context_window.evictions > 0
+    assert agent.context_window.window_tokens <= CONTEXT_WINDOW_TOKENS
+    growth = interface.rss_at_end - interface.rss_after_warmup
+    assert growth < MAX_RSS_GROWTH_BYTES, f"resident memory grew by {growth / 1024**2:.1f} MB over {TURNS} turns"